@@ -0,0 +1 @@
+"""Benchmarks of the MQTT adapter, run with ``python -m benchmarks`` from ``src``"""
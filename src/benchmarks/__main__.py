@@ -0,0 +1,132 @@
+"""
+Command line entry point of the benchmark suite.
+
+    cd src
+    python -m benchmarks run --rates 500,2000 --duration 10 --output results.json
+    python -m benchmarks compare baseline.json results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+import yaml
+
+from .harness import SCENARIOS, run_benchmarks
+
+def _parse_option(value: str) -> Tuple[str, Any]:
+    """Parse a key=value broker option, the value is read as YAML"""
+    key, _, raw = value.partition('=')
+    if not key or not raw:
+        raise argparse.ArgumentTypeError(f"Expected key=value, got {value!r}")
+    return key, yaml.safe_load(raw)
+
+def _default_output(report: Dict[str, Any]) -> str:
+    stamp = report["meta"]["timestamp"].replace(':', '').replace('-', '')
+    commit = report["meta"]["commit"] or 'unknown'
+    return os.path.join('benchmark-results', f"{stamp}-{commit}.json")
+
+def run(args: argparse.Namespace) -> int:
+    scenarios = args.scenarios.split(',')
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            print(f"Unknown scenario {scenario!r}, choose from {', '.join(SCENARIOS)}", file=sys.stderr)
+            return 2
+
+    report = asyncio.run(run_benchmarks(
+        scenarios=scenarios,
+        rates=[float(rate) for rate in args.rates.split(',')],
+        duration=args.duration,
+        warmup=args.warmup,
+        broker_options=dict(args.set),
+        responder_delay=args.responder_delay,
+        payload_size=args.payload_size,
+        request_timeout=args.timeout,
+        http_connections=args.http_connections,
+        qos=args.qos
+    ))
+
+    output = args.output or _default_output(report)
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return 0
+
+def _change(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+def compare(args: argparse.Namespace) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    baseline_results = {(r["scenario"], r["target_rate"]): r for r in baseline["results"]}
+    print(f"baseline {baseline['meta'].get('commit')}  candidate {candidate['meta'].get('commit')}")
+    print(f"{'scenario':<13} {'rate':>8} {'metric':<22} {'baseline':>10} {'candidate':>10} {'change':>8}")
+
+    regressions = 0
+    for result in candidate["results"]:
+        before = baseline_results.get((result["scenario"], result["target_rate"]))
+        if before is None:
+            continue
+        metrics = [
+            ("throughput_per_s", before["throughput_per_s"], result["throughput_per_s"], False),
+            ("p50_ms", before["latency_ms"]["p50"], result["latency_ms"]["p50"], True),
+            ("p99_ms", before["latency_ms"]["p99"], result["latency_ms"]["p99"], True),
+            ("p999_ms", before["latency_ms"]["p999"], result["latency_ms"]["p999"], True),
+            ("adapter_us_per_message", before["cpu"].get("adapter_us_per_message"),
+             result["cpu"].get("adapter_us_per_message"), True),
+        ]
+        for name, old, new, lower_is_better in metrics:
+            change = _change(old, new)
+            flag = ''
+            if change is not None and args.threshold is not None:
+                worse = change > args.threshold if lower_is_better else change < -args.threshold
+                if worse:
+                    regressions += 1
+                    flag = '  REGRESSION'
+            change_text = f"{change:+.1f}%" if change is not None else 'n/a'
+            print(f"{result['scenario']:<13} {result['target_rate']:>8.0f} {name:<22} {old!s:>10} {new!s:>10} {change_text:>8}{flag}")
+
+    return 1 if regressions else 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='MQTT adapter benchmark suite')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the benchmarks and write a JSON report')
+    run_parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f"Comma separated scenarios ({', '.join(SCENARIOS)})")
+    run_parser.add_argument('--rates', default='500', help='Comma separated request rates per second')
+    run_parser.add_argument('--duration', type=float, default=10.0, help='Seconds measured per scenario and rate')
+    run_parser.add_argument('--warmup', type=float, default=1.0, help='Seconds of unmeasured load before each run')
+    run_parser.add_argument('--set', type=_parse_option, action='append', default=[], metavar='KEY=VALUE',
+                            help='Broker option applied to both adapter brokers, e.g. network_loop=asyncio')
+    run_parser.add_argument('--responder-delay', type=float, default=0.0, help='Seconds the responder waits before replying')
+    run_parser.add_argument('--payload-size', type=int, default=64, help='Bytes of filler in each payload')
+    run_parser.add_argument('--timeout', type=float, default=10.0, help='Seconds before a request counts as timed out')
+    run_parser.add_argument('--http-connections', type=int, default=256, help='Maximum HTTP connections to the adapter')
+    run_parser.add_argument('--qos', type=int, choices=[0, 1], default=1, help='QoS of all MQTT traffic')
+    run_parser.add_argument('--output', help='Report path, benchmark-results/<time>-<commit>.json by default')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float,
+                                help='Exit with 1 if a metric gets worse by more than this many percent')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    return args.handler(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
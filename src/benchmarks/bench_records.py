@@ -0,0 +1,142 @@
+"""
+Micro-benchmark of the per-message objects built on the hot path.
+
+Compares the validated pydantic models that used to be built for every
+message with the lightweight records used now:
+
+    python3 src/benchmarks/bench_records.py --iterations 200000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqtt_adapter.models import (  # noqa: E402
+    HTTPRequest,
+    HTTPResponse,
+    MQTTRequest,
+    MQTTResponse,
+    RequestRecord,
+    ResponseRecord,
+)
+
+PAYLOAD = {"message": "Hello from HTTP to MQTT bridge!", "timestamp": 1700000000.0}
+HEADERS = {"Content-Type": "application/json", "X-Correlation-ID": str(uuid.uuid4())}
+CORRELATION_ID = str(uuid.uuid4())
+
+def models_http_round_trip():
+    """Objects built per HTTP request/response before: four validated models"""
+    http_request = HTTPRequest(
+        method="POST",
+        path="/api/internet 2/requests/device",
+        headers=HEADERS,
+        body={"is_request": True, "payload": PAYLOAD},
+        identifier="internet 2",
+        request_topic="requests/device"
+    )
+    mqtt_request = MQTTRequest(
+        topic=http_request.request_topic,
+        payload=PAYLOAD,
+        correlation_id=CORRELATION_ID,
+        target_broker_id=http_request.identifier,
+        is_response=True
+    )
+    mqtt_response = MQTTResponse(status_code=200, payload=PAYLOAD, correlation_id=mqtt_request.correlation_id)
+    return HTTPResponse(
+        status_code=mqtt_response.status_code,
+        headers={"X-Correlation-ID": mqtt_response.correlation_id},
+        body=mqtt_response.payload
+    )
+
+def records_http_round_trip():
+    """Objects built per HTTP request/response now: one request and one response record"""
+    request = RequestRecord("requests/device", PAYLOAD, CORRELATION_ID, "internet 2", True)
+    return ResponseRecord(200, PAYLOAD, request.correlation_id)
+
+def models_mqtt_message():
+    """Object built per forwarded MQTT message before"""
+    return MQTTRequest(
+        topic="requests/device",
+        payload=PAYLOAD,
+        correlation_id=CORRELATION_ID,
+        target_broker_id="internet 2",
+        is_response=False
+    )
+
+def records_mqtt_message():
+    """Object built per forwarded MQTT message now"""
+    return RequestRecord("requests/device", PAYLOAD, CORRELATION_ID, "internet 2", False)
+
+CASES = [
+    ("http_round_trip", models_http_round_trip, records_http_round_trip),
+    ("mqtt_message", models_mqtt_message, records_mqtt_message),
+]
+
+def measure_cpu(func, iterations: int) -> float:
+    """CPU microseconds per call"""
+    gc.collect()
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) * 1e6 / iterations
+
+def measure_memory(func, iterations: int):
+    """Bytes retained per call by the objects it returns"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        results = [func() for _ in range(iterations)]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    retained = (after - before) / iterations
+    del results
+    return retained
+
+def run(iterations: int):
+    report = {"python": sys.version.split()[0], "iterations": iterations, "cases": {}}
+    for name, before, after in CASES:
+        # Warm up both code paths
+        for func in (before, after):
+            for _ in range(1000):
+                func()
+        report["cases"][name] = {
+            "before": {
+                "cpu_us": measure_cpu(before, iterations),
+                "retained_bytes": measure_memory(before, min(iterations, 20000)),
+            },
+            "after": {
+                "cpu_us": measure_cpu(after, iterations),
+                "retained_bytes": measure_memory(after, min(iterations, 20000)),
+            },
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark hot path message objects')
+    parser.add_argument('--iterations', type=int, default=100000, help='Calls per measurement')
+    parser.add_argument('--json', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    report = run(args.iterations)
+
+    print(f"{'case':<18} {'variant':<8} {'cpu us/msg':>11} {'bytes/msg':>10}")
+    for name, variants in report["cases"].items():
+        for variant, result in variants.items():
+            print(f"{name:<18} {variant:<8} {result['cpu_us']:>11.2f} {result['retained_bytes']:>10.0f}")
+        speedup = variants["before"]["cpu_us"] / variants["after"]["cpu_us"]
+        print(f"{name:<18} {'speedup':<8} {speedup:>10.1f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Micro-benchmark of the topic routing table.
+
+Compares matching a topic against the compiled topic trie with a linear scan
+of the same filters with paho's topic_matches_sub, for growing rule counts:
+
+    python3 src/benchmarks/bench_routing.py --rules 10,100,1000,10000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqtt_adapter.models import RouteConfig  # noqa: E402
+from mqtt_adapter.protocols.routing import TopicTrie, compile_route  # noqa: E402
+
+def make_filters(count: int, rng: random.Random):
+    """Topic filters shaped like device routes: site/+/kind, site/device/#, ..."""
+    filters = []
+    for index in range(count):
+        site, device = f"site{index % 97}", f"device{index}"
+        shape = index % 4
+        if shape == 0:
+            filters.append(f"{site}/+/temp")
+        elif shape == 1:
+            filters.append(f"{site}/{device}/#")
+        elif shape == 2:
+            filters.append(f"{site}/{device}/+/state")
+        else:
+            filters.append(f"{site}/{device}/status")
+    rng.shuffle(filters)
+    return filters
+
+def make_topics(count: int, rng: random.Random, samples: int = 1000):
+    """Topics of the messages, about half of them match a route"""
+    topics = []
+    for _ in range(samples):
+        index = rng.randrange(count * 2)
+        topics.append(rng.choice([
+            f"site{index % 97}/device{index}/temp",
+            f"site{index % 97}/device{index}/relay/state",
+            f"site{index % 97}/device{index}/status",
+        ]))
+    return topics
+
+def build_trie(filters) -> TopicTrie:
+    return TopicTrie(compile_route(RouteConfig(source="a", topic=f, target="b")) for f in filters)
+
+def measure(func, topics, iterations: int) -> float:
+    """CPU microseconds per matched topic"""
+    gc.collect()
+    start = time.process_time()
+    done = 0
+    while done < iterations:
+        for topic in topics:
+            func(topic)
+        done += len(topics)
+    return (time.process_time() - start) * 1e6 / done
+
+def run(rule_counts, iterations: int, seed: int):
+    report = {"python": sys.version.split()[0], "iterations": iterations, "rules": {}}
+    for count in rule_counts:
+        rng = random.Random(seed)
+        filters = make_filters(count, rng)
+        topics = make_topics(count, rng)
+        trie = build_trie(filters)
+
+        def linear(topic, filters=filters):
+            return [f for f in filters if topic_matches_sub(f, topic)]
+
+        # The linear scan is O(rules), cap its iterations so large tables finish
+        linear_iterations = max(len(topics), min(iterations, iterations * 100 // count))
+        report["rules"][count] = {
+            "trie_us": measure(trie.match, topics, iterations),
+            "linear_us": measure(linear, topics, linear_iterations),
+            "matches": sum(len(trie.match(topic)) for topic in topics) / len(topics),
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark topic routing match cost against the rule count')
+    parser.add_argument('--rules', default='10,100,1000,10000', help='Comma separated rule counts')
+    parser.add_argument('--iterations', type=int, default=100000, help='Topics matched per measurement')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated filters and topics')
+    parser.add_argument('--json', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    report = run([int(count) for count in args.rules.split(',')], args.iterations, args.seed)
+
+    print(f"{'rules':>7} {'trie us/msg':>12} {'linear us/msg':>14} {'speedup':>8} {'matches':>8}")
+    for count, result in report["rules"].items():
+        speedup = result["linear_us"] / result["trie_us"]
+        print(f"{count:>7} {result['trie_us']:>12.2f} {result['linear_us']:>14.2f} {speedup:>7.1f}x {result['matches']:>8.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
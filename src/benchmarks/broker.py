@@ -0,0 +1,321 @@
+"""
+Minimal in-process MQTT 3.1.1 and 5.0 broker used as a stand-in by the benchmarks.
+
+It supports what the adapter and the benchmark clients use: CONNECT,
+SUBSCRIBE/UNSUBSCRIBE with ``+``/``#`` wildcards and ``$share/<group>/``
+shared subscriptions, PUBLISH at QoS 0/1 (QoS 2 is acknowledged and
+delivered as QoS 1), PINGREQ and DISCONNECT. MQTT 5.0 PUBLISH properties
+(response topic, correlation data, user properties...) are passed on to 5.0
+subscribers and dropped for 3.1.1 ones, and incoming topic aliases are
+resolved. There are no retained messages, sessions, retries or other 5.0
+features such as flow control, so it stays out of the way of the
+measurements.
+"""
+import asyncio
+import logging
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+MQTT_V311, MQTT_V5 = 4, 5
+
+# Value sizes of the MQTT 5.0 properties by identifier: fixed byte counts, or
+# 'string'/'binary' (two byte length prefix), 'pair' (two strings) and 'varint'
+_PROPERTY_SIZES = {
+    0x01: 1, 0x02: 4, 0x03: 'string', 0x08: 'string', 0x09: 'binary', 0x0B: 'varint',
+    0x11: 4, 0x12: 'string', 0x13: 2, 0x15: 'string', 0x16: 'binary', 0x17: 1, 0x18: 4,
+    0x19: 1, 0x1A: 'string', 0x1C: 'string', 0x1F: 'string', 0x21: 2, 0x22: 2, 0x23: 2,
+    0x24: 1, 0x25: 1, 0x26: 'pair', 0x27: 4, 0x28: 1, 0x29: 1, 0x2A: 1,
+}
+TOPIC_ALIAS, SUBSCRIPTION_IDENTIFIER = 0x23, 0x0B
+
+def _encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+def _packet(first_byte: int, body: bytes) -> bytes:
+    return bytes((first_byte,)) + _encode_length(len(body)) + body
+
+def _read_string(data: bytes, offset: int) -> Tuple[str, int]:
+    length = struct.unpack_from('!H', data, offset)[0]
+    start = offset + 2
+    return data[start:start + length].decode('utf-8'), start + length
+
+def _read_length(data: bytes, offset: int) -> Tuple[int, int]:
+    multiplier, length = 1, 0
+    while True:
+        byte = data[offset]
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        offset += 1
+        if not byte & 0x80:
+            return length, offset
+
+def _read_properties(data: bytes, offset: int) -> Tuple[bytes, Optional[int], int]:
+    """
+    Read an MQTT 5.0 property block, giving the encoded properties to pass on
+    (without the topic alias and subscription identifiers), the topic alias
+    and the offset after the block
+    """
+    length, offset = _read_length(data, offset)
+    end = offset + length
+    kept = bytearray()
+    topic_alias = None
+    while offset < end:
+        start = offset
+        identifier = data[offset]
+        size = _PROPERTY_SIZES[identifier]
+        offset += 1
+        if size == 'varint':
+            _, offset = _read_length(data, offset)
+        elif size == 'pair':
+            offset += 2 + struct.unpack_from('!H', data, offset)[0]
+            offset += 2 + struct.unpack_from('!H', data, offset)[0]
+        elif isinstance(size, str):
+            offset += 2 + struct.unpack_from('!H', data, offset)[0]
+        else:
+            offset += size
+        if identifier == TOPIC_ALIAS:
+            topic_alias = struct.unpack_from('!H', data, start + 1)[0]
+        elif identifier != SUBSCRIPTION_IDENTIFIER:
+            kept += data[start:offset]
+    return bytes(kept), topic_alias, end
+
+def topic_matches(filter_levels: List[str], topic_levels: List[str]) -> bool:
+    """Check a topic against a subscription filter split on '/'"""
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+class _Subscription:
+    __slots__ = ('session', 'topic_filter', 'levels', 'qos', 'group')
+
+    def __init__(self, session: '_Session', topic_filter: str, qos: int):
+        self.session = session
+        self.topic_filter = topic_filter
+        self.group = None
+        if topic_filter.startswith('$share/'):
+            _, self.group, topic_filter = topic_filter.split('/', 2)
+        self.levels = topic_filter.split('/')
+        self.qos = min(qos, 1)
+
+class _Session(asyncio.Protocol):
+    """Connection of one client"""
+
+    def __init__(self, broker: 'MiniBroker'):
+        self.broker = broker
+        self.transport: Optional[asyncio.Transport] = None
+        self.client_id = ''
+        self.protocol_level = MQTT_V311
+        self._topic_aliases: Dict[int, str] = {}
+        self._buffer = bytearray()
+        self._next_packet_id = 0
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.broker.remove_session(self)
+
+    def write(self, data: bytes):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def next_packet_id(self) -> int:
+        self._next_packet_id = self._next_packet_id % 65535 + 1
+        return self._next_packet_id
+
+    def data_received(self, data: bytes):
+        self._buffer += data
+        while True:
+            # Fixed header: packet type and flags, then the variable length remaining length
+            if len(self._buffer) < 2:
+                return
+            multiplier, length, offset = 1, 0, 1
+            while True:
+                if offset >= len(self._buffer):
+                    return
+                byte = self._buffer[offset]
+                length += (byte & 0x7F) * multiplier
+                multiplier *= 128
+                offset += 1
+                if not byte & 0x80:
+                    break
+            end = offset + length
+            if len(self._buffer) < end:
+                return
+            first_byte = self._buffer[0]
+            body = bytes(self._buffer[offset:end])
+            del self._buffer[:end]
+            self._handle(first_byte >> 4, first_byte & 0x0F, body)
+
+    def _handle(self, packet_type: int, flags: int, body: bytes):
+        if packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topic, offset = _read_string(body, 0)
+            if qos:
+                packet_id = body[offset:offset + 2]
+                offset += 2
+                # A bare packet ID is a success acknowledgement in 5.0 as well
+                self.write(_packet(0x40 if qos == 1 else 0x50, packet_id))
+            properties = None
+            if self.protocol_level == MQTT_V5:
+                properties, topic_alias, offset = _read_properties(body, offset)
+                if topic_alias is not None:
+                    if topic:
+                        self._topic_aliases[topic_alias] = topic
+                    else:
+                        topic = self._topic_aliases[topic_alias]
+            self.broker.route(topic, body[offset:], qos, properties)
+        elif packet_type == PUBREL:
+            self.write(_packet(0x70, body[:2]))
+        elif packet_type == CONNECT:
+            self._handle_connect(body)
+        elif packet_type == SUBSCRIBE:
+            packet_id, offset, granted = body[:2], 2, bytearray()
+            if self.protocol_level == MQTT_V5:
+                _, _, offset = _read_properties(body, offset)
+                # Empty properties before the reason codes
+                granted.append(0)
+            while offset < len(body):
+                topic_filter, offset = _read_string(body, offset)
+                # The QoS is in the two low bits of the 5.0 subscription options
+                subscription = _Subscription(self, topic_filter, body[offset] & 0x03)
+                offset += 1
+                self.broker.subscribe(subscription)
+                granted.append(subscription.qos)
+            self.write(_packet(0x90, packet_id + bytes(granted)))
+        elif packet_type == UNSUBSCRIBE:
+            packet_id, offset, reasons = body[:2], 2, bytearray()
+            if self.protocol_level == MQTT_V5:
+                _, _, offset = _read_properties(body, offset)
+                reasons.append(0)
+            while offset < len(body):
+                topic_filter, offset = _read_string(body, offset)
+                self.broker.unsubscribe(self, topic_filter)
+                if self.protocol_level == MQTT_V5:
+                    reasons.append(0)
+            self.write(_packet(0xB0, packet_id + bytes(reasons)))
+        elif packet_type == PINGREQ:
+            self.write(_packet(0xD0, b''))
+        elif packet_type == DISCONNECT:
+            self.transport.close()
+        # PUBACK, PUBREC and PUBCOMP from clients need no answer without retries
+
+    def _handle_connect(self, body: bytes):
+        _, offset = _read_string(body, 0)
+        level = body[offset]
+        if level not in (MQTT_V311, MQTT_V5):
+            # Answer "unacceptable protocol version" in the 3.1.1 layout
+            self.write(_packet(0x20, b'\x00\x01'))
+            self.transport.close()
+            return
+        self.protocol_level = level
+        # Protocol level, connect flags and keep alive
+        offset += 4
+        if level == MQTT_V5:
+            _, _, offset = _read_properties(body, offset)
+        self.client_id, _ = _read_string(body, offset)
+        # Session present flag and return code, then empty properties in 5.0
+        self.write(_packet(0x20, b'\x00\x00\x00' if level == MQTT_V5 else b'\x00\x00'))
+
+class MiniBroker:
+    """MQTT broker stand-in listening on one port"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._subscriptions: List[_Subscription] = []
+        self._group_counters: Dict[Tuple[str, str], int] = {}
+        self.messages_routed = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: _Session(self), self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Benchmark broker listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def subscribe(self, subscription: _Subscription):
+        self.unsubscribe(subscription.session, subscription.topic_filter)
+        self._subscriptions.append(subscription)
+
+    def unsubscribe(self, session: _Session, topic_filter: str):
+        self._subscriptions = [
+            s for s in self._subscriptions if not (s.session is session and s.topic_filter == topic_filter)
+        ]
+
+    def remove_session(self, session: _Session):
+        self._subscriptions = [s for s in self._subscriptions if s.session is not session]
+
+    def route(self, topic: str, payload: bytes, qos: int, properties: Optional[bytes] = None):
+        """Deliver a message to every matching subscriber, and to one member of each shared group"""
+        self.messages_routed += 1
+        topic_levels = topic.split('/')
+        groups: Dict[Tuple[str, str], List[_Subscription]] = {}
+        delivered = set()
+        for subscription in self._subscriptions:
+            if not topic_matches(subscription.levels, topic_levels):
+                continue
+            if subscription.group is not None:
+                groups.setdefault((subscription.group, '/'.join(subscription.levels)), []).append(subscription)
+            elif subscription.session not in delivered:
+                delivered.add(subscription.session)
+                self._deliver(subscription, topic, payload, qos, properties)
+
+        for key, members in groups.items():
+            counter = self._group_counters.get(key, 0)
+            self._group_counters[key] = counter + 1
+            self._deliver(members[counter % len(members)], topic, payload, qos, properties)
+
+    def _deliver(self, subscription: _Subscription, topic: str, payload: bytes, qos: int, properties: Optional[bytes]):
+        qos = min(qos, subscription.qos)
+        encoded_topic = topic.encode('utf-8')
+        body = struct.pack('!H', len(encoded_topic)) + encoded_topic
+        if qos:
+            body += struct.pack('!H', subscription.session.next_packet_id())
+        if subscription.session.protocol_level == MQTT_V5:
+            properties = properties or b''
+            body += _encode_length(len(properties)) + properties
+        subscription.session.write(_packet(0x30 | (qos << 1), body + payload))
+
+class BrokerThread:
+    """Runs broker stand-ins on their own event loop thread"""
+
+    def __init__(self, count: int = 1, host: str = '127.0.0.1'):
+        self.brokers = [MiniBroker(host) for _ in range(count)]
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='benchmark-broker', daemon=True)
+
+    def start(self) -> List[MiniBroker]:
+        self._thread.start()
+        for broker in self.brokers:
+            asyncio.run_coroutine_threadsafe(broker.start(), self._loop).result()
+        return self.brokers
+
+    def stop(self):
+        for broker in self.brokers:
+            asyncio.run_coroutine_threadsafe(broker.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
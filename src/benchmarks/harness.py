@@ -0,0 +1,424 @@
+"""
+Benchmark harness: starts two broker stand-ins, the adapter in its own
+process and a responder, then drives the adapter at fixed open-loop rates.
+
+Topology::
+
+    edge broker  <->  adapter  <->  core broker  <->  responder
+
+Scenarios:
+
+* ``http_rrp``: HTTP request/response, POST /api/core/bench/rrp answered by the responder
+* ``mqtt_forward``: MQTT to MQTT request/response, a client on the edge broker
+  asks for a forward to the core broker and waits for the reply
+* ``http_ffg``: HTTP fire-and-forget, measured until the message is delivered
+  to a subscriber on the core broker
+* ``mqtt_route``: small telemetry messages published on the edge broker and
+  routed to the core broker by a declarative route, measured until delivered
+  to a subscriber there. Run it with ``--set publish_batch_delay=...`` (and
+  ``--set publish_batch_topic=...`` for batch envelopes) to measure publish batching
+"""
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+import paho.mqtt.client as mqtt
+import yaml
+
+from mqtt_adapter.protocols.batching import BATCH_PREFIX, unpack_batch
+
+from .broker import BrokerThread
+from .loadgen import RunResult, run_open_loop
+from .responder import Responder, _set_nodelay
+
+# psutil is optional, /proc is read directly on Linux without it
+try:
+    import psutil
+except ImportError:  # pragma: no cover - depends on the environment
+    psutil = None
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('http_rrp', 'mqtt_forward', 'http_ffg', 'mqtt_route')
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User plus system CPU time of a process, None if it can not be read"""
+    if psutil is not None:
+        times = psutil.Process(pid).cpu_times()
+        return times.user + times.system
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name may contain spaces, the fields start after its closing parenthesis
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class AdapterProcess:
+    """The adapter running from src/main.py in a child process"""
+
+    def __init__(self, config: Dict[str, Any], http_port: int, log_level: str = 'WARNING'):
+        self.config = config
+        self.http_port = http_port
+        self.log_level = log_level
+        self.url = f"http://127.0.0.1:{http_port}"
+        self._tempdir = tempfile.TemporaryDirectory(prefix='mqtt-adapter-bench-')
+        self.process: Optional[subprocess.Popen] = None
+
+    async def start(self, timeout: float = 30.0):
+        config_path = os.path.join(self._tempdir.name, 'config.yaml')
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(self.config, f)
+
+        env = dict(os.environ, HTTP_HOST='127.0.0.1', HTTP_PORT=str(self.http_port))
+        self.process = subprocess.Popen(
+            [
+                sys.executable, os.path.join(SRC_DIR, 'main.py'),
+                '--config', config_path,
+                '--log-level', self.log_level,
+                '--log-file', os.path.join(self._tempdir.name, 'adapter.log')
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL
+        )
+
+        # Ready once every broker connection is up
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"Adapter exited with code {self.process.returncode}")
+                try:
+                    async with session.get(f"{self.url}/health") as response:
+                        health = await response.json()
+                    if all(broker["connected"] for broker in health.get("admission", {}).values()):
+                        return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("Adapter did not become ready in time")
+
+    def cpu_seconds(self) -> Optional[float]:
+        return process_cpu_seconds(self.process.pid) if self.process else None
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._tempdir.cleanup()
+
+class MQTTClient:
+    """
+    Benchmark MQTT client resolving futures from the sequence number echoed
+    in replies. Messages received on ``batch_topic`` are batch envelopes and
+    resolve the futures of all the messages they carry
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        subscribe_topic: str,
+        loop: asyncio.AbstractEventLoop,
+        qos: int = 1,
+        batch_topic: Optional[str] = None
+    ):
+        self.loop = loop
+        self.qos = qos
+        self.subscribe_topic = subscribe_topic
+        self.batch_topic = batch_topic
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._connected = threading.Event()
+        self.client = mqtt.Client(client_id=f"bench-client-{uuid.uuid4().hex[:8]}")
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.on_socket_open = _set_nodelay
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+        if not self._connected.wait(10):
+            raise RuntimeError(f"Benchmark client could not connect to {host}:{port}")
+
+    def _on_connect(self, client, userdata, flags, rc):
+        client.subscribe(self.subscribe_topic, qos=self.qos)
+        if self.batch_topic is not None:
+            client.subscribe(self.batch_topic, qos=self.qos)
+        self._connected.set()
+
+    def _on_message(self, client, userdata, message):
+        if message.topic == self.batch_topic and message.payload.startswith(BATCH_PREFIX):
+            payloads = [payload for _, payload, _ in unpack_batch(message.payload)]
+        else:
+            payloads = [message.payload]
+        sequences = []
+        for payload in payloads:
+            try:
+                sequences.append(json.loads(payload).get('seq'))
+            except (ValueError, AttributeError):
+                continue
+        if sequences:
+            self.loop.call_soon_threadsafe(self._resolve, *sequences)
+
+    def _resolve(self, *sequences: int):
+        for sequence in sequences:
+            future = self._waiters.pop(sequence, None)
+            if future is not None and not future.done():
+                future.set_result(True)
+
+    def expect(self, sequence: int) -> asyncio.Future:
+        """Get the future completed when the message with this sequence number arrives"""
+        future = self.loop.create_future()
+        self._waiters[sequence] = future
+        return future
+
+    def forget(self, sequence: int):
+        self._waiters.pop(sequence, None)
+
+    def publish(self, topic: str, data: bytes):
+        self.client.publish(topic, data, qos=self.qos)
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+class BenchmarkHarness:
+    """Sets up the topology and runs the scenarios against it"""
+
+    def __init__(
+        self,
+        broker_options: Optional[Dict[str, Any]] = None,
+        responder_delay: float = 0.0,
+        payload_size: int = 64,
+        request_timeout: float = 10.0,
+        http_connections: int = 256,
+        qos: int = 1
+    ):
+        self.broker_options = broker_options or {}
+        self.responder_delay = responder_delay
+        self.payload_size = payload_size
+        self.request_timeout = request_timeout
+        self.http_connections = http_connections
+        self.qos = qos
+        self._brokers: Optional[BrokerThread] = None
+        self.adapter: Optional[AdapterProcess] = None
+        self._responder: Optional[Responder] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._clients: List[MQTTClient] = []
+        self.edge_port = self.core_port = 0
+
+    def adapter_config(self) -> Dict[str, Any]:
+        def broker(name: str, port: int, topics: List[str]) -> Dict[str, Any]:
+            return {
+                "host": "127.0.0.1",
+                "port": port,
+                "client_id": f"bench-adapter-{name}",
+                "qos": self.qos,
+                "subscribe_topics": topics,
+                **self.broker_options
+            }
+        return {
+            "brokers": {
+                "edge": broker("edge", self.edge_port, ["requests/#"]),
+                "core": broker("core", self.core_port, []),
+            },
+            "routes": [{"source": "edge", "topic": "telemetry/#", "target": "core"}],
+        }
+
+    async def start(self):
+        self._brokers = BrokerThread(count=2)
+        edge, core = self._brokers.start()
+        self.edge_port, self.core_port = edge.port, core.port
+
+        self._responder = Responder(
+            "127.0.0.1", self.core_port, topics=["bench/#", "requests/#"], delay=self.responder_delay, qos=self.qos
+        )
+        self._responder.start()
+
+        self.adapter = AdapterProcess(self.adapter_config(), _free_port())
+        await self.adapter.start()
+
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.http_connections),
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+        )
+
+    async def stop(self):
+        if self._session is not None:
+            await self._session.close()
+        for client in self._clients:
+            client.stop()
+        if self.adapter is not None:
+            self.adapter.stop()
+        if self._responder is not None:
+            self._responder.stop()
+        if self._brokers is not None:
+            self._brokers.stop()
+
+    def _payload(self, sequence: int) -> Dict[str, Any]:
+        return {"seq": sequence, "data": "x" * self.payload_size}
+
+    def _sender(self, scenario: str) -> Callable[[int], Awaitable[bool]]:
+        """Build the function sending one message of a scenario"""
+        loop = asyncio.get_running_loop()
+        run_id = uuid.uuid4().hex[:8]
+
+        if scenario == 'http_rrp':
+            url = f"{self.adapter.url}/api/core/bench/rrp"
+
+            async def send(sequence: int) -> bool:
+                body = json.dumps({"is_request": True, "payload": self._payload(sequence)})
+                headers = {"Content-Type": "application/json", "X-Correlation-ID": f"{run_id}-{sequence}"}
+                async with self._session.post(url, data=body, headers=headers) as response:
+                    await response.read()
+                    return response.status == 200
+            return send
+
+        if scenario == 'mqtt_forward':
+            reply_topic = f"bench-client/{run_id}"
+            client = MQTTClient("127.0.0.1", self.edge_port, reply_topic, loop, self.qos)
+            self._clients.append(client)
+
+            async def send(sequence: int) -> bool:
+                waiter = client.expect(sequence)
+                client.publish("requests/bench", json.dumps({
+                    "identifier": reply_topic,
+                    "correlation_id": f"{run_id}-{sequence}",
+                    "target_broker_id": "core",
+                    "is_response": True,
+                    "payload": self._payload(sequence)
+                }).encode('utf-8'))
+                try:
+                    return await asyncio.wait_for(waiter, self.request_timeout)
+                finally:
+                    client.forget(sequence)
+            return send
+
+        if scenario == 'http_ffg':
+            topic = f"ffg/{run_id}"
+            client = MQTTClient("127.0.0.1", self.core_port, topic, loop, self.qos)
+            self._clients.append(client)
+            url = f"{self.adapter.url}/api/core/{topic}"
+
+            async def send(sequence: int) -> bool:
+                waiter = client.expect(sequence)
+                body = json.dumps({"is_request": False, "payload": self._payload(sequence)})
+                try:
+                    async with self._session.post(url, data=body, headers={"Content-Type": "application/json"}) as response:
+                        await response.read()
+                        if response.status != 200:
+                            return False
+                    return await asyncio.wait_for(waiter, self.request_timeout)
+                finally:
+                    client.forget(sequence)
+            return send
+
+        if scenario == 'mqtt_route':
+            topic = f"telemetry/{run_id}"
+            publisher = MQTTClient("127.0.0.1", self.edge_port, f"bench-client/{run_id}", loop, self.qos)
+            subscriber = MQTTClient(
+                "127.0.0.1", self.core_port, topic, loop, self.qos, self.broker_options.get('publish_batch_topic')
+            )
+            self._clients.extend((publisher, subscriber))
+
+            async def send(sequence: int) -> bool:
+                waiter = subscriber.expect(sequence)
+                publisher.publish(topic, json.dumps(self._payload(sequence)).encode('utf-8'))
+                try:
+                    return await asyncio.wait_for(waiter, self.request_timeout)
+                finally:
+                    subscriber.forget(sequence)
+            return send
+
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    async def run_scenario(self, scenario: str, rate: float, duration: float, warmup: float = 1.0) -> Dict[str, Any]:
+        """Run one scenario at a fixed rate and summarize latency, throughput and CPU"""
+        send = self._sender(scenario)
+        if warmup > 0:
+            await run_open_loop(send, rate, warmup, drain_timeout=self.request_timeout)
+
+        adapter_cpu_before = self.adapter.cpu_seconds()
+        harness_cpu_before = time.process_time()
+        result: RunResult = await run_open_loop(send, rate, duration, drain_timeout=self.request_timeout)
+        adapter_cpu_after = self.adapter.cpu_seconds()
+        harness_cpu = time.process_time() - harness_cpu_before
+
+        summary = result.summary()
+        elapsed = max(result.finished_at - result.started_at, 1e-9)
+        cpu: Dict[str, Any] = {"harness_seconds": round(harness_cpu, 3)}
+        if adapter_cpu_before is not None and adapter_cpu_after is not None:
+            adapter_cpu = adapter_cpu_after - adapter_cpu_before
+            cpu["adapter_seconds"] = round(adapter_cpu, 3)
+            cpu["adapter_percent"] = round(adapter_cpu / elapsed * 100, 1)
+            if summary["completed"]:
+                cpu["adapter_us_per_message"] = round(adapter_cpu / summary["completed"] * 1e6, 1)
+        summary["cpu"] = cpu
+        return summary
+
+async def run_benchmarks(
+    scenarios: List[str],
+    rates: List[float],
+    duration: float,
+    warmup: float = 1.0,
+    **harness_options
+) -> Dict[str, Any]:
+    """Run every scenario at every rate and build the machine-readable report"""
+    harness = BenchmarkHarness(**harness_options)
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {
+            "duration_s": duration,
+            "warmup_s": warmup,
+            **harness_options,
+        },
+        "results": [],
+    }
+    await harness.start()
+    try:
+        report["adapter_config"] = harness.adapter_config()
+        for scenario in scenarios:
+            for rate in rates:
+                summary = await harness.run_scenario(scenario, rate, duration, warmup)
+                report["results"].append({"scenario": scenario, **summary})
+                latency = summary["latency_ms"]
+                print(
+                    f"{scenario:<13} rate {rate:>8.0f}/s  done {summary['throughput_per_s']:>9.1f}/s  "
+                    f"p50 {latency['p50']} ms  p99 {latency['p99']} ms  p999 {latency['p999']} ms  "
+                    f"errors {summary['errors']}  timeouts {summary['timeouts']}  "
+                    f"adapter cpu {summary['cpu'].get('adapter_percent')}%",
+                    flush=True
+                )
+    finally:
+        await harness.stop()
+    return report
@@ -0,0 +1,115 @@
+"""
+Open-loop load generation and latency statistics.
+
+Requests are started on a fixed schedule whatever the response times, and
+each latency is measured from the time the request was due rather than the
+time it was actually sent, so a stalled system is not hidden by the load
+generator slowing down with it (coordinated omission).
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+class RunResult:
+    """Outcome of one open-loop run"""
+
+    def __init__(self, rate: float, duration: float):
+        self.rate = rate
+        self.duration = duration
+        self.latencies: List[float] = []
+        self.sent = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.errors_by_type: Dict[str, int] = {}
+        self.started_at = 0.0
+        self.finished_at = 0.0
+
+    def record_error(self, kind: str):
+        self.errors += 1
+        self.errors_by_type[kind] = self.errors_by_type.get(kind, 0) + 1
+
+    def summary(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        elapsed = max(self.finished_at - self.started_at, 1e-9)
+
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "target_rate": self.rate,
+            "duration_s": self.duration,
+            "sent": self.sent,
+            "completed": len(latencies),
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "errors_by_type": self.errors_by_type,
+            "throughput_per_s": round(len(latencies) / elapsed, 1),
+            "latency_ms": {
+                "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+                "p50": ms(percentile(latencies, 0.50)),
+                "p90": ms(percentile(latencies, 0.90)),
+                "p99": ms(percentile(latencies, 0.99)),
+                "p999": ms(percentile(latencies, 0.999)),
+                "max": ms(latencies[-1]) if latencies else None,
+            },
+        }
+
+async def run_open_loop(
+    send: Callable[[int], Awaitable[bool]],
+    rate: float,
+    duration: float,
+    drain_timeout: float = 10.0,
+    tick: float = 0.001
+) -> RunResult:
+    """
+    Call send(sequence) rate times per second for duration seconds. send
+    returns True on success, False on an error response, and may raise
+    """
+    loop = asyncio.get_running_loop()
+    result = RunResult(rate, duration)
+    total = int(rate * duration)
+    pending = set()
+
+    async def timed(sequence: int, due: float):
+        try:
+            ok = await send(sequence)
+        except asyncio.TimeoutError:
+            result.timeouts += 1
+            return
+        except Exception as e:
+            result.record_error(type(e).__name__)
+            return
+        if ok:
+            result.latencies.append(loop.time() - due)
+        else:
+            result.record_error('error_response')
+
+    start = loop.time() + tick
+    result.started_at = time.perf_counter()
+    sequence = 0
+    while sequence < total:
+        now = loop.time()
+        # Start every request that is due, catching up if the loop fell behind
+        while sequence < total and start + sequence / rate <= now:
+            task = loop.create_task(timed(sequence, start + sequence / rate))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            sequence += 1
+        result.sent = sequence
+        next_due = start + sequence / rate
+        await asyncio.sleep(max(0.0, min(tick, next_due - loop.time())))
+
+    if pending:
+        done, still_pending = await asyncio.wait(set(pending), timeout=drain_timeout)
+        for task in still_pending:
+            task.cancel()
+        result.timeouts += len(still_pending)
+    result.finished_at = time.perf_counter()
+    return result
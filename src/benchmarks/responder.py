@@ -0,0 +1,117 @@
+"""
+Configurable responder for the benchmarks, answering requests the way
+``src/tools/response_server.py`` (MQTTListener) does, without its per-message
+logging.
+"""
+import heapq
+import json
+import socket
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import paho.mqtt.client as mqtt
+
+def _set_nodelay(client, userdata, sock):
+    """Disable Nagle's algorithm, paho leaves it on and small replies would wait for ACKs"""
+    if hasattr(sock, 'setsockopt'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+class Responder:
+    """
+    Subscribes to request topics and publishes each request's payload back to
+    the topic named by its ``identifier``, optionally after a fixed delay
+    """
+
+    def __init__(
+        self,
+        broker_host: str = "localhost",
+        broker_port: int = 1883,
+        topics: Optional[List[str]] = None,
+        delay: float = 0.0,
+        qos: int = 1,
+        client_id: Optional[str] = None
+    ):
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.topics = topics or ["requests/#"]
+        self.delay = delay
+        self.qos = qos
+        self.client_id = client_id or f"bench-responder-{uuid.uuid4().hex[:8]}"
+        self.requests_answered = 0
+
+        self.client = mqtt.Client(client_id=self.client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.on_socket_open = _set_nodelay
+        self._connected = threading.Event()
+
+        # Delayed replies, sent by a single timer thread in due order
+        self._delayed = []
+        self._delayed_ready = threading.Condition()
+        self._running = False
+        self._timer_thread: Optional[threading.Thread] = None
+
+    def _on_connect(self, client, userdata, flags, rc):
+        for topic in self.topics:
+            client.subscribe(topic, qos=self.qos)
+        self._connected.set()
+
+    def _on_message(self, client, userdata, message):
+        try:
+            request = json.loads(message.payload)
+        except ValueError:
+            return
+        identifier = request.get('identifier') if isinstance(request, dict) else None
+        correlation_id = request.get('correlation_id') if identifier else None
+        if not correlation_id:
+            return
+
+        reply = json.dumps({
+            "identifier": self.client_id,
+            "correlation_id": correlation_id,
+            "payload": request.get('payload', {})
+        })
+        if self.delay > 0:
+            with self._delayed_ready:
+                heapq.heappush(self._delayed, (time.monotonic() + self.delay, identifier, reply))
+                self._delayed_ready.notify()
+        else:
+            self._reply(identifier, reply)
+
+    def _reply(self, topic: str, reply: str):
+        self.client.publish(topic, reply, qos=self.qos)
+        self.requests_answered += 1
+
+    def _run_timer(self):
+        while self._running:
+            with self._delayed_ready:
+                if not self._delayed:
+                    self._delayed_ready.wait(0.1)
+                    continue
+                due, topic, reply = self._delayed[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._delayed_ready.wait(wait)
+                    continue
+                heapq.heappop(self._delayed)
+            self._reply(topic, reply)
+
+    def start(self, timeout: float = 10.0):
+        """Connect and wait until the subscriptions are sent"""
+        self._running = True
+        if self.delay > 0:
+            self._timer_thread = threading.Thread(target=self._run_timer, name='bench-responder-timer', daemon=True)
+            self._timer_thread.start()
+        self.client.connect(self.broker_host, self.broker_port, 60)
+        self.client.loop_start()
+        if not self._connected.wait(timeout):
+            raise RuntimeError(f"Responder could not connect to {self.broker_host}:{self.broker_port}")
+
+    def stop(self):
+        self._running = False
+        if self._timer_thread is not None:
+            self._timer_thread.join()
+        self.client.disconnect()
+        self.client.loop_stop()
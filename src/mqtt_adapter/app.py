@@ -11,21 +11,46 @@ from .models import MQTTAppConfig
 from .services import MQTTServiceManager
 from .web import WebServer
 from .utils import setup_logging
+from .utils.tracing import TRACER, configure_tracing
 
 logger = logging.getLogger(__name__)
 
 class MQTTAdapterApp:
     """Main application class for the MQTT Adapter"""
     
-    def __init__(self, config_path: str = None):
+    def __init__(self, config_path: str = None, instance_id: str = None, worker: bool = False):
         self.loop = asyncio.get_event_loop()
         self.config = load_config(config_path)
+        
+        # Instance ID from the command line or environment overrides the configuration
+        instance_id = instance_id or os.environ.get('MQTT_ADAPTER_INSTANCE_ID')
+        if instance_id:
+            self.config.instance_id = instance_id
+        
+        if worker:
+            # Workers split inbound messages through shared subscriptions,
+            # otherwise every worker would forward every message
+            for broker_config in self.config.brokers.values():
+                if not broker_config.share_group:
+                    broker_config.share_group = broker_config.client_id
+        
+        # Record spans if tracing is enabled in the configuration
+        tracing = self.config.tracing
+        configure_tracing(tracing.sample_rate, tracing.exporter, tracing.file_path, tracing.max_spans)
+        
         self.mqtt_manager = MQTTServiceManager(self.config, self.loop)
         
         # Get web server config from environment
         host = os.environ.get('HTTP_HOST', '0.0.0.0')
         port = int(os.environ.get('HTTP_PORT', '8080'))
-        self.web_server = WebServer(self.mqtt_manager, self.loop, host, port)
+        self.web_server = WebServer(
+            self.mqtt_manager, self.loop, host, port, reuse_port=worker,
+            max_batch_items=int(os.environ.get('HTTP_BATCH_MAX_ITEMS', '1000')),
+            batch_concurrency=int(os.environ.get('HTTP_BATCH_CONCURRENCY', '100')),
+            stream_buffer_size=int(os.environ.get('HTTP_STREAM_BUFFER_SIZE', '100')),
+            ws_max_inflight=int(os.environ.get('HTTP_WS_MAX_INFLIGHT', '100')),
+            ws_send_queue_size=int(os.environ.get('HTTP_WS_SEND_QUEUE_SIZE', '256'))
+        )
         
         # Set up signal handlers
         for sig in (signal.SIGINT, signal.SIGTERM):
@@ -53,27 +78,19 @@ class MQTTAdapterApp:
         # Shutdown the MQTT service manager
         await self.mqtt_manager.shutdown()
         
+        # Flush the exported spans
+        TRACER.shutdown()
+        
         # Stop the event loop
         self.loop.stop()
         
         logger.info("MQTT Adapter shutdown completed")
 
-def main():
-    """Main entry point for the application"""
-    # Parse command line arguments
-    parser = argparse.ArgumentParser(description='MQTT Adapter')
-    parser.add_argument('--config', help='Path to configuration file', default='config.yaml')
-    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
-                        help='Logging level')
-    parser.add_argument('--log-file', help='Path to log file', default='mqtt_adapter.log')
-    args = parser.parse_args()
-    
-    # Set up logging
-    setup_logging(args.log_level, args.log_file)
-    
+def run_app(config_path: str = None, instance_id: str = None, worker: bool = False):
+    """Create the application and run it until it is shut down"""
     try:
         # Create the application
-        app = MQTTAdapterApp(args.config)
+        app = MQTTAdapterApp(config_path, instance_id, worker)
         
         # Run the application
         app.loop.create_task(app.start())
@@ -86,5 +103,46 @@ def main():
     finally:
         logger.info("Application exiting")
 
+def main():
+    """Main entry point for the application"""
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='MQTT Adapter')
+    parser.add_argument('--config', help='Path to configuration file', default='config.yaml')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Logging level')
+    parser.add_argument('--log-file', help='Path to log file', default='mqtt_adapter.log')
+    parser.add_argument('--log-format', choices=['text', 'json'], help='Log output format')
+    parser.add_argument('--log-message-sample-rate', type=float,
+                        help='Fraction of messages whose per-message logs are kept')
+    parser.add_argument('--log-sync', action='store_true',
+                        help='Write logs from the calling thread instead of a background thread')
+    parser.add_argument('--instance-id', help='Unique ID of this adapter instance when running several instances')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes sharing the HTTP port')
+    args = parser.parse_args()
+    
+    # Set up logging
+    log_options = {
+        "log_format": args.log_format,
+        "use_queue": False if args.log_sync else None,
+        "message_sample_rate": args.log_message_sample_rate
+    }
+    setup_logging(args.log_level, args.log_file, **log_options)
+    
+    if args.workers > 1:
+        # Run the adapter in supervised worker processes
+        from .supervisor import WorkerSupervisor
+        supervisor = WorkerSupervisor(
+            workers=args.workers,
+            config_path=args.config,
+            instance_id=args.instance_id,
+            log_level=args.log_level,
+            log_file=args.log_file,
+            log_options=log_options
+        )
+        supervisor.run()
+    else:
+        run_app(args.config, args.instance_id)
+
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,17 @@
+from .http_client import (
+    AdapterCall,
+    AdapterClient,
+    AdapterClientError,
+    AdapterResponse,
+    SyncAdapterClient,
+    DEFAULT_RETRY_STATUSES,
+)
+
+__all__ = [
+    'AdapterCall',
+    'AdapterClient',
+    'AdapterClientError',
+    'AdapterResponse',
+    'SyncAdapterClient',
+    'DEFAULT_RETRY_STATUSES',
+]
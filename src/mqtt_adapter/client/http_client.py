@@ -0,0 +1,433 @@
+import asyncio
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import aiohttp
+
+from ..serialization import Codec, JSON_CODEC, get_codec, get_codec_for_content_type
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: refused by admission control or a failing gateway
+DEFAULT_RETRY_STATUSES = (429, 502, 503, 504)
+
+# Extra time given to a batch response past the batch deadline, in seconds
+BATCH_RESPONSE_GRACE = 5.0
+
+class AdapterCall(NamedTuple):
+    """One call to the adapter, as submitted in a batch"""
+    identifier: str
+    topic: str
+    payload: Any = None
+    is_request: bool = True
+    correlation_id: Optional[str] = None
+    timeout: Optional[float] = None
+
+class AdapterResponse(NamedTuple):
+    """Response of the adapter to one call"""
+    status_code: int
+    payload: Any
+    correlation_id: str
+    headers: Mapping[str, str]
+    attempts: int
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 300
+
+class AdapterClientError(Exception):
+    """Raised when a call could not get any HTTP response, after all retries"""
+
+    def __init__(self, message: str, correlation_id: str, attempts: int):
+        super().__init__(message)
+        self.correlation_id = correlation_id
+        self.attempts = attempts
+
+class AdapterClient:
+    """
+    Asynchronous client for the adapter HTTP API.
+
+    Calls share one pooled aiohttp session and at most ``max_concurrency`` of
+    them are in flight at a time. Failed attempts (connection errors, HTTP
+    timeouts and ``retry_statuses``) are retried with the same correlation ID,
+    so the adapter and the responders see one logical request, after an
+    exponential backoff with full jitter or the server's ``Retry-After``.
+
+    Usage::
+
+        async with AdapterClient("http://localhost:8080") as client:
+            response = await client.request("local", "devices/42/cmd", {"on": True})
+            responses = await client.batch(calls)
+            # Or many calls per HTTP request through /api/batch
+            responses = await client.batch(calls, batch_size=100)
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8080",
+        max_connections: int = 100,
+        max_concurrency: int = 100,
+        timeout: float = 30.0,
+        retries: int = 2,
+        backoff: float = 0.1,
+        max_backoff: float = 5.0,
+        retry_statuses: Sequence[int] = DEFAULT_RETRY_STATUSES,
+        codec: Union[str, Codec] = JSON_CODEC,
+        headers: Optional[Dict[str, str]] = None
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.codec = get_codec(codec) if isinstance(codec, str) else codec
+        self.headers = {
+            "Content-Type": self.codec.content_type,
+            "Accept": self.codec.content_type,
+            **(headers or {})
+        }
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> 'AdapterClient':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        """Open the connection pool, called on first use if not called before"""
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_connections)
+        self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        """Close the connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def health(self) -> Dict[str, Any]:
+        """Get the adapter health status"""
+        await self.start()
+        async with self._session.get(f"{self.base_url}/health", headers={"Accept": "application/json"}) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def request(
+        self,
+        identifier: str,
+        topic: str,
+        payload: Any = None,
+        correlation_id: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> AdapterResponse:
+        """Send a request to a broker and wait for its response"""
+        return await self.send(AdapterCall(identifier, topic, payload, True, correlation_id, timeout))
+
+    async def publish(
+        self,
+        identifier: str,
+        topic: str,
+        payload: Any = None,
+        correlation_id: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> AdapterResponse:
+        """Publish a message to a broker without waiting for a response (fire and forget)"""
+        return await self.send(AdapterCall(identifier, topic, payload, False, correlation_id, timeout))
+
+    async def send(self, call: AdapterCall) -> AdapterResponse:
+        """Send one call, retrying it with the same correlation ID"""
+        await self.start()
+        correlation_id = call.correlation_id or str(uuid.uuid4())
+        url = f"{self.base_url}/api/{call.identifier}/{call.topic}"
+        body = self.codec.encode({"is_request": call.is_request, "payload": call.payload or {}})
+        timeout = aiohttp.ClientTimeout(total=call.timeout or self.timeout)
+        headers = {"X-Correlation-ID": correlation_id}
+
+        started = time.perf_counter()
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                attempt += 1
+                try:
+                    async with self._session.post(url, data=body, headers=headers, timeout=timeout) as response:
+                        data = await response.read()
+                    if response.status in self.retry_statuses and attempt <= self.retries:
+                        # Back off after the connection went back to the pool
+                        await self._sleep_before_retry(attempt, response.headers.get('Retry-After'))
+                        continue
+                    return AdapterResponse(
+                        response.status,
+                        self._decode(data, response.headers.get('Content-Type')),
+                        response.headers.get('X-Correlation-ID', correlation_id),
+                        response.headers,
+                        attempt,
+                        time.perf_counter() - started
+                    )
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt > self.retries:
+                        raise AdapterClientError(
+                            f"Request {correlation_id} to {url} failed after {attempt} attempts: {e!r}",
+                            correlation_id,
+                            attempt
+                        ) from e
+                    logger.debug("Attempt %d for correlation ID %s failed: %r", attempt, correlation_id, e)
+                    await self._sleep_before_retry(attempt, None)
+
+    async def send_batch(self, calls: Sequence[AdapterCall]) -> List[Union[AdapterResponse, Exception]]:
+        """
+        Send calls in one POST /api/batch and get their results in order. The
+        items answered with a ``retry_statuses`` status are sent again with
+        their correlation ID in the next attempt, and the whole batch when
+        the HTTP request itself fails. Calls that get no HTTP response give
+        an AdapterClientError
+        """
+        await self.start()
+        url = f"{self.base_url}/api/batch"
+        correlation_ids = [call.correlation_id or str(uuid.uuid4()) for call in calls]
+        results: List[Union[AdapterResponse, Exception, None]] = [None] * len(calls)
+        todo = list(range(len(calls)))
+
+        started = time.perf_counter()
+        attempt = 0
+        async with self._semaphore:
+            while todo:
+                attempt += 1
+                deadline = max(calls[index].timeout or self.timeout for index in todo)
+                body = self.codec.encode({
+                    "items": [
+                        {
+                            "identifier": calls[index].identifier,
+                            "topic": calls[index].topic,
+                            "payload": calls[index].payload or {},
+                            "is_request": calls[index].is_request,
+                            "correlation_id": correlation_ids[index],
+                            "timeout": calls[index].timeout or self.timeout,
+                        }
+                        for index in todo
+                    ],
+                    "deadline": deadline,
+                })
+                timeout = aiohttp.ClientTimeout(total=deadline + BATCH_RESPONSE_GRACE)
+                try:
+                    async with self._session.post(url, data=body, timeout=timeout) as response:
+                        data = await response.read()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt > self.retries:
+                        for index in todo:
+                            results[index] = AdapterClientError(
+                                f"Batch request to {url} failed after {attempt} attempts: {e!r}",
+                                correlation_ids[index],
+                                attempt
+                            )
+                        break
+                    logger.debug("Attempt %d of a batch of %d calls failed: %r", attempt, len(todo), e)
+                    await self._sleep_before_retry(attempt, None)
+                    continue
+
+                payload = self._decode(data, response.headers.get('Content-Type'))
+                if response.status != 200:
+                    if response.status in self.retry_statuses and attempt <= self.retries:
+                        await self._sleep_before_retry(attempt, response.headers.get('Retry-After'))
+                        continue
+                    # The whole batch was refused, every call gets the error
+                    elapsed = time.perf_counter() - started
+                    for index in todo:
+                        results[index] = AdapterResponse(
+                            response.status, payload, correlation_ids[index], response.headers, attempt, elapsed
+                        )
+                    break
+
+                elapsed = time.perf_counter() - started
+                retry = []
+                for index, entry in zip(todo, payload["results"]):
+                    status_code = entry.get("status_code", 500)
+                    if status_code in self.retry_statuses and attempt <= self.retries:
+                        retry.append(index)
+                    results[index] = AdapterResponse(
+                        status_code,
+                        entry.get("payload"),
+                        entry.get("correlation_id", correlation_ids[index]),
+                        response.headers,
+                        attempt,
+                        elapsed
+                    )
+                todo = retry
+                if todo:
+                    await self._sleep_before_retry(attempt, response.headers.get('Retry-After'))
+        return results
+
+    async def batch(
+        self,
+        calls: Iterable[AdapterCall],
+        return_exceptions: bool = True,
+        batch_size: Optional[int] = None
+    ) -> List[Union[AdapterResponse, Exception]]:
+        """
+        Send many calls and get their results in submission order. With
+        return_exceptions, failed calls give their exception in place of a
+        response instead of raising. With batch_size, calls are sent that many
+        at a time through /api/batch
+        """
+        results: List[Union[AdapterResponse, Exception]] = []
+        async for index, result in self.as_completed(calls, batch_size):
+            results.extend([None] * (index + 1 - len(results)))
+            if isinstance(result, Exception) and not return_exceptions:
+                raise result
+            results[index] = result
+        return results
+
+    async def as_completed(
+        self,
+        calls: Iterable[AdapterCall],
+        batch_size: Optional[int] = None
+    ) -> AsyncIterator[Tuple[int, Union[AdapterResponse, Exception]]]:
+        """
+        Send many calls and yield (index, response or exception) as they
+        complete. The calls are pulled from the iterable lazily by
+        ``max_concurrency`` workers, so the window of in-flight requests stays
+        full on the pooled connections without one task per call. With
+        batch_size, each worker pulls that many calls at a time and sends them
+        with send_batch, pipelining batches on the pooled connections
+        """
+        await self.start()
+        source = iter(enumerate(calls))
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency * (batch_size or 1))
+        done = object()
+
+        async def worker():
+            for index, call in source:
+                try:
+                    result = await self.send(call)
+                except Exception as e:
+                    result = e
+                await results.put((index, result))
+            await results.put(done)
+
+        async def batch_worker():
+            while True:
+                chunk = list(itertools.islice(source, batch_size))
+                if not chunk:
+                    break
+                try:
+                    chunk_results = await self.send_batch([call for _, call in chunk])
+                except Exception as e:
+                    chunk_results = [e] * len(chunk)
+                for (index, _), result in zip(chunk, chunk_results):
+                    await results.put((index, result))
+            await results.put(done)
+
+        if batch_size:
+            worker = batch_worker
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.max_concurrency)]
+        try:
+            running = len(workers)
+            while running:
+                item = await results.get()
+                if item is done:
+                    running -= 1
+                    continue
+                yield item
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def _decode(self, data: bytes, content_type: Optional[str]) -> Any:
+        if not data:
+            return None
+        codec = get_codec_for_content_type(content_type, self.codec)
+        try:
+            return codec.decode(data)
+        except Exception:
+            # Plain text error pages from proxies or aiohttp itself
+            return data.decode('utf-8', errors='replace')
+
+    async def _sleep_before_retry(self, attempt: int, retry_after: Optional[str]):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        await asyncio.sleep(delay)
+
+class SyncAdapterClient:
+    """
+    Blocking wrapper around AdapterClient for scripts and threaded callers.
+
+    The asynchronous client runs on a private event loop thread, so calls from
+    several threads share its connection pool and concurrency limit.
+    """
+
+    def __init__(self, base_url: str = "http://localhost:8080", **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='adapter-client', daemon=True)
+        self._thread.start()
+        self._client = self._call(self._create_client(base_url, kwargs))
+
+    async def _create_client(self, base_url: str, kwargs: Dict[str, Any]) -> AdapterClient:
+        client = AdapterClient(base_url, **kwargs)
+        await client.start()
+        return client
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def __enter__(self) -> 'SyncAdapterClient':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def health(self) -> Dict[str, Any]:
+        """Get the adapter health status"""
+        return self._call(self._client.health())
+
+    def request(self, identifier: str, topic: str, payload: Any = None, **kwargs) -> AdapterResponse:
+        """Send a request to a broker and wait for its response"""
+        return self._call(self._client.request(identifier, topic, payload, **kwargs))
+
+    def publish(self, identifier: str, topic: str, payload: Any = None, **kwargs) -> AdapterResponse:
+        """Publish a message to a broker without waiting for a response"""
+        return self._call(self._client.publish(identifier, topic, payload, **kwargs))
+
+    def send(self, call: AdapterCall) -> AdapterResponse:
+        """Send one call"""
+        return self._call(self._client.send(call))
+
+    def send_batch(self, calls: Sequence[AdapterCall]) -> List[Union[AdapterResponse, Exception]]:
+        """Send calls in one batch request and get their results in order"""
+        return self._call(self._client.send_batch(calls))
+
+    def batch(
+        self,
+        calls: Iterable[AdapterCall],
+        return_exceptions: bool = True,
+        batch_size: Optional[int] = None
+    ) -> List[Union[AdapterResponse, Exception]]:
+        """Send many calls concurrently and get their results in submission order"""
+        return self._call(self._client.batch(calls, return_exceptions, batch_size))
+
+    def close(self):
+        """Close the connection pool and stop the event loop thread"""
+        if not self._thread.is_alive():
+            return
+        self._call(self._client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
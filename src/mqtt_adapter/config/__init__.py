@@ -38,9 +38,12 @@ def load_config_from_env() -> MQTTAppConfig:
             brokers[broker_id] = {'broker_id': broker_id}
         
         # Handle different property types
-        if property_name in ('port', 'qos', 'keepalive'):
+        if property_name in ('port', 'qos', 'keepalive', 'publish_pool_size', 'protocol_version', 'max_pending_requests',
+                             'max_concurrent_requests', 'max_queued_messages'):
             brokers[broker_id][property_name] = int(env_value)
-        elif property_name in ('clean_session'):
+        elif property_name == 'retry_after':
+            brokers[broker_id][property_name] = float(env_value)
+        elif property_name in ('clean_session', 'passthrough'):
             brokers[broker_id][property_name] = env_value.lower() in ('true', '1', 'yes')
         elif property_name == 'subscribe_topics':
             brokers[broker_id][property_name] = env_value.split(',')
@@ -49,6 +52,8 @@ def load_config_from_env() -> MQTTAppConfig:
     
     # Check if MQTT_CONFIG_JSON environment variable exists
     json_config = os.environ.get('MQTT_CONFIG_JSON')
+    routes = []
+    broker_groups = {}
     if json_config:
         try:
             config_data = json.loads(json_config)
@@ -60,7 +65,24 @@ def load_config_from_env() -> MQTTAppConfig:
                     else:
                         # Merge with existing config from environment
                         brokers[broker_id].update(broker_data)
+            routes = config_data.get('routes', [])
+            broker_groups = config_data.get('broker_groups', {})
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse MQTT_CONFIG_JSON: {e}")
     
-    return MQTTAppConfig(brokers=brokers) 
\ No newline at end of file
+    # Tracing settings: MQTT_TRACE_SAMPLE_RATE, MQTT_TRACE_EXPORTER, MQTT_TRACE_FILE
+    tracing = {}
+    if os.environ.get('MQTT_TRACE_SAMPLE_RATE'):
+        tracing['sample_rate'] = float(os.environ['MQTT_TRACE_SAMPLE_RATE'])
+    if os.environ.get('MQTT_TRACE_EXPORTER'):
+        tracing['exporter'] = os.environ['MQTT_TRACE_EXPORTER']
+    if os.environ.get('MQTT_TRACE_FILE'):
+        tracing['file_path'] = os.environ['MQTT_TRACE_FILE']
+    
+    return MQTTAppConfig(
+        brokers=brokers,
+        instance_id=os.environ.get('MQTT_ADAPTER_INSTANCE_ID'),
+        tracing=tracing,
+        routes=routes,
+        broker_groups=broker_groups
+    ) 
\ No newline at end of file
@@ -1,6 +1,7 @@
 from .base import BaseModel
-from .mqtt import MQTTRequest, MQTTResponse, MQTTBrokerConfig, MQTTAppConfig
+from .mqtt import MQTTRequest, MQTTResponse, MQTTBrokerConfig, MQTTAppConfig, BrokerGroupConfig, ResponseCacheRule, RouteConfig, TracingConfig
 from .http import HTTPRequest, HTTPResponse
+from .records import RequestRecord, ResponseRecord
 
 __all__ = [
     'BaseModel',
@@ -8,6 +9,12 @@ __all__ = [
     'MQTTResponse',
     'MQTTBrokerConfig',
     'MQTTAppConfig',
+    'BrokerGroupConfig',
+    'ResponseCacheRule',
+    'RouteConfig',
+    'TracingConfig',
     'HTTPRequest',
     'HTTPResponse',
+    'RequestRecord',
+    'ResponseRecord',
 ] 
\ No newline at end of file
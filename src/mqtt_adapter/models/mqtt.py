@@ -1,4 +1,4 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Literal, Optional, Union
 from .base import BaseModel
 
 class MQTTRequest(BaseModel):
@@ -6,8 +6,11 @@ class MQTTRequest(BaseModel):
     topic: str
     payload: dict
     correlation_id: str
-    target_broker_id: str
+    # Broker ID, broker group name or list of broker IDs
+    target_broker_id: Union[str, List[str]]
     is_response: bool = False
+    # Original message body, set when the message is forwarded without decoding it
+    raw_payload: Optional[bytes] = None
 
     def to_dict(self) -> dict:
         """Convert the model to a dictionary"""
@@ -18,11 +21,26 @@ class MQTTResponse(BaseModel):
     status_code: int
     payload: dict
     correlation_id: str
+    # Response body as received from the broker, passed through without
+    # decoding and re-encoding it
+    raw_payload: Optional[bytes] = None
+    # Content type of raw_payload, None for JSON
+    content_type: Optional[str] = None
 
     def to_dict(self) -> dict:
         """Convert the model to a dictionary"""
         return self.dict()
 
+class ResponseCacheRule(BaseModel):
+    """Request topics whose responses are cached, for reads repeated by many callers"""
+    # Topic filter of the cached requests, with the + and # wildcards
+    topic: str
+    # Seconds a response is served from the cache
+    ttl: float
+    # Seconds after the TTL during which the stale response is still served
+    # while a single request refreshes it in the background
+    stale_ttl: float = 0.0
+
 class MQTTBrokerConfig(BaseModel):
     """MQTT broker configuration"""
     broker_id: str
@@ -35,12 +53,129 @@ class MQTTBrokerConfig(BaseModel):
     qos: int = 0
     keepalive: int = 60
     subscribe_topics: List[str] = []
-    
-    
+    # Network loop driving the client socket: "thread" runs paho's loop_start()
+    # thread, "asyncio" runs the socket I/O on the adapter's event loop
+    network_loop: Literal['thread', 'asyncio'] = 'thread'
+    # Number of connections used for publishing, subscriptions stay on the first one
+    publish_pool_size: int = 1
+    # MQTT protocol version, 4 for MQTT 3.1.1 or 5 for MQTT 5
+    protocol_version: Literal[4, 5] = 4
+    # Shared subscription group, subscribe_topics are subscribed as $share/<group>/<topic>
+    # so adapter instances in the same group split the inbound messages
+    share_group: Optional[str] = None
+    # Read the routing metadata of incoming messages from MQTT 5 user properties or
+    # the compact "@mqa" header and forward the body bytes without decoding them
+    passthrough: bool = False
+    # Codec of the envelopes published to this broker: json, msgpack or cbor.
+    # Incoming messages are decoded according to their content type or marker
+    codec: str = 'json'
+    # Maximum number of requests waiting for a response from this broker, and what
+    # to do when it is reached: "reject" new requests (503) or "evict_oldest"
+    max_pending_requests: int = 10000
+    pending_overflow_policy: Literal['reject', 'evict_oldest'] = 'reject'
+    # Admission control of the requests routed to this broker: at most
+    # max_concurrent_requests in progress (429 beyond) and no new request while
+    # the outbound MQTT queue holds max_queued_messages or more (503), None for
+    # no limit. Rejected clients are told to retry after retry_after seconds
+    max_concurrent_requests: Optional[int] = None
+    max_queued_messages: Optional[int] = None
+    retry_after: float = 1.0
+    # Directory of the on-disk spool keeping the forwarded fire-and-forget
+    # messages while the broker is disconnected, None to disable it
+    spool_dir: Optional[str] = None
+    # Size of the spool segment files and of the whole spool, the oldest
+    # segments are dropped beyond spool_max_bytes
+    spool_segment_bytes: int = 16 * 1024 * 1024
+    spool_max_bytes: int = 1024 * 1024 * 1024
+    # Spooled messages older than this many seconds are dropped, None to keep them
+    spool_max_age: Optional[float] = None
+    # Seconds between two fsyncs of the spool writes
+    spool_fsync_interval: float = 0.1
+    # Messages per second replayed after a reconnect, None for no limit
+    spool_replay_rate: Optional[float] = None
+    # Read the spool segments through mmap when replaying
+    spool_mmap: bool = False
+    # Bounds of the jittered exponential delay between two reconnect attempts
+    reconnect_min_delay: float = 1.0
+    reconnect_max_delay: float = 60.0
+    # Circuit breaker: requests fail fast (503) while the broker is disconnected
+    # or after circuit_failure_threshold consecutive timeouts or errors (None to
+    # only watch the connection), timeouts counting only while nothing comes
+    # from the broker, one probe request is let through every
+    # circuit_reset_timeout seconds to close it again
+    circuit_failure_threshold: Optional[int] = 5
+    circuit_reset_timeout: float = 10.0
+    # Broker the requests are sent to instead while the circuit of this one is open
+    failover: Optional[str] = None
+    # Drop the requests received again within dedup_ttl seconds (QoS 1
+    # redeliveries, HTTP retries), keyed on their correlation ID, None to
+    # disable it. Duplicates get the cached response of the first request.
+    # At most dedup_capacity keys are remembered
+    dedup_ttl: Optional[float] = None
+    dedup_capacity: int = 100000
+    # Also drop the routed messages whose topic and payload were already received
+    dedup_content_hash: bool = False
+    # Cache the responses to the requests matching these rules, by topic and
+    # payload, keeping at most response_cache_size responses (least recently used out)
+    response_cache: List[ResponseCacheRule] = []
+    response_cache_size: int = 10000
+    # Publish batching: messages wait up to publish_batch_delay seconds (0 for
+    # the end of the event loop iteration, None to publish them one by one) or
+    # until publish_batch_bytes bytes are waiting, then are published together
+    publish_batch_delay: Optional[float] = None
+    publish_batch_bytes: int = 65536
+    # Pack each batch in one message on this topic, for adapters expanding it
+    publish_batch_topic: Optional[str] = None
+    # Topics of the batch envelopes to subscribe to and expand into their messages
+    unbatch_topics: List[str] = []
+
+
+class RouteConfig(BaseModel):
+    """Route forwarding the messages of a source broker topic to a target broker"""
+    # Broker the messages come from and the topic filter they must match,
+    # with the + and # wildcards
+    source: str
+    topic: str
+    # Broker the messages are forwarded to
+    target: str
+    # Topic on the target broker, the source topic by default. {topic} is
+    # replaced by the source topic and {1}, {2}... by the levels matched by
+    # the wildcards in order, # matching all the remaining levels
+    target_topic: Optional[str] = None
+    # QoS of the forwarded messages, the target broker's QoS by default
+    qos: Optional[int] = None
+
+class BrokerGroupConfig(BaseModel):
+    """Named group of brokers, messages sent to the group are published to all of them"""
+    brokers: List[str]
+    # How the responses of requests are gathered: the "first" successful
+    # response, "all" the responses or a "quorum" of successful responses
+    gather: Literal['first', 'all', 'quorum'] = 'first'
+    # Successful responses needed with the quorum policy, a majority by default
+    quorum: Optional[int] = None
+
+class TracingConfig(BaseModel):
+    """Tracing configuration"""
+    # Fraction of new traces that are recorded, 0 disables tracing. Traces
+    # started upstream follow the sampling decision of their traceparent
+    sample_rate: float = 0.0
+    # "memory" keeps the latest max_spans spans for GET /traces, "file"
+    # appends the spans to file_path as JSON lines
+    exporter: Literal['memory', 'file'] = 'memory'
+    file_path: Optional[str] = None
+    max_spans: int = 10000
 
 class MQTTAppConfig(BaseModel):
     """Application configuration containing all broker configurations"""
     brokers: Dict[str, MQTTBrokerConfig]
+    tracing: TracingConfig = TracingConfig()
+    # Declarative routes, checked for every message before its payload is decoded
+    routes: List[RouteConfig] = []
+    # Broker groups, usable as target broker ID to fan messages out to several brokers
+    broker_groups: Dict[str, BrokerGroupConfig] = {}
+    # Identifies this adapter instance, used to derive unique client IDs and
+    # per-instance response topics when several instances share the brokers
+    instance_id: Optional[str] = None
 
     @classmethod
     def load_from_file(cls, file_path: str) -> 'MQTTAppConfig':
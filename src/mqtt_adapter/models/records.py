@@ -0,0 +1,59 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+from .mqtt import MQTTRequest, MQTTResponse
+
+# Lightweight records used on the message hot path. They expose the same
+# attributes as the pydantic models but skip validation, which is done once
+# at the edges (HTTP body parsing, configuration loading).
+
+class RequestRecord(NamedTuple):
+    """Request travelling through the adapter"""
+    topic: str
+    payload: Any
+    correlation_id: str
+    # Broker ID, broker group name or list of broker IDs
+    target_broker_id: Union[str, List[str]]
+    is_response: bool = False
+    raw_payload: Optional[bytes] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the record to a dictionary"""
+        return self._asdict()
+
+    def to_model(self) -> MQTTRequest:
+        """Convert the record to the validated pydantic model"""
+        return MQTTRequest(**self._asdict())
+
+    @classmethod
+    def from_model(cls, request: MQTTRequest) -> 'RequestRecord':
+        """Create a record from the pydantic model"""
+        return cls(
+            request.topic,
+            request.payload,
+            request.correlation_id,
+            request.target_broker_id,
+            request.is_response,
+            request.raw_payload
+        )
+
+class ResponseRecord(NamedTuple):
+    """Response travelling through the adapter"""
+    status_code: int
+    payload: Any
+    correlation_id: str
+    raw_payload: Optional[bytes] = None
+    content_type: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the record to a dictionary"""
+        return self._asdict()
+
+    def to_model(self) -> MQTTResponse:
+        """Convert the record to the validated pydantic model"""
+        return MQTTResponse(
+            status_code=self.status_code,
+            payload=self.payload,
+            correlation_id=self.correlation_id,
+            raw_payload=self.raw_payload,
+            content_type=self.content_type
+        )
@@ -1,10 +1,30 @@
 from .interface import IMQTTProtocol
 from .base import BaseProtocol, MQTTBrokerRegistry
+from .batching import PublishBatcher, pack_batch, unpack_batch
+from .connection import ConnectionMonitor
+from .dedup import DedupCache
 from .factory import MQTTProtocolFactory
+from .fanout import gather_responses, publish_to_all
+from .routing import Route, RoutingTable, TopicTrie
+from .correlation import CorrelationTable, PendingRequestEvicted, PendingRequestsFull, ReplyStream
 
 __all__ = [
     'IMQTTProtocol',
     'BaseProtocol',
     'MQTTBrokerRegistry',
     'MQTTProtocolFactory',
+    'ConnectionMonitor',
+    'DedupCache',
+    'PublishBatcher',
+    'pack_batch',
+    'unpack_batch',
+    'CorrelationTable',
+    'PendingRequestEvicted',
+    'PendingRequestsFull',
+    'ReplyStream',
+    'gather_responses',
+    'publish_to_all',
+    'Route',
+    'RoutingTable',
+    'TopicTrie',
 ] 
\ No newline at end of file
@@ -1,32 +1,96 @@
 import asyncio
-import json
+import hashlib
+import os
+import re
+import time
 import uuid
-from typing import Dict, Callable, Optional, Any, List
+import zlib
+from typing import Dict, Callable, Optional, Any, List, Tuple, Union
 import logging
 from paho.mqtt import client as mqtt
 from paho.mqtt.client import MQTTMessage
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
-from ..models import MQTTBrokerConfig, MQTTRequest, MQTTResponse
+from ..models import BrokerGroupConfig, MQTTBrokerConfig, RequestRecord, ResponseRecord
+from ..utils.logging import MESSAGE_LOGGER
+from ..utils.tracing import TRACER
+from ..utils.metrics import DEDUP_LOOKUPS, ERRORS, FORWARD_HOP, MESSAGES_FORWARDED, MESSAGES_IN, MESSAGES_OUT, REQUEST_WAIT, REQUESTS_TIMED_OUT
+from ..serialization import JSON_CODEC, frame_payload, get_codec, get_codec_for_content_type, unframe_payload
+from .correlation import CorrelationTable, PendingRequestEvicted, PendingRequestsFull, ReplyStream
+from .envelope import MessageMetadata, encode_header, is_final_reply, metadata_to_properties, read_metadata
 from .interface import IMQTTProtocol
+from .batching import BatchedMessage, PublishBatcher, pack_batch, unpack_batch
+from .connection import ConnectionMonitor, backoff_delay
+from .dedup import DedupCache
+from .fanout import GATHER_ALL, gather_responses, publish_to_all
+from .routing import Route, TopicTrie
+from .spool import Spool
+from .transport import AsyncioTransport, set_tcp_nodelay
 
 logger = logging.getLogger(__name__)
+# Per-message step logs, formatted lazily and sampled per correlation ID
+message_logger = logging.getLogger(MESSAGE_LOGGER)
+
+# Spooled messages replayed per batch, and outbound paho queue depth at
+# which the replay waits so live messages are not stuck behind the backlog
+SPOOL_REPLAY_BATCH = 100
+SPOOL_REPLAY_WINDOW = 1000
 
 class MQTTBrokerRegistry:
     """Registry for MQTT protocols/brokers"""
     
     def __init__(self):
         self.protocols: Dict[str, 'BaseProtocol'] = {}
+        self.groups: Dict[str, BrokerGroupConfig] = {}
     
     def register_protocol(self, broker_id: str, protocol: 'BaseProtocol'):
         """Register a protocol with the registry"""
         self.protocols[broker_id] = protocol
     
+    def register_group(self, name: str, group: BrokerGroupConfig):
+        """Register a broker group, its brokers must be registered first"""
+        if name in self.protocols:
+            raise ValueError(f"Broker group {name} has the name of a broker")
+        for broker_id in group.brokers:
+            if broker_id not in self.protocols:
+                raise ValueError(f"Broker group {name} uses unknown broker: {broker_id}")
+        if not group.brokers or (group.quorum is not None and not 0 < group.quorum <= len(group.brokers)):
+            raise ValueError(f"Broker group {name} needs brokers and a quorum between 1 and their number")
+        self.groups[name] = group
+    
+    def resolve_targets(self, target: Union[str, List[str]]) -> Tuple[List[str], Optional[BrokerGroupConfig]]:
+        """
+        Get the broker IDs a target broker ID, group name or list of broker IDs
+        stands for, with the group it names if any
+        """
+        if isinstance(target, str):
+            group = self.groups.get(target)
+            if group is not None:
+                return group.brokers, group
+            return [target], None
+        return list(dict.fromkeys(target)), None
+    
     def get_protocol(self, broker_id: str) -> 'BaseProtocol':
         """Get a protocol by broker ID"""
         if broker_id not in self.protocols:
             raise KeyError(f"Protocol not found for broker ID: {broker_id}")
         return self.protocols[broker_id]
     
+    def select_protocol(self, broker_id: str) -> 'BaseProtocol':
+        """
+        Get the protocol of a broker, or of its failover broker while the
+        circuit of the broker is open and the failover one is available
+        """
+        protocol = self.get_protocol(broker_id)
+        if protocol.connection.available or protocol.config.failover is None:
+            return protocol
+        failover = self.protocols.get(protocol.config.failover)
+        if failover is None or not failover.connection.available:
+            return protocol
+        logger.debug(f"Circuit of broker **{broker_id}** is open, failing over to **{failover.config.broker_id}**")
+        return failover
+    
     def list_protocols(self) -> List[str]:
         """List all registered protocol IDs"""
         return list(self.protocols.keys())
@@ -38,23 +102,156 @@ class BaseProtocol(IMQTTProtocol):
         self, 
         config: MQTTBrokerConfig, 
         broker_registry: MQTTBrokerRegistry, 
-        loop: Optional[asyncio.AbstractEventLoop] = None
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        instance_id: Optional[str] = None,
+        routes: Optional[TopicTrie] = None
     ):
         self.loop = loop or asyncio.get_event_loop()
         self.config = config
         self._running = False
-        self.client = mqtt.Client(client_id=config.client_id, clean_session=config.clean_session)
-        self._pending_requests: Dict[str, asyncio.Future] = {}
+        
+        # Adapter instances sharing a subscription group need their own client ID
+        # and response topic, so replies come back to the instance that is waiting
+        if instance_id is None and config.share_group:
+            instance_id = uuid.uuid4().hex[:8]
+        self.instance_id = instance_id
+        self.client_id = f"{config.client_id}-{instance_id}" if instance_id else config.client_id
+        self.response_topic = f"{config.broker_id}/{instance_id}" if instance_id else config.broker_id
+        self._pending_requests = CorrelationTable(
+            self.loop,
+            capacity=config.max_pending_requests,
+            overflow_policy=config.pending_overflow_policy
+        )
         self._broker_registry = broker_registry
         
-        # Set up callbacks
+        # Declarative routes of the messages received from this broker
+        self._routes = routes if routes else None
+        self._routed_counters: Dict[str, Any] = {}
+        
+        # On-disk spool of the forwarded messages while the broker is unreachable,
+        # one directory per broker and adapter instance
+        self.spool: Optional[Spool] = None
+        if config.spool_dir:
+            spool_name = f"{config.broker_id}-{instance_id}" if instance_id else config.broker_id
+            self.spool = Spool(
+                os.path.join(config.spool_dir, re.sub(r'[^\w.-]', '_', spool_name)),
+                segment_bytes=config.spool_segment_bytes,
+                max_bytes=config.spool_max_bytes,
+                max_age=config.spool_max_age,
+                use_mmap=config.spool_mmap
+            )
+        self._spool_task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+        
+        # Connection state and circuit breaker, requests fail fast while the circuit is open
+        self.connection = ConnectionMonitor(
+            failure_threshold=config.circuit_failure_threshold,
+            reset_timeout=config.circuit_reset_timeout
+        )
+        # Failed reconnect attempts by client, driving the jittered backoff in thread mode
+        self._reconnect_attempts: Dict[mqtt.Client, int] = {}
+        
+        # Recently received request keys, duplicates are dropped or answered from the cache
+        self.dedup: Optional[DedupCache] = None
+        if config.dedup_ttl is not None:
+            self.dedup = DedupCache(config.dedup_capacity, config.dedup_ttl)
+        self._dedup_hits = DEDUP_LOOKUPS.labels(config.broker_id, 'hit')
+        self._dedup_misses = DEDUP_LOOKUPS.labels(config.broker_id, 'miss')
+        
+        # Small messages published close together are flushed in batches
+        self._batcher: Optional[PublishBatcher] = None
+        if config.publish_batch_delay is not None:
+            self._batcher = PublishBatcher(self.loop, self._flush_batch, config.publish_batch_delay, config.publish_batch_bytes)
+        self._unbatch_topics = frozenset(config.unbatch_topics)
+        
+        # Callbacks of the listeners (e.g. WebSocket clients) by topic filter.
+        # Replaced on every change, so the paho thread can read it without a lock
+        self._listeners: Dict[str, Tuple[Callable[[str, Any], None], ...]] = {}
+        
+        # Metric series of this broker, looked up once
+        self._messages_in = MESSAGES_IN.labels(config.broker_id)
+        self._messages_out = MESSAGES_OUT.labels(config.broker_id)
+        self._requests_timed_out = REQUESTS_TIMED_OUT.labels(config.broker_id)
+        self._request_wait = REQUEST_WAIT.labels(config.broker_id)
+        
+        # Codec used for the envelopes published to this broker
+        self.codec = get_codec(config.codec)
+        
+        # The primary client owns the subscriptions and receives all messages
+        self.client = self._create_client(self.client_id)
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
+        self.client.on_connect_fail = self._on_connect_fail
         self.client.on_message = self._on_message
         
+        # Additional publish-only connections, each with its own socket and outbound queue
+        self._publish_clients: List[mqtt.Client] = [self.client]
+        for index in range(1, max(1, config.publish_pool_size)):
+            pool_client = self._create_client(f"{self.client_id}-pub{index}")
+            pool_client.on_connect = self._on_pool_connect
+            pool_client.on_disconnect = self._on_disconnect
+            pool_client.on_connect_fail = self._on_connect_fail
+            self._publish_clients.append(pool_client)
+        
+        # Drive the sockets from the event loop instead of paho network threads
+        self._transports: List[AsyncioTransport] = []
+        if config.network_loop == 'asyncio':
+            self._transports = [
+                AsyncioTransport(
+                    client,
+                    self.loop,
+                    reconnect_delay=config.reconnect_min_delay,
+                    max_reconnect_delay=config.reconnect_max_delay,
+                    on_connect_fail=self.connection.on_connect_failed if client is self.client else None
+                )
+                for client in self._publish_clients
+            ]
+        self._transport: Optional[AsyncioTransport] = self._transports[0] if self._transports else None
+    
+    def _create_client(self, client_id: str) -> mqtt.Client:
+        """Create a paho client for this broker"""
+        if self.config.protocol_version == mqtt.MQTTv5:
+            # MQTT 5 replaces clean_session with clean_start, passed on connect
+            client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        else:
+            client = mqtt.Client(client_id=client_id, clean_session=self.config.clean_session)
+        
         # Set up authentication if provided
-        if config.username and config.password:
-            self.client.username_pw_set(config.username, config.password)
+        if self.config.username and self.config.password:
+            client.username_pw_set(self.config.username, self.config.password)
+        
+        # Send small packets right away, replaced by the transport's callback in asyncio mode
+        client.on_socket_open = lambda client, userdata, sock: set_tcp_nodelay(sock)
+        return client
+    
+    def _select_client(self, key: str) -> mqtt.Client:
+        """Pick the pool connection for a publish, the same key always maps to the same connection"""
+        if len(self._publish_clients) == 1:
+            return self.client
+        return self._publish_clients[zlib.crc32(key.encode('utf-8')) % len(self._publish_clients)]
+    
+    def _connect_kwargs(self) -> Dict[str, Any]:
+        """Get the connection parameters for the broker"""
+        kwargs = {
+            "host": self.config.host,
+            "port": self.config.port,
+            "keepalive": self.config.keepalive
+        }
+        if self.config.protocol_version == mqtt.MQTTv5:
+            kwargs["clean_start"] = self.config.clean_session
+        return kwargs
+    
+    def _subscription_topic(self, topic: str) -> str:
+        """Get the topic filter to subscribe to, using the shared group if configured"""
+        if self.config.share_group:
+            return f"$share/{self.config.share_group}/{topic}"
+        return topic
+    
+    def _is_own_identifier(self, identifier: Optional[str]) -> bool:
+        """Check whether a message identifier belongs to one of the adapter instances for this broker"""
+        if not identifier:
+            return False
+        return identifier == self.config.broker_id or identifier.startswith(f"{self.config.broker_id}/")
     
     def get_identifier(self) -> str:
         """Get the identifier for the broker"""
@@ -64,83 +261,431 @@ class BaseProtocol(IMQTTProtocol):
         """Get the QoS for the broker"""
         return self.config.qos
     
-    def _on_connect(self, client, userdata, flags, rc):
+    def _call_soon(self, callback: Callable, *args):
+        """Schedule a callback on the event loop from a paho callback"""
+        if self._transport is not None:
+            # paho callbacks already run on the event loop thread
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+    
+    def _spawn(self, coro):
+        """Run a coroutine on the event loop from a paho callback"""
+        if self._transport is not None:
+            return self.loop.create_task(coro)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback for when the client connects to the broker"""
         if rc == 0:
             logger.info(f"Connected to broker **{self.config.broker_id}** at **{self.config.host}**:**{self.config.port}**")
+            self._reconnect_attempts.pop(client, None)
+            self.connection.on_connected()
+            
+            # Subscribe to all configured and routed topics, shared across instances if a group is configured
+            for topic in self._own_topic_filters():
+                subscription = self._subscription_topic(topic)
+                client.subscribe(subscription, qos=self.config.qos)
+                logger.info(f"Subscribed to topic **{subscription}**")
+            
+            # Responses to this instance's requests are never shared
+            if self.response_topic != self.config.broker_id:
+                client.subscribe(self.response_topic, qos=self.config.qos)
+                logger.info(f"Subscribed to response topic **{self.response_topic}**")
             
-            # Subscribe to all configured topics
-            for topic in self.config.subscribe_topics:
-                client.subscribe(topic, qos=self.config.qos)
-            client.subscribe(self.config.broker_id, qos=self.config.qos)
-            logger.info(f"Subscribed to topic **{topic}**")
+            # Restore the subscriptions of the listeners
+            for topic_filter in self._listeners:
+                client.subscribe(topic_filter, qos=self.config.qos)
+            
+            # Send what was spooled while the broker was unreachable
+            if self.spool is not None:
+                self._call_soon(self._start_replay)
         else:
             logger.error(f"Failed to connect to broker **{self.config.broker_id}**, return code: {rc}")
+            self.connection.on_connect_failed(f"Connection refused, return code: {rc}")
+    
+    def _on_pool_connect(self, client, userdata, flags, rc, properties=None):
+        """Callback for when a publish pool client connects to the broker"""
+        if rc == 0:
+            logger.debug(f"Publish pool connection connected to broker **{self.config.broker_id}**")
+            self._reconnect_attempts.pop(client, None)
+        else:
+            logger.error(f"Failed to connect publish pool connection to broker **{self.config.broker_id}**, return code: {rc}")
     
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         """Callback for when the client disconnects from the broker"""
         if rc != 0:
             logger.warning(f"Unexpected disconnect from broker **{self.config.broker_id}**, return code: {rc}")
         else:
             logger.info(f"Disconnected from broker **{self.config.broker_id}**")
+        if client is self.client:
+            self.connection.on_disconnected(f"Disconnected, return code: {rc}")
+        self._set_reconnect_delay(client)
+    
+    def _on_connect_fail(self, client, userdata):
+        """Callback for when paho's network thread fails to reconnect to the broker"""
+        if client is self.client:
+            self.connection.on_connect_failed("Connection failed")
+        self._reconnect_attempts[client] = self._reconnect_attempts.get(client, 0) + 1
+        self._set_reconnect_delay(client)
+    
+    def _set_reconnect_delay(self, client: mqtt.Client):
+        """
+        Set the delay paho's network thread waits before its next reconnect
+        attempt. paho doubles its delay without jitter, so the jittered delay
+        is computed here and set as both its bounds
+        """
+        if self._transport is None:
+            delay = backoff_delay(
+                self._reconnect_attempts.get(client, 0) + 1,
+                self.config.reconnect_min_delay,
+                self.config.reconnect_max_delay
+            )
+            client.reconnect_delay_set(delay, delay)
+    
+    def add_listener(self, topic_filter: str, callback: Callable[[str, Any], None]):
+        """
+        Call callback(topic, payload) on the event loop for every message
+        matching the topic filter, subscribing to it on the broker if needed.
+        Messages received only for listeners are not handled as requests
+        """
+        callbacks = self._listeners.get(topic_filter, ())
+        if not callbacks:
+            self.client.subscribe(topic_filter, qos=self.config.qos)
+            logger.info(f"Subscribed to listener topic **{topic_filter}** on broker **{self.config.broker_id}**")
+        self._listeners = {**self._listeners, topic_filter: callbacks + (callback,)}
+    
+    def remove_listener(self, topic_filter: str, callback: Callable[[str, Any], None]):
+        """Stop calling a listener, unsubscribing from the topic filter when it was the last one"""
+        callbacks = tuple(c for c in self._listeners.get(topic_filter, ()) if c is not callback)
+        listeners = dict(self._listeners)
+        if callbacks:
+            listeners[topic_filter] = callbacks
+        elif listeners.pop(topic_filter, None) is not None and not self._is_own_subscription(topic_filter):
+            self.client.unsubscribe(topic_filter)
+            logger.info(f"Unsubscribed from listener topic **{topic_filter}** on broker **{self.config.broker_id}**")
+        self._listeners = listeners
+    
+    def _own_topic_filters(self) -> List[str]:
+        """Topic filters of the configured subscriptions, the routes and the broker requests"""
+        route_filters = self._routes.topic_filters if self._routes is not None else []
+        return list(dict.fromkeys(
+            self.config.subscribe_topics + route_filters + self.config.unbatch_topics + [self.config.broker_id]
+        ))
+    
+    def _is_own_subscription(self, topic: str) -> bool:
+        """Check whether a topic matches the subscriptions the adapter makes for its own traffic"""
+        own_filters = self._own_topic_filters() + [self.response_topic]
+        return any(mqtt.topic_matches_sub(topic_filter, topic) for topic_filter in own_filters)
+    
+    def _notify_listeners(self, listeners: Dict[str, Tuple[Callable[[str, Any], None], ...]], message: MQTTMessage) -> bool:
+        """Pass a message to the matching listeners, True if it was received only for them"""
+        callbacks = [
+            callback
+            for topic_filter, filter_callbacks in listeners.items()
+            if mqtt.topic_matches_sub(topic_filter, message.topic)
+            for callback in filter_callbacks
+        ]
+        if not callbacks:
+            return False
+        try:
+            payload = self._decode_payload(message)
+        except Exception:
+            payload = bytes(message.payload).decode('utf-8', errors='replace')
+        for callback in callbacks:
+            self._call_soon(callback, message.topic, payload)
+        return not self._is_own_subscription(message.topic)
+    
+    def _resolve_pending(self, correlation_id: str, response: ResponseRecord, final: bool = False):
+        """Complete the pending request waiting for a response, or add the response to its stream"""
+        self._call_soon(self._pending_requests.resolve, correlation_id, response, final)
+    
+    def get_backpressure(self) -> Dict[str, Any]:
+        """
+        Get the outbound queue state of the broker connections. paho has no
+        public API for it, so its internal counters are read when present
+        """
+        inflight = queued = 0
+        for client in self._publish_clients:
+            client_inflight = getattr(client, '_inflight_messages', 0)
+            inflight += client_inflight
+            queued += max(0, len(getattr(client, '_out_messages', ())) - client_inflight)
+        return {"connected": self.client.is_connected(), "inflight": inflight, "queued": queued}
+    
+    def get_pending_stats(self) -> Dict[str, int]:
+        """Get the size and counters of the pending request table"""
+        return self._pending_requests.get_stats()
+    
+    def _get_raw_response(self, message: MQTTMessage) -> Optional[ResponseRecord]:
+        """
+        Get an MQTT 5 response that carries its correlation ID as a property,
+        its payload is the response body and is passed through as is
+        """
+        if message.topic != self.response_topic:
+            return None
+        
+        properties = getattr(message, 'properties', None)
+        correlation_data = getattr(properties, 'CorrelationData', None)
+        if not correlation_data:
+            return None
+        
+        # Without a content type the body is expected to be JSON
+        content_type = getattr(properties, 'ContentType', None)
+        codec = get_codec_for_content_type(content_type, None if content_type else JSON_CODEC)
+        if codec is None:
+            return None
+        
+        correlation_id = correlation_data.decode('utf-8')
+        if correlation_id not in self._pending_requests:
+            return None
+        
+        return ResponseRecord(
+            status_code=200,
+            payload={},
+            correlation_id=correlation_id,
+            raw_payload=message.payload,
+            content_type=codec.content_type
+        )
+    
+    def _encode_payload(
+        self, 
+        payload: Dict[str, Any], 
+        properties: Optional[Properties]
+    ) -> Tuple[bytes, Optional[Properties]]:
+        """Encode a payload with the broker codec, marking its content type"""
+        data = self.codec.encode(payload)
+        if self.config.protocol_version == mqtt.MQTTv5:
+            if properties is None:
+                properties = Properties(PacketTypes.PUBLISH)
+            properties.ContentType = self.codec.content_type
+            return data, properties
+        return frame_payload(self.codec, data), properties
+    
+    def _mark_content_type(self, data: bytes, content_type: Optional[str]) -> Tuple[bytes, Optional[Properties]]:
+        """Mark the content type of an already encoded body, JSON bodies are left as is before MQTT 5"""
+        codec = get_codec_for_content_type(content_type, JSON_CODEC)
+        if self.config.protocol_version == mqtt.MQTTv5:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.ContentType = codec.content_type
+            return data, properties
+        return frame_payload(codec, data), None
+    
+    def _decode_payload(self, message: MQTTMessage) -> Any:
+        """Decode a payload with the codec given by its MQTT 5 content type or marker"""
+        content_type = getattr(getattr(message, 'properties', None), 'ContentType', None)
+        codec = get_codec_for_content_type(content_type)
+        if codec is not None:
+            return codec.decode(message.payload)
+        codec, data = unframe_payload(message.payload, JSON_CODEC)
+        return codec.decode(data)
+    
+    def _handle_raw_message(self, topic: str, metadata: MessageMetadata, body: bytes):
+        """Handle a message whose routing metadata was read without decoding its body"""
+        if self._is_own_identifier(metadata.identifier):
+            return
+        
+        correlation_id = metadata.correlation_id
+        if correlation_id in self._pending_requests:
+            self._resolve_pending(correlation_id, ResponseRecord(
+                status_code=200,
+                payload={},
+                correlation_id=correlation_id,
+                raw_payload=body
+            ), metadata.final)
+            return
+        
+        if self._drop_duplicate(metadata.identifier, correlation_id):
+            return
+        
+        request = RequestRecord(
+            topic=topic,
+            payload={},
+            correlation_id=correlation_id,
+            target_broker_id=metadata.target_broker_id,
+            is_response=metadata.is_response,
+            raw_payload=body
+        )
+        message_logger.info(
+            "Received passthrough message from broker **%s** for target broker **%s** at topic **%s**",
+            self.config.broker_id, metadata.target_broker_id, topic, extra={"correlation_id": correlation_id}
+        )
+        self._spawn(self._handle_message(metadata.identifier, request, metadata.traceparent))
     
     def _on_message(self, client, userdata, message: MQTTMessage):
         """Callback for when a message is received"""
+        self._messages_in.inc()
+        self.connection.last_message_at = time.monotonic()
         try:
+            if message.topic in self._unbatch_topics:
+                self._on_batch(client, userdata, message)
+                return
+            
+            listeners = self._listeners
+            if listeners and self._notify_listeners(listeners, message):
+                return
+            
+            # Routed messages are forwarded as they are, without decoding the payload
+            if self._routes is not None:
+                matches = self._routes.match(message.topic)
+                if matches:
+                    if self.config.dedup_content_hash and self.dedup is not None:
+                        # A 128-bit digest, so distinct messages do not collide and
+                        # the key is the same in every worker process
+                        key = hashlib.blake2b(message.topic.encode('utf-8') + b'\0' + message.payload, digest_size=16).digest()
+                        if self.check_duplicate(key)[0]:
+                            return
+                    self._forward_routed(message, matches)
+                    return
+            
+            # MQTT 5 responses are completed without decoding the payload
+            raw_response = self._get_raw_response(message)
+            if raw_response is not None:
+                self._resolve_pending(raw_response.correlation_id, raw_response, is_final_reply(message.properties))
+                return
+            
+            # Messages carrying their routing metadata in user properties or a
+            # compact header are forwarded as the original bytes
+            if self.config.passthrough or message.topic == self.response_topic:
+                metadata, body = read_metadata(message)
+                if metadata is not None:
+                    self._handle_raw_message(message.topic, metadata, body)
+                    return
+            
             # Parse the payload
-            payload = json.loads(message.payload.decode())
+            payload = self._decode_payload(message)
             correlation_id = payload.get('correlation_id')
             
-            if payload.get('identifier') == self.config.broker_id or correlation_id is None:
+            if self._is_own_identifier(payload.get('identifier')) or correlation_id is None:
                 return
             # Check if it's a response to a pending request
             if correlation_id and correlation_id in self._pending_requests:
                 # Handle the response for a pending request
-                future = self._pending_requests.pop(correlation_id)
-                response = MQTTResponse(
+                response = ResponseRecord(
                     status_code=payload.get('status_code', 200),
                     payload=payload.get('payload', {}),
                     correlation_id=correlation_id
                 )
-                if not future.done():
-                    self.loop.call_soon_threadsafe(future.set_result, response)
-            else:
+                self._resolve_pending(correlation_id, response, bool(payload.get('final', False)))
+            elif not self._drop_duplicate(payload.get('identifier'), correlation_id):
                 # Process as a new incoming request
                 # Create a task to handle it asynchronously
-                request = MQTTRequest(
+                request = RequestRecord(
                     topic=message.topic,
                     payload=payload.get('payload', {}),
-                    correlation_id=payload.get('correlation_id', str(uuid.uuid4())),
+                    correlation_id=correlation_id,
                     target_broker_id=payload.get('target_broker_id', ''),
                     is_response=payload.get('is_response', False)
                 )
                 src_indentifier = payload.get('identifier', '')
-                print("#" * 100)
-                logger.info(f"1. Received message from broker **{self.config.broker_id}** and ready for forward to the target broker **{payload.get('target_broker_id')}** at topic **{message.topic}**")
-                asyncio.run_coroutine_threadsafe(self._handle_message(src_indentifier, request), self.loop)
+                message_logger.info(
+                    "Received message from broker **%s** for target broker **%s** at topic **%s**",
+                    self.config.broker_id, request.target_broker_id, message.topic, extra={"correlation_id": correlation_id}
+                )
+                self._spawn(self._handle_message(src_indentifier, request, payload.get('traceparent')))
                 
         except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
+            ERRORS.labels(self.config.broker_id, 'receive').inc()
+            logger.error("Error processing message from broker **%s**: %s", self.config.broker_id, e)
+    
+    def _on_batch(self, client, userdata, message: MQTTMessage):
+        """Handle the messages packed in a batch envelope one by one"""
+        for topic, data, packed in unpack_batch(message.payload):
+            inner = MQTTMessage(message.mid, topic.encode('utf-8'))
+            inner.payload = data
+            inner.qos = message.qos
+            if packed:
+                inner.properties = Properties(PacketTypes.PUBLISH)
+                inner.properties.unpack(packed)
+            self._on_message(client, userdata, inner)
+    
+    def check_duplicate(self, key: Any) -> Tuple[bool, Optional[ResponseRecord]]:
+        """Check whether a request key was already received, with its cached response if any"""
+        seen, response = self.dedup.add(key)
+        (self._dedup_hits if seen else self._dedup_misses).inc()
+        return seen, response
+    
+    def _drop_duplicate(self, identifier: Optional[str], correlation_id: str) -> bool:
+        """
+        Check whether a request received from the broker is a duplicate to
+        drop. The cached response, if any, is published again to the requester
+        since it may have missed it
+        """
+        if self.dedup is None:
+            return False
+        seen, response = self.check_duplicate(correlation_id)
+        if not seen:
+            return False
+        message_logger.info(
+            "Dropped duplicate message from broker **%s**", self.config.broker_id, extra={"correlation_id": correlation_id}
+        )
+        if response is not None and identifier:
+            self._spawn(self._publish_response(identifier, response, correlation_id))
+        return True
     
-    async def _handle_message(self, src_indentifier: str, request: MQTTRequest) -> MQTTResponse:
-        """Handle an incoming message"""
+    def _forward_routed(self, message: MQTTMessage, matches: List[Tuple[Route, Tuple[str, ...]]]):
+        """Publish a message to the target broker of every matching route"""
+        for route, captures in matches:
+            try:
+                target_protocol = self._broker_registry.get_protocol(route.target)
+                topic = route.target_topic(message.topic, captures)
+                # MQTT 5 properties (content type, user properties) only mean something between MQTT 5 brokers
+                properties = None
+                if self.config.protocol_version == mqtt.MQTTv5 and target_protocol.config.protocol_version == mqtt.MQTTv5:
+                    properties = getattr(message, 'properties', None)
+                
+                if target_protocol._transport is None:
+                    # paho clients driven by their own thread can be called from any thread
+                    target_protocol.publish_nowait(topic, message.payload, route.qos, properties=properties, durable=True)
+                else:
+                    self._call_soon(target_protocol.publish_nowait, topic, message.payload, route.qos, None, properties, True)
+                
+                counter = self._routed_counters.get(route.target)
+                if counter is None:
+                    counter = self._routed_counters[route.target] = MESSAGES_FORWARDED.labels(self.config.broker_id, route.target)
+                counter.inc()
+                message_logger.debug(
+                    "Routed message from broker **%s** topic **%s** to broker **%s** topic **%s**",
+                    self.config.broker_id, message.topic, route.target, topic
+                )
+            except Exception as e:
+                ERRORS.labels(self.config.broker_id, 'forward').inc()
+                logger.error("Error routing message from topic **%s** to broker **%s**: %s", message.topic, route.target, e)
+    
+    async def _handle_message(
+        self, 
+        src_indentifier: str, 
+        request: RequestRecord, 
+        traceparent: Optional[str] = None
+    ) -> ResponseRecord:
+        """Handle an incoming message, continuing the trace of the sender if any"""
         try:
             # If a target broker is specified, route the request to it
             
             if request.target_broker_id and request.target_broker_id != self.config.broker_id:
-                logger.info(f"2. Routing request from broker **{self.config.broker_id}** to broker **{request.target_broker_id}**")
-                response = await self._route_to_target_broker(src_indentifier, request)
+                message_logger.info(
+                    "Routing request from broker **%s** to broker **%s**",
+                    self.config.broker_id, request.target_broker_id, extra={"correlation_id": request.correlation_id}
+                )
+                with TRACER.start_span('mqtt.forward', traceparent=traceparent, root=True) as span:
+                    span.set_attribute('mqtt.broker', self.config.broker_id)
+                    span.set_attribute('mqtt.target_broker', request.target_broker_id)
+                    span.set_attribute('mqtt.topic', request.topic)
+                    span.set_attribute('mqtt.correlation_id', request.correlation_id)
+                    response = await self._route_to_target_broker(src_indentifier, request)
+                if self.dedup is not None:
+                    self.dedup.complete(request.correlation_id, response)
                 return response
             else:
-                return MQTTResponse(
+                return ResponseRecord(
                     status_code=200,
                     payload={"message": "Request handled locally"},
                     correlation_id=request.correlation_id
                 )
             
         except Exception as e:
-            logger.error(f"Error handling message: {str(e)}")
-            return MQTTResponse(
+            ERRORS.labels(self.config.broker_id, 'handle').inc()
+            logger.error("Error handling message: %s", e, extra={"correlation_id": request.correlation_id})
+            return ResponseRecord(
                 status_code=500,
                 payload={"error": str(e)},
                 correlation_id=request.correlation_id
@@ -148,57 +693,220 @@ class BaseProtocol(IMQTTProtocol):
     
     
     
-    async def _route_to_target_broker(self, src_indentifier: str, request: MQTTRequest) -> MQTTResponse:
+    async def _route_to_target_broker(self, src_indentifier: str, request: RequestRecord) -> ResponseRecord:
         """Route the request to the target broker"""
+        started = time.perf_counter()
         try:
-            target_protocol = self._broker_registry.get_protocol(request.target_broker_id)
+            targets, group = self._broker_registry.resolve_targets(request.target_broker_id)
+            if group is not None or len(targets) > 1:
+                return await self._fan_out_to_brokers(src_indentifier, request, targets, group)
+            
+            # Requests go to the failover broker while the circuit of the target is open,
+            # a list of one broker is routed like its broker ID
+            target_protocol = self._broker_registry.select_protocol(targets[0])
+            target_id = target_protocol.get_identifier()
             response = None
             if request.is_response:
-                logger.info(f"3. Sending request to broker **{request.target_broker_id}** at topic **{request.topic}**")
-                response = await target_protocol.request(
+                message_logger.info(
+                    "Sending request to broker **%s** at topic **%s**",
+                    target_id, request.topic, extra={"correlation_id": request.correlation_id}
+                )
+                if request.raw_payload is not None:
+                    response = await target_protocol.request_raw(
+                        topic=request.topic,
+                        data=request.raw_payload,
+                        correlation_id=request.correlation_id,
+                        timeout=15.0  # Default timeout
+                    )
+                else:
+                    response = await target_protocol.request(
+                        topic=request.topic,
+                        payload=request.payload,
+                        correlation_id=request.correlation_id,
+                        timeout=15.0  # Default timeout
+                    )
+                message_logger.info(
+                    "Received response from broker **%s** to request at topic **%s**",
+                    target_id, request.topic, extra={"correlation_id": request.correlation_id}
+                )
+                await self._publish_response(src_indentifier, response, request.correlation_id)
+            elif request.raw_payload is not None:
+                # Forward the original bytes without re-encoding them
+                await target_protocol.publish_raw(
                     topic=request.topic,
-                    payload=request.payload,
+                    data=request.raw_payload,
+                    qos=target_protocol.get_qos(),
                     correlation_id=request.correlation_id,
-                    timeout=15.0  # Default timeout
-                )
-                logger.info(f"4. Received response from broker **{request.target_broker_id}** at response topic **{request.topic}**")
-                await self.publish(
-                    topic=src_indentifier,
-                    payload=response.payload,
-                    qos=self.config.qos
+                    durable=True
                 )
-                logger.info(f"5. Finnaly, Published response back to broker **{self.config.broker_id}** at response topic **{src_indentifier}**")
             else:
                 await target_protocol.publish(
                     topic=request.topic,
                     payload=request.payload,
-                    qos=target_protocol.get_qos()
+                    qos=target_protocol.get_qos(),
+                    correlation_id=request.correlation_id,
+                    durable=True
                 )
-                logger.info(f"3. Finnaly, Published request to broker **{request.target_broker_id}** at topic **{request.topic}**")
+                message_logger.info(
+                    "Published request to broker **%s** at topic **%s**",
+                    target_id, request.topic, extra={"correlation_id": request.correlation_id}
+                )
+            MESSAGES_FORWARDED.labels(self.config.broker_id, target_id).inc()
+            FORWARD_HOP.labels(target_id).observe(time.perf_counter() - started)
             return response
         except Exception as e:
-            logger.error(f"Error routing to target broker: {str(e)}")
-            return MQTTResponse(
+            ERRORS.labels(self.config.broker_id, 'forward').inc()
+            logger.error("Error routing to target broker: %s", e, extra={"correlation_id": request.correlation_id})
+            return ResponseRecord(
                 status_code=500,
                 payload={"error": f"Failed to route to broker: {request.target_broker_id}: {str(e)}"},
                 correlation_id=request.correlation_id
             )
     
     
+    async def _fan_out_to_brokers(
+        self,
+        src_indentifier: str,
+        request: RequestRecord,
+        targets: List[str],
+        group: Optional[BrokerGroupConfig]
+    ) -> Optional[ResponseRecord]:
+        """Send the request to several target brokers at once"""
+        started = time.perf_counter()
+        protocols = {broker_id: self._broker_registry.get_protocol(broker_id) for broker_id in targets}
+        response = None
+        failed: Dict[str, str] = {}
+        if request.is_response:
+            message_logger.info(
+                "Sending request to brokers **%s** at topic **%s**",
+                ', '.join(targets), request.topic, extra={"correlation_id": request.correlation_id}
+            )
+            async def send(protocol: 'BaseProtocol') -> ResponseRecord:
+                if request.raw_payload is not None:
+                    return await protocol.request_raw(request.topic, request.raw_payload, request.correlation_id, 15.0)
+                return await protocol.request(request.topic, request.payload, request.correlation_id, 15.0)
+            
+            response = await gather_responses(
+                protocols,
+                request.correlation_id,
+                send,
+                group.gather if group is not None else GATHER_ALL,
+                group.quorum if group is not None else None
+            )
+            await self._publish_response(src_indentifier, response, request.correlation_id)
+        else:
+            failed = publish_to_all(protocols, request.topic, request.payload, request.correlation_id, request.raw_payload)
+            for broker_id, error in failed.items():
+                ERRORS.labels(self.config.broker_id, 'forward').inc()
+                logger.error("Error publishing to broker %s: %s", broker_id, error, extra={"correlation_id": request.correlation_id})
+            message_logger.info(
+                "Published request to brokers **%s** at topic **%s**",
+                ', '.join(targets), request.topic, extra={"correlation_id": request.correlation_id}
+            )
+        
+        elapsed = time.perf_counter() - started
+        for broker_id in targets:
+            if broker_id not in failed:
+                MESSAGES_FORWARDED.labels(self.config.broker_id, broker_id).inc()
+                FORWARD_HOP.labels(broker_id).observe(elapsed)
+        return response
+    
+    async def _publish_response(self, src_indentifier: str, response: ResponseRecord, correlation_id: str):
+        """Publish the response of a forwarded request back to the requester"""
+        if response.raw_payload is not None:
+            # Forward the response body exactly as it was received
+            data, properties = self._mark_content_type(response.raw_payload, response.content_type)
+            await self.publish_raw(
+                topic=src_indentifier,
+                data=data,
+                qos=self.config.qos,
+                correlation_id=correlation_id,
+                properties=properties
+            )
+        else:
+            await self.publish(
+                topic=src_indentifier,
+                payload=response.payload,
+                qos=self.config.qos,
+                correlation_id=correlation_id
+            )
+        message_logger.info(
+            "Published response back to broker **%s** at response topic **%s**",
+            self.config.broker_id, src_indentifier, extra={"correlation_id": correlation_id}
+        )
+    
+    def _start_replay(self):
+        """Start replaying the spool unless it is empty or already replaying"""
+        if self._replay_task is None or self._replay_task.done():
+            if self._running and self.spool.pending:
+                self._replay_task = self.loop.create_task(self._replay_spool())
+    
+    async def _replay_spool(self):
+        """Publish the spooled messages in order while the broker stays connected"""
+        rate = self.config.spool_replay_rate
+        batch_size = SPOOL_REPLAY_BATCH if rate is None else max(1, min(SPOOL_REPLAY_BATCH, int(rate / 10)))
+        logger.info(f"Replaying {self.spool.pending} spooled messages to broker **{self.config.broker_id}**")
+        started = time.perf_counter()
+        replayed = 0
+        while self._running and self.client.is_connected():
+            backpressure = self.get_backpressure()
+            if backpressure["inflight"] + backpressure["queued"] >= SPOOL_REPLAY_WINDOW:
+                await asyncio.sleep(0.01)
+                continue
+            
+            batch = self.spool.read(batch_size)
+            if batch is None:
+                break
+            for message in batch.messages:
+                properties = None
+                if message.properties:
+                    properties = Properties(PacketTypes.PUBLISH)
+                    properties.unpack(message.properties)
+                self._select_client(message.topic).publish(message.topic, message.data, qos=message.qos, properties=properties)
+            self._messages_out.inc(len(batch.messages))
+            # Moved past the batch only once paho has it, a crash before replays it again
+            self.spool.commit(batch)
+            replayed += len(batch.messages)
+            
+            # Pace the replay at spool_replay_rate messages per second
+            delay = replayed / rate - (time.perf_counter() - started) if rate else 0
+            await asyncio.sleep(max(0, delay))
+        logger.info(f"Replayed {replayed} spooled messages to broker **{self.config.broker_id}**, {self.spool.pending} left")
+    
+    async def _sync_spool(self):
+        """Fsync the spool writes in batches, expire old messages and resume interrupted replays"""
+        while True:
+            await asyncio.sleep(self.config.spool_fsync_interval)
+            try:
+                self.spool.expire()
+                flushed = self.spool.flush()
+                if flushed is not None:
+                    await self.loop.run_in_executor(None, self.spool.fsync, *flushed)
+                if self.client.is_connected():
+                    self._start_replay()
+            except Exception as e:
+                ERRORS.labels(self.config.broker_id, 'spool').inc()
+                logger.error(f"Error syncing the spool of broker **{self.config.broker_id}**: {e}")
+    
     async def start(self):
         """Start the MQTT client"""
         if self._running:
             return
         
-        # Connect to the broker
-        self.client.connect_async(
-            host=self.config.host,
-            port=self.config.port,
-            keepalive=self.config.keepalive
-        )
+        if self.spool is not None:
+            self.spool.open()
+            self._spool_task = self.loop.create_task(self._sync_spool())
         
-        # Start the MQTT loop in a separate thread
-        self.client.loop_start()
+        for index, client in enumerate(self._publish_clients):
+            if self._transports:
+                # Connect and run the socket I/O on the event loop
+                await self._transports[index].start(**self._connect_kwargs())
+            else:
+                # Connect to the broker
+                client.connect_async(**self._connect_kwargs())
+                
+                # Start the MQTT loop in a separate thread
+                client.loop_start()
         self._running = True
         logger.info(f"Started MQTT protocol for broker **{self.config.broker_id}**")
     
@@ -207,19 +915,71 @@ class BaseProtocol(IMQTTProtocol):
         if not self._running:
             return
         
+        self.connection.on_stopped()
+        
         # Cancel any pending requests
-        for correlation_id, future in self._pending_requests.items():
-            if not future.done():
-                future.cancel()
+        self._pending_requests.cancel_all()
+        
+        # Send the messages still waiting in the batcher
+        if self._batcher is not None:
+            self._batcher.flush()
         
-        # Disconnect and stop the loop
-        self.client.disconnect()
-        self.client.loop_stop()
+        # Disconnect and stop the loops
+        for index, client in enumerate(self._publish_clients):
+            client.disconnect()
+            if self._transports:
+                await self._transports[index].stop()
+            else:
+                client.loop_stop()
         self._running = False
+        
+        if self.spool is not None:
+            for task in (self._spool_task, self._replay_task):
+                if task is not None:
+                    task.cancel()
+            self.spool.close()
         logger.info(f"Stopped MQTT protocol for broker **{self.config.broker_id}**")
     
-    async def publish(self, topic: str, payload: Dict[str, Any], qos: int = None):
-        """Publish a message to a topic"""
+    async def publish(
+        self, 
+        topic: str, 
+        payload: Dict[str, Any], 
+        qos: int = None, 
+        correlation_id: Optional[str] = None,
+        properties: Optional[Properties] = None,
+        durable: bool = False
+    ):
+        """Publish a message to a topic, spreading publishes over the connection pool"""
+        # Encode the payload with the codec of the broker
+        data, properties = self._encode_payload(payload, properties)
+        await self.publish_raw(topic, data, qos, correlation_id, properties, durable)
+    
+    async def publish_raw(
+        self, 
+        topic: str, 
+        data: bytes, 
+        qos: int = None, 
+        correlation_id: Optional[str] = None,
+        properties: Optional[Properties] = None,
+        durable: bool = False
+    ):
+        """Publish an already encoded message to a topic"""
+        self.publish_nowait(topic, data, qos, correlation_id, properties, durable)
+    
+    def publish_nowait(
+        self, 
+        topic: str, 
+        data: bytes, 
+        qos: Optional[int] = None, 
+        correlation_id: Optional[str] = None,
+        properties: Optional[Properties] = None,
+        durable: bool = False
+    ):
+        """
+        Queue an already encoded message on the paho client, paho sends it from
+        its network loop. Durable messages go to the spool, if the broker has
+        one, while it is disconnected or older spooled messages are waiting
+        """
         if not self._running:
             raise RuntimeError("MQTT protocol not running")
         
@@ -227,11 +987,124 @@ class BaseProtocol(IMQTTProtocol):
         if qos is None:
             qos = self.config.qos
         
-        # Convert the payload to JSON
-        message = json.dumps(payload).encode('utf-8')
+        if durable and self.spool is not None:
+            packed = properties.pack() if properties is not None else None
+            if self.spool.offer(topic, data, qos, packed, self.client.is_connected()):
+                return
+        
+        if self._batcher is not None:
+            self._batcher.add(BatchedMessage(topic, data, qos, properties, correlation_id or topic))
+            return
         
-        # Publish the message
-        self.client.publish(topic, message, qos=qos)
+        # Publish the message on the pool connection for this correlation ID or topic
+        self._select_client(correlation_id or topic).publish(topic, data, qos=qos, properties=properties)
+        self._messages_out.inc()
+    
+    def _flush_batch(self, batch: List[BatchedMessage]):
+        """
+        Publish a batch of messages from the batcher, packed in one envelope
+        if the broker has a batch topic, one by one otherwise
+        """
+        try:
+            if self.config.publish_batch_topic is not None and len(batch) > 1:
+                self.client.publish(
+                    self.config.publish_batch_topic, pack_batch(batch), qos=max(message.qos for message in batch)
+                )
+                self._messages_out.inc()
+                clients = (self.client,)
+            else:
+                clients = set()
+                for message in batch:
+                    client = self._select_client(message.key)
+                    client.publish(message.topic, message.data, qos=message.qos, properties=message.properties)
+                    clients.add(client)
+                self._messages_out.inc(len(batch))
+            
+            # In asyncio mode the packets are only queued so far, write them together
+            for index, client in enumerate(self._publish_clients):
+                if self._transports and client in clients:
+                    self._transports[index].write_now()
+        except Exception as e:
+            ERRORS.labels(self.config.broker_id, 'publish').inc()
+            logger.error("Error publishing a batch of %d messages to broker **%s**: %s", len(batch), self.config.broker_id, e)
+    
+    def _response_properties(self, correlation_id: str) -> Optional[Properties]:
+        """Get the MQTT 5 request/response properties for a request, None before MQTT 5"""
+        if self.config.protocol_version != mqtt.MQTTv5:
+            return None
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.ResponseTopic = self.response_topic
+        properties.CorrelationData = correlation_id.encode('utf-8')
+        return properties
+    
+    async def _wait_for_response(self, correlation_id: str, future: asyncio.Future) -> ResponseRecord:
+        """Wait for the response to a pending request, the table expires it on timeout"""
+        started = time.perf_counter()
+        sent_at = time.monotonic()
+        try:
+            response = await future
+            self.connection.record_success(time.perf_counter() - started)
+            return response
+        except asyncio.TimeoutError:
+            self._requests_timed_out.inc()
+            self.connection.record_timeout(sent_at)
+            logger.warning("Request timed out for correlation ID: %s", correlation_id, extra={"correlation_id": correlation_id})
+            return ResponseRecord(
+                status_code=408,
+                payload={"error": "Request timed out"},
+                correlation_id=correlation_id
+            )
+        except PendingRequestEvicted:
+            return ResponseRecord(
+                status_code=503,
+                payload={"error": "Request evicted, too many pending requests"},
+                correlation_id=correlation_id
+            )
+        except Exception as e:
+            # Remove the pending request if there's an error
+            self._pending_requests.discard(correlation_id)
+            self.connection.record_failure()
+            ERRORS.labels(self.config.broker_id, 'request').inc()
+            logger.error("Error while waiting for response: %s", e, extra={"correlation_id": correlation_id})
+            return ResponseRecord(
+                status_code=500,
+                payload={"error": str(e)},
+                correlation_id=correlation_id
+            )
+        finally:
+            self._request_wait.observe(time.perf_counter() - started)
+    
+    def _add_pending(self, correlation_id: str, timeout: float) -> Optional[asyncio.Future]:
+        """Register a pending request, None if the table is full"""
+        try:
+            return self._pending_requests.add(correlation_id, timeout)
+        except PendingRequestsFull as e:
+            logger.warning("Rejected request for correlation ID %s: %s", correlation_id, e, extra={"correlation_id": correlation_id})
+            return None
+    
+    def _start_request_span(self, topic: str, correlation_id: str):
+        """Start the span covering a request to this broker, from publish to response"""
+        span = TRACER.start_span('mqtt.request')
+        span.set_attribute('mqtt.broker', self.config.broker_id)
+        span.set_attribute('mqtt.topic', topic)
+        span.set_attribute('mqtt.correlation_id', correlation_id)
+        return span
+    
+    def _overloaded_response(self, correlation_id: str) -> ResponseRecord:
+        """Get the response for a request rejected because the pending table is full"""
+        return ResponseRecord(
+            status_code=503,
+            payload={"error": "Too many pending requests"},
+            correlation_id=correlation_id
+        )
+    
+    def _unavailable_response(self, correlation_id: str) -> ResponseRecord:
+        """Get the response for a request failed fast because the circuit of the broker is open"""
+        return ResponseRecord(
+            status_code=503,
+            payload={"error": f"Broker {self.config.broker_id} is unavailable ({self.connection.state}, circuit open)"},
+            correlation_id=correlation_id
+        )
     
     async def request(
         self, 
@@ -239,43 +1112,121 @@ class BaseProtocol(IMQTTProtocol):
         payload: Dict[str, Any], 
         correlation_id: str, 
         timeout: float = 30.0
-    ) -> MQTTResponse:
+    ) -> ResponseRecord:
         """Send a request and wait for a response"""
         if not self._running:
             raise RuntimeError("MQTT protocol not running")
         
+        # Fail fast rather than wait for a response that can not come
+        if not self.connection.allow_request():
+            return self._unavailable_response(correlation_id)
+        
         # Create a future to wait for the response
-        future = self.loop.create_future()
-        self._pending_requests[correlation_id] = future
+        future = self._add_pending(correlation_id, timeout)
+        if future is None:
+            return self._overloaded_response(correlation_id)
+        
+        with self._start_request_span(topic, correlation_id) as span:
+            await self._publish_request(topic, payload, correlation_id, span.traceparent)
+            response = await self._wait_for_response(correlation_id, future)
+            span.set_attribute('mqtt.status_code', response.status_code)
+            return response
+    
+    async def request_stream(
+        self,
+        topic: str,
+        payload: Dict[str, Any],
+        correlation_id: str,
+        timeout: float = 30.0,
+        max_replies: Optional[int] = None,
+        buffer_size: int = 100
+    ) -> Optional[ReplyStream]:
+        """
+        Send a request and get the stream of its responses, open until
+        max_replies responses, a response marked final or the timeout. None if
+        the pending request table is full. Call discard_pending when done
+        reading before the stream ended
+        """
+        if not self._running:
+            raise RuntimeError("MQTT protocol not running")
+        
+        try:
+            stream = self._pending_requests.add_stream(correlation_id, timeout, max_replies, buffer_size)
+        except PendingRequestsFull as e:
+            logger.warning("Rejected request for correlation ID %s: %s", correlation_id, e, extra={"correlation_id": correlation_id})
+            return None
         
+        with self._start_request_span(topic, correlation_id) as span:
+            span.set_attribute('mqtt.stream', True)
+            await self._publish_request(topic, payload, correlation_id, span.traceparent)
+        return stream
+    
+    def discard_pending(self, correlation_id: str):
+        """Stop waiting for the responses to a request"""
+        self._pending_requests.discard(correlation_id)
+    
+    async def _publish_request(self, topic: str, payload: Dict[str, Any], correlation_id: str, traceparent: Optional[str]):
+        """Publish a request envelope, forgetting the pending request if that fails"""
         # Prepare the payload with correlation ID
         full_payload = {
-            "identifier": self.config.broker_id,
+            "identifier": self.response_topic,
             "payload": payload,
             "correlation_id": correlation_id
         }
+        if traceparent:
+            full_payload["traceparent"] = traceparent
         
-        # Publish the request
-        await self.publish(topic, full_payload, self.config.qos)
+        # MQTT 5 responders can also reply using the request/response properties
+        properties = self._response_properties(correlation_id)
         
+        # Publish the request
         try:
-            # Wait for the response with timeout
-            return await asyncio.wait_for(future, timeout=timeout)
-        except asyncio.TimeoutError:
-            # Remove the pending request if it times out
-            self._pending_requests.pop(correlation_id, None)
-            logger.warning(f"Request timed out for correlation ID: {correlation_id}")
-            return MQTTResponse(
-                status_code=408,
-                payload={"error": "Request timed out"},
-                correlation_id=correlation_id
+            await self.publish(topic, full_payload, self.config.qos, correlation_id=correlation_id, properties=properties)
+        except Exception:
+            self._pending_requests.discard(correlation_id)
+            raise
+    
+    async def request_raw(
+        self, 
+        topic: str, 
+        data: bytes, 
+        correlation_id: str, 
+        timeout: float = 30.0
+    ) -> ResponseRecord:
+        """Send an already encoded request body and wait for a response"""
+        if not self._running:
+            raise RuntimeError("MQTT protocol not running")
+        
+        # Fail fast rather than wait for a response that can not come
+        if not self.connection.allow_request():
+            return self._unavailable_response(correlation_id)
+        
+        # Create a future to wait for the response
+        future = self._add_pending(correlation_id, timeout)
+        if future is None:
+            return self._overloaded_response(correlation_id)
+        
+        with self._start_request_span(topic, correlation_id) as span:
+            # The routing metadata travels in user properties with MQTT 5 and in
+            # the compact header otherwise, the body itself is left untouched
+            metadata = MessageMetadata(
+                correlation_id=correlation_id,
+                identifier=self.response_topic,
+                traceparent=span.traceparent or ''
             )
-        except Exception as e:
-            # Remove the pending request if there's an error
-            self._pending_requests.pop(correlation_id, None)
-            logger.error(f"Error while waiting for response: {str(e)}")
-            return MQTTResponse(
-                status_code=500,
-                payload={"error": str(e)},
-                correlation_id=correlation_id
-            ) 
\ No newline at end of file
+            properties = self._response_properties(correlation_id)
+            try:
+                if properties is not None:
+                    await self.publish_raw(
+                        topic, data, self.config.qos, correlation_id=correlation_id,
+                        properties=metadata_to_properties(metadata, properties)
+                    )
+                else:
+                    await self.publish_raw(topic, encode_header(metadata) + data, self.config.qos, correlation_id=correlation_id)
+            except Exception:
+                self._pending_requests.discard(correlation_id)
+                raise
+            
+            response = await self._wait_for_response(correlation_id, future)
+            span.set_attribute('mqtt.status_code', response.status_code)
+            return response
@@ -0,0 +1,133 @@
+import asyncio
+import struct
+import threading
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from paho.mqtt.properties import Properties
+
+# Batch envelope packing several messages in one MQTT payload:
+#   @mqb then per message >HIH (topic, payload and MQTT 5 properties lengths),
+#   the UTF-8 topic, the payload and the packed properties
+BATCH_PREFIX = b'@mqb'
+_RECORD = struct.Struct('>HIH')
+
+class BatchedMessage(NamedTuple):
+    """Message waiting in the publish batcher"""
+    topic: str
+    data: bytes
+    qos: int
+    properties: Optional[Properties]
+    # Picks the pool connection, see BaseProtocol._select_client
+    key: str
+
+def pack_batch(messages: Iterable[BatchedMessage]) -> bytes:
+    """Pack messages in one batch envelope"""
+    parts = [BATCH_PREFIX]
+    for message in messages:
+        topic = message.topic.encode('utf-8')
+        packed = message.properties.pack() if message.properties is not None else b''
+        parts.append(_RECORD.pack(len(topic), len(message.data), len(packed)))
+        parts.append(topic)
+        parts.append(message.data)
+        parts.append(packed)
+    return b''.join(parts)
+
+def unpack_batch(data: bytes) -> List[Tuple[str, bytes, bytes]]:
+    """Get the topic, payload and packed MQTT 5 properties of the messages of a batch envelope"""
+    if not data.startswith(BATCH_PREFIX):
+        raise ValueError("Not a batch envelope")
+    view = memoryview(data)
+    messages = []
+    offset = len(BATCH_PREFIX)
+    while offset < len(data):
+        if offset + _RECORD.size > len(data):
+            raise ValueError("Truncated batch envelope")
+        topic_length, data_length, properties_length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        end = offset + topic_length + data_length + properties_length
+        if end > len(data):
+            raise ValueError("Truncated batch envelope")
+        topic = str(view[offset:offset + topic_length], 'utf-8')
+        offset += topic_length
+        payload = bytes(view[offset:offset + data_length])
+        offset += data_length
+        messages.append((topic, payload, bytes(view[offset:end])))
+        offset = end
+    return messages
+
+class PublishBatcher:
+    """
+    Nagle-style coalescing of the messages published to one broker.
+
+    Messages are collected for up to ``max_delay`` seconds, 0 meaning until
+    the end of the current event loop iteration, or until ``max_bytes``
+    bytes are waiting, then handed to ``flush`` together. Messages can be
+    added from paho threads, ``flush`` always runs on the event loop.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        flush: Callable[[List[BatchedMessage]], None],
+        max_delay: float = 0.0,
+        max_bytes: int = 65536
+    ):
+        self.loop = loop
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self._flush = flush
+        self._pending: List[BatchedMessage] = []
+        self._bytes = 0
+        # Whether a flush is already planned, by the timer or because the batch is full
+        self._timer_set = False
+        self._flush_set = False
+        self._timer: Optional[asyncio.Handle] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _call_in_loop(self, callback: Callable[[], None]):
+        """Run a callback on the event loop, whichever thread adds the message"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self.loop:
+            callback()
+        else:
+            self.loop.call_soon_threadsafe(callback)
+
+    def add(self, message: BatchedMessage):
+        """Add a message to the current batch"""
+        with self._lock:
+            self._pending.append(message)
+            self._bytes += len(message.data) + len(message.topic)
+            start_timer = not self._timer_set
+            self._timer_set = True
+            flush_now = self._bytes >= self.max_bytes and not self._flush_set
+            if flush_now:
+                self._flush_set = True
+        if flush_now:
+            self._call_in_loop(self.flush)
+        elif start_timer:
+            self._call_in_loop(self._start_timer)
+
+    def _start_timer(self):
+        if self.max_delay > 0:
+            self._timer = self.loop.call_later(self.max_delay, self.flush)
+        else:
+            self._timer = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        """Hand the messages waiting to the flush callback"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._bytes = 0
+            self._timer_set = self._flush_set = False
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if batch:
+            self._flush(batch)
@@ -0,0 +1,170 @@
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Connection states of a broker
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+RECONNECTING = 'reconnecting'
+STOPPED = 'stopped'
+
+# Circuit breaker states: requests flow when closed, fail fast when open and
+# one probe request at a time is let through when half open
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+def backoff_delay(attempt: int, min_delay: float, max_delay: float) -> float:
+    """
+    Delay before reconnect attempt number attempt (from 1): exponential from
+    min_delay up to max_delay, with equal jitter so adapters that lost the
+    same broker do not all reconnect at the same instant
+    """
+    cap = min(max_delay, min_delay * 2 ** (attempt - 1))
+    return cap / 2 + random.uniform(0, cap / 2)
+
+class ConnectionMonitor:
+    """
+    Connection state machine and circuit breaker of one broker.
+
+    The connection goes from ``connecting`` to ``connected``, to
+    ``reconnecting`` when it drops and back, and to ``stopped``. Losing the
+    connection opens the circuit right away, since requests could only time
+    out, and so do ``failure_threshold`` consecutive failed requests while
+    connected. A timeout only counts as a failure when nothing came from the
+    broker while the request waited, otherwise it is one device not
+    answering and shows the broker is alive. An open circuit lets one probe request
+    through every ``reset_timeout`` seconds once the broker is connected: its
+    success closes the circuit, its failure opens it again.
+
+    Updated from the paho callbacks, possibly on paho threads, and read on
+    the event loop, so every change holds a lock.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: Optional[int] = 5,
+        reset_timeout: float = 10.0
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CONNECTING
+        self.circuit = CIRCUIT_OPEN
+        self.failures = 0
+        self.reconnect_attempts = 0
+        self.disconnects = 0
+        self.last_error: Optional[str] = None
+        # Response time of the last successful request and arrival of the last message
+        self.last_latency: Optional[float] = None
+        self.last_message_at: Optional[float] = None
+        self._state_since = time.monotonic()
+        self._opened_at = self._state_since
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        self.state = state
+        self._state_since = time.monotonic()
+
+    def _open_circuit(self):
+        self.circuit = CIRCUIT_OPEN
+        self._opened_at = time.monotonic()
+        self._probe_started = None
+
+    def on_connected(self):
+        with self._lock:
+            self._set_state(CONNECTED)
+            self.reconnect_attempts = 0
+            self.failures = 0
+            self.circuit = CIRCUIT_CLOSED
+            self._probe_started = None
+
+    def on_disconnected(self, reason: Optional[str] = None):
+        with self._lock:
+            if self.state == STOPPED:
+                return
+            if self.state == CONNECTED:
+                self.disconnects += 1
+            self._set_state(RECONNECTING)
+            self.last_error = reason
+            self._open_circuit()
+
+    def on_connect_failed(self, reason: Optional[str] = None):
+        with self._lock:
+            if self.state != STOPPED:
+                self.reconnect_attempts += 1
+                self.last_error = reason
+
+    def on_stopped(self):
+        with self._lock:
+            self._set_state(STOPPED)
+            self._open_circuit()
+
+    @property
+    def available(self) -> bool:
+        """Whether a request would be let through now, without taking the probe slot"""
+        if self.circuit == CIRCUIT_CLOSED:
+            return True
+        return self.state == CONNECTED and self._probe_due(time.monotonic())
+
+    def _probe_due(self, now: float) -> bool:
+        if self.circuit == CIRCUIT_OPEN:
+            return now - self._opened_at >= self.reset_timeout
+        # Half open: a probe lost without an outcome (e.g. rejected locally) is replaced
+        return self._probe_started is None or now - self._probe_started >= self.reset_timeout
+
+    def allow_request(self) -> bool:
+        """Whether a request may be sent now, taking the probe slot when the circuit is not closed"""
+        if self.circuit == CIRCUIT_CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state != CONNECTED or not self._probe_due(now):
+                return False
+            self.circuit = CIRCUIT_HALF_OPEN
+            self._probe_started = now
+            return True
+
+    def record_success(self, latency: float):
+        self.last_latency = latency
+        self._record_alive()
+
+    def _record_alive(self):
+        if self.failures or self.circuit != CIRCUIT_CLOSED:
+            with self._lock:
+                self.failures = 0
+                if self.circuit == CIRCUIT_HALF_OPEN:
+                    self.circuit = CIRCUIT_CLOSED
+                    self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.circuit == CIRCUIT_HALF_OPEN or (
+                self.failure_threshold is not None and self.failures >= self.failure_threshold
+            ):
+                self._open_circuit()
+
+    def record_timeout(self, sent_at: float):
+        """Record a request sent at sent_at (monotonic time) that got no response"""
+        last_message_at = self.last_message_at
+        if last_message_at is not None and last_message_at >= sent_at:
+            self._record_alive()
+        else:
+            self.record_failure()
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the connection and circuit state with the last seen latency"""
+        now = time.monotonic()
+        return {
+            "state": self.state,
+            "state_seconds": round(now - self._state_since, 3),
+            "circuit": self.circuit,
+            "consecutive_failures": self.failures,
+            "reconnect_attempts": self.reconnect_attempts,
+            "disconnects": self.disconnects,
+            "last_error": self.last_error,
+            "last_latency_ms": round(self.last_latency * 1000, 3) if self.last_latency is not None else None,
+            "last_message_seconds_ago": round(now - self.last_message_at, 3) if self.last_message_at is not None else None,
+        }
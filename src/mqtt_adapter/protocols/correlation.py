@@ -0,0 +1,306 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_REJECT = 'reject'
+OVERFLOW_EVICT_OLDEST = 'evict_oldest'
+
+class PendingRequestsFull(Exception):
+    """Raised when a request is added to a full table with the reject policy"""
+
+class PendingRequestEvicted(Exception):
+    """Set on the future of a request evicted to make room for a newer one"""
+
+# Reasons a reply stream ends
+STREAM_COUNT = 'count'
+STREAM_FINAL = 'final'
+STREAM_DEADLINE = 'deadline'
+STREAM_CANCELLED = 'cancelled'
+STREAM_EVICTED = 'evicted'
+
+class ReplyStream:
+    """
+    Replies to a request that stays open for several responses, read with
+    ``async for``. At most ``buffer_size`` replies are buffered, replies
+    arriving while the reader is that far behind are dropped and counted, so a
+    slow reader can not make the adapter buffer without bounds.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        correlation_id: str,
+        max_replies: Optional[int] = None,
+        buffer_size: int = 100
+    ):
+        self.loop = loop
+        self.correlation_id = correlation_id
+        self.max_replies = max_replies
+        self.buffer_size = buffer_size
+        self.received = 0
+        self.dropped = 0
+        # Why the stream ended, None while it is open
+        self.reason: Optional[str] = None
+        self._buffer: Deque[Any] = deque()
+        self._waiter: Optional[asyncio.Future] = None
+
+    @property
+    def closed(self) -> bool:
+        return self.reason is not None
+
+    @property
+    def complete(self) -> bool:
+        """Whether the expected number of replies was received"""
+        return self.max_replies is not None and self.received >= self.max_replies
+
+    def push(self, reply: Any):
+        """Add a reply, dropping it if the buffer is full"""
+        self.received += 1
+        if len(self._buffer) >= self.buffer_size:
+            self.dropped += 1
+            return
+        self._buffer.append(reply)
+        self._wake()
+
+    def close(self, reason: str):
+        """End the stream, the buffered replies can still be read"""
+        if self.reason is None:
+            self.reason = reason
+            self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def __aiter__(self) -> 'ReplyStream':
+        return self
+
+    async def __anext__(self) -> Any:
+        while not self._buffer:
+            if self.reason is not None:
+                raise StopAsyncIteration
+            self._waiter = self.loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._buffer.popleft()
+
+class _Entry:
+    """Pending request stored in the table and in one timer wheel slot"""
+    __slots__ = ('future', 'stream', 'slot', 'rounds')
+
+    def __init__(self, future: Optional[asyncio.Future], stream: Optional[ReplyStream], slot: int, rounds: int):
+        self.future = future
+        self.stream = stream
+        self.slot = slot
+        self.rounds = rounds
+
+    def cancel(self, reason: str = STREAM_CANCELLED):
+        """Cancel the waiter, or end the stream with reason"""
+        if self.stream is not None:
+            self.stream.close(reason)
+        elif not self.future.done():
+            self.future.cancel()
+
+class CorrelationTable:
+    """
+    Bounded table of the requests waiting for a response, keyed by correlation ID.
+
+    Timeouts are tracked with a hashed timer wheel: each entry sits in the slot
+    of the tick it expires on, with the number of full wheel rounds left, and a
+    single loop timer advances the wheel while entries are pending. This avoids
+    one TimerHandle and one ``wait_for`` task per request.
+
+    A request gets either a future completed by its first response, or a
+    ReplyStream that takes every response until ``max_replies``, a reply
+    marked final or the timeout.
+
+    All methods except ``__contains__`` must be called on the event loop thread.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        capacity: int = 10000,
+        overflow_policy: str = OVERFLOW_REJECT,
+        tick: float = 0.1,
+        wheel_size: int = 512
+    ):
+        if overflow_policy not in (OVERFLOW_REJECT, OVERFLOW_EVICT_OLDEST):
+            raise ValueError(f"Unsupported overflow policy: {overflow_policy}")
+        self.loop = loop
+        self.capacity = capacity
+        self.overflow_policy = overflow_policy
+        self.tick = tick
+        self.wheel_size = wheel_size
+        # Insertion ordered, so the first entry is always the oldest
+        self._entries: Dict[str, _Entry] = {}
+        self._wheel: List[Dict[str, _Entry]] = [{} for _ in range(wheel_size)]
+        self._current_tick = 0
+        self._started_at = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._counters = {
+            "added": 0,
+            "resolved": 0,
+            "expired": 0,
+            "evicted": 0,
+            "rejected": 0,
+            "cancelled": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, correlation_id: str) -> bool:
+        # Plain dict lookup, safe to call from the paho network thread
+        return correlation_id in self._entries
+
+    def add(self, correlation_id: str, timeout: float) -> asyncio.Future:
+        """Register a pending request and get the future its response is set on"""
+        entry = self._insert(correlation_id, timeout, self.loop.create_future(), None)
+        # Drop the entry as soon as the waiter goes away, e.g. a cancelled HTTP handler
+        entry.future.add_done_callback(lambda future: self._on_done(correlation_id, future))
+        return entry.future
+
+    def add_stream(
+        self,
+        correlation_id: str,
+        timeout: float,
+        max_replies: Optional[int] = None,
+        buffer_size: int = 100
+    ) -> ReplyStream:
+        """Register a pending request taking several responses until timeout"""
+        stream = ReplyStream(self.loop, correlation_id, max_replies, buffer_size)
+        self._insert(correlation_id, timeout, None, stream)
+        return stream
+
+    def _insert(
+        self,
+        correlation_id: str,
+        timeout: float,
+        future: Optional[asyncio.Future],
+        stream: Optional[ReplyStream]
+    ) -> _Entry:
+        if correlation_id in self._entries:
+            # A request reusing a correlation ID replaces the previous one
+            self._remove(correlation_id).cancel()
+        elif len(self._entries) >= self.capacity:
+            if self.overflow_policy == OVERFLOW_REJECT:
+                self._counters["rejected"] += 1
+                raise PendingRequestsFull(f"Too many pending requests ({self.capacity})")
+            self._evict_oldest()
+
+        if not self._entries:
+            self._start_wheel()
+
+        # Round up from the loop clock rather than the last tick processed, so a
+        # request never expires before its timeout
+        due_tick = int(-(-(self.loop.time() - self._started_at + timeout) // self.tick))
+        ticks = max(1, due_tick - self._current_tick)
+        due_tick = self._current_tick + ticks
+        slot = due_tick % self.wheel_size
+        entry = _Entry(future, stream, slot, (ticks - 1) // self.wheel_size)
+        self._entries[correlation_id] = entry
+        self._wheel[slot][correlation_id] = entry
+        self._counters["added"] += 1
+        return entry
+
+    def resolve(self, correlation_id: str, result: Any, final: bool = False) -> bool:
+        """
+        Complete a pending request, or add a reply to its stream, ending it
+        when final. False if it is no longer pending
+        """
+        entry = self._entries.get(correlation_id)
+        if entry is None:
+            return False
+        if entry.stream is not None:
+            entry.stream.push(result)
+            if final or entry.stream.complete:
+                self._remove(correlation_id)
+                entry.stream.close(STREAM_FINAL if final else STREAM_COUNT)
+                self._counters["resolved"] += 1
+            return True
+        self._remove(correlation_id)
+        if entry.future.done():
+            return False
+        entry.future.set_result(result)
+        self._counters["resolved"] += 1
+        return True
+
+    def discard(self, correlation_id: str):
+        """Forget a pending request without completing it"""
+        entry = self._entries.get(correlation_id)
+        if entry is not None:
+            self._remove(correlation_id)
+            entry.cancel()
+
+    def cancel_all(self):
+        """Cancel all pending requests"""
+        for correlation_id in list(self._entries):
+            self.discard(correlation_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get the current size, capacity and lifetime counters of the table"""
+        return {"size": len(self._entries), "capacity": self.capacity, **self._counters}
+
+    def _remove(self, correlation_id: str) -> _Entry:
+        entry = self._entries.pop(correlation_id)
+        self._wheel[entry.slot].pop(correlation_id, None)
+        if not self._entries:
+            self._stop_wheel()
+        return entry
+
+    def _on_done(self, correlation_id: str, future: asyncio.Future):
+        """Remove the entry of a future completed or cancelled outside the table"""
+        entry = self._entries.get(correlation_id)
+        if entry is None or entry.future is not future:
+            return
+        self._remove(correlation_id)
+        if future.cancelled():
+            self._counters["cancelled"] += 1
+
+    def _evict_oldest(self):
+        correlation_id = next(iter(self._entries))
+        entry = self._remove(correlation_id)
+        self._counters["evicted"] += 1
+        logger.warning("Evicted pending request for correlation ID: %s", correlation_id)
+        if entry.stream is not None:
+            entry.stream.close(STREAM_EVICTED)
+        elif not entry.future.done():
+            entry.future.set_exception(PendingRequestEvicted(correlation_id))
+
+    def _start_wheel(self):
+        """Anchor the wheel to the loop clock and schedule the first tick"""
+        self._current_tick = 0
+        self._started_at = self.loop.time()
+        self._timer = self.loop.call_at(self._started_at + self.tick, self._advance)
+
+    def _stop_wheel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _advance(self):
+        """Expire the entries of every tick elapsed since the last call"""
+        self._timer = None
+        due_tick = int((self.loop.time() - self._started_at) / self.tick)
+        while self._current_tick < due_tick and self._entries:
+            self._current_tick += 1
+            slot = self._wheel[self._current_tick % self.wheel_size]
+            for correlation_id, entry in list(slot.items()):
+                if entry.rounds > 0:
+                    entry.rounds -= 1
+                    continue
+                self._remove(correlation_id)
+                self._counters["expired"] += 1
+                if entry.stream is not None:
+                    entry.stream.close(STREAM_DEADLINE)
+                elif not entry.future.done():
+                    entry.future.set_exception(asyncio.TimeoutError())
+
+        if self._entries and self._timer is None:
+            self._timer = self.loop.call_at(self._started_at + (self._current_tick + 1) * self.tick, self._advance)
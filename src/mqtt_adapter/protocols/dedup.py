@@ -0,0 +1,103 @@
+import threading
+import time
+from array import array
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from ..models import ResponseRecord
+
+class DedupCache:
+    """
+    Bounded cache of the recently seen request keys, to drop duplicates.
+
+    Keys are correlation IDs, or hashes of the message content, kept in a
+    fixed-size ring of ``capacity`` slots with a dict from key to slot. A new
+    key takes the next slot, overwriting the oldest one, so memory stays
+    bounded however fast keys arrive. A key is a duplicate while it is less
+    than ``ttl`` seconds old and still in the ring. Successful responses are
+    kept with their key, so a duplicate request can be answered without
+    sending it again.
+
+    Used from the paho threads and the event loop, so every operation holds
+    a lock.
+    """
+
+    def __init__(self, capacity: int = 100000, ttl: float = 300.0):
+        if capacity <= 0:
+            raise ValueError("Dedup cache capacity must be positive")
+        self.capacity = capacity
+        self.ttl = ttl
+        self._keys: List[Optional[Hashable]] = [None] * capacity
+        self._times = array('d', bytes(8 * capacity))
+        self._responses: List[Optional[ResponseRecord]] = [None] * capacity
+        self._index: Dict[Hashable, int] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            # Keys overwritten by the ring before their TTL, the capacity is too small
+            "evicted": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def add(self, key: Hashable) -> Tuple[bool, Optional[ResponseRecord]]:
+        """
+        Check whether a key was already seen, with the response kept for it if
+        any. A key that was not seen is remembered
+        """
+        now = time.monotonic()
+        with self._lock:
+            slot = self._index.get(key)
+            if slot is not None:
+                if now - self._times[slot] < self.ttl:
+                    self._counters["hits"] += 1
+                    return True, self._responses[slot]
+                self._clear(slot)
+            self._counters["misses"] += 1
+
+            slot = self._next
+            old_key = self._keys[slot]
+            if old_key is not None:
+                if now - self._times[slot] < self.ttl:
+                    self._counters["evicted"] += 1
+                del self._index[old_key]
+            self._keys[slot] = key
+            self._times[slot] = now
+            self._responses[slot] = None
+            self._index[key] = slot
+            self._next = (slot + 1) % self.capacity
+            return False, None
+
+    def _clear(self, slot: int):
+        del self._index[self._keys[slot]]
+        self._keys[slot] = None
+        self._responses[slot] = None
+
+    def complete(self, key: Hashable, response: Optional[ResponseRecord]):
+        """
+        Record how the request of a key went. A response is kept for the
+        duplicates, None (a message without response) keeps the key only, and
+        transient failures (timeouts, 429 and 5xx) forget the key so retries
+        go through
+        """
+        with self._lock:
+            slot = self._index.get(key)
+            if slot is None or response is None:
+                return
+            if response.status_code in (408, 429) or response.status_code >= 500:
+                self._clear(slot)
+            else:
+                self._responses[slot] = response
+
+    def discard(self, key: Hashable):
+        """Forget a key, e.g. when its request could not be sent"""
+        with self._lock:
+            slot = self._index.get(key)
+            if slot is not None:
+                self._clear(slot)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the number of keys and the hit, miss and eviction counters"""
+        return {"keys": len(self._index), "capacity": self.capacity, **self._counters}
@@ -0,0 +1,102 @@
+from typing import NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from paho.mqtt.client import MQTTMessage
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+# Compact routing header placed in front of the message body:
+#   @mqa correlation_id=...&identifier=...&target_broker_id=...&is_response=1&traceparent=...&final=1\n<body>
+HEADER_PREFIX = b'@mqa '
+HEADER_END = b'\n'
+
+class MessageMetadata(NamedTuple):
+    """Routing metadata of a message forwarded without decoding its body"""
+    correlation_id: str
+    identifier: str = ''
+    target_broker_id: str = ''
+    is_response: bool = False
+    # W3C trace context of the request, empty when it is not traced
+    traceparent: str = ''
+    # Set on the last reply to a streamed request
+    final: bool = False
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() in ('1', 'true', 'yes')
+
+def _from_fields(fields) -> Optional[MessageMetadata]:
+    """Build the metadata from key/value pairs, None if there is no correlation ID"""
+    values = dict(fields)
+    correlation_id = values.get('correlation_id')
+    if not correlation_id:
+        return None
+    return MessageMetadata(
+        correlation_id=correlation_id,
+        identifier=values.get('identifier', ''),
+        target_broker_id=values.get('target_broker_id', ''),
+        is_response=_parse_bool(values.get('is_response', '')),
+        traceparent=values.get('traceparent', ''),
+        final=_parse_bool(values.get('final', ''))
+    )
+
+def _to_fields(metadata: MessageMetadata):
+    fields = [('correlation_id', metadata.correlation_id)]
+    if metadata.identifier:
+        fields.append(('identifier', metadata.identifier))
+    if metadata.target_broker_id:
+        fields.append(('target_broker_id', metadata.target_broker_id))
+    if metadata.is_response:
+        fields.append(('is_response', '1'))
+    if metadata.traceparent:
+        fields.append(('traceparent', metadata.traceparent))
+    if metadata.final:
+        fields.append(('final', '1'))
+    return fields
+
+def metadata_from_properties(properties: Optional[Properties]) -> Optional[MessageMetadata]:
+    """Read the routing metadata from MQTT 5 user properties"""
+    user_properties = getattr(properties, 'UserProperty', None)
+    if not user_properties:
+        return None
+    return _from_fields(user_properties)
+
+def is_final_reply(properties: Optional[Properties]) -> bool:
+    """Check the MQTT 5 user properties of a reply for the final marker"""
+    for key, value in getattr(properties, 'UserProperty', None) or ():
+        if key == 'final':
+            return _parse_bool(value)
+    return False
+
+def metadata_to_properties(metadata: MessageMetadata, properties: Optional[Properties] = None) -> Properties:
+    """Add the routing metadata to MQTT 5 user properties"""
+    if properties is None:
+        properties = Properties(PacketTypes.PUBLISH)
+    properties.UserProperty = _to_fields(metadata)
+    return properties
+
+def encode_header(metadata: MessageMetadata) -> bytes:
+    """Encode the routing metadata as a compact header to put in front of the body"""
+    return HEADER_PREFIX + urlencode(_to_fields(metadata)).encode('utf-8') + HEADER_END
+
+def split_header(payload: bytes) -> Tuple[Optional[MessageMetadata], bytes]:
+    """Split a payload into its routing header and body, the metadata is None without a header"""
+    if not payload.startswith(HEADER_PREFIX):
+        return None, payload
+
+    end = payload.find(HEADER_END, len(HEADER_PREFIX))
+    if end < 0:
+        return None, payload
+
+    header = payload[len(HEADER_PREFIX):end].decode('utf-8')
+    return _from_fields(parse_qsl(header)), payload[end + 1:]
+
+def read_metadata(message: MQTTMessage) -> Tuple[Optional[MessageMetadata], bytes]:
+    """
+    Get the routing metadata and body of a message, from the MQTT 5 user
+    properties if present, otherwise from the compact header
+    """
+    metadata = metadata_from_properties(getattr(message, 'properties', None))
+    if metadata is not None:
+        # The body is the original payload, no copy needed
+        return metadata, message.payload
+    return split_header(message.payload)
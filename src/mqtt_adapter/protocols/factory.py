@@ -3,6 +3,7 @@ from typing import Dict
 
 from ..models import MQTTAppConfig
 from .base import BaseProtocol, MQTTBrokerRegistry
+from .routing import RoutingTable
 
 class MQTTProtocolFactory:
     """Factory for creating MQTT protocol instances from configuration"""
@@ -16,13 +17,23 @@ class MQTTProtocolFactory:
         """Create protocol instances for all brokers in the configuration"""
         protocols = {}
         
+        # Compile the routes once, invalid routes fail the startup
+        routing = RoutingTable(config.routes, config.brokers)
+        
         for broker_id, broker_config in config.brokers.items():
+            if broker_config.failover is not None and broker_config.failover not in (set(config.brokers) - {broker_id}):
+                raise ValueError(f"Broker {broker_id} fails over to unknown broker: {broker_config.failover}")
             protocol = BaseProtocol(
                 config=broker_config,
                 broker_registry=registry,
-                loop=loop
+                loop=loop,
+                instance_id=config.instance_id,
+                routes=routing.for_broker(broker_id)
             )
             protocols[broker_id] = protocol
             registry.register_protocol(broker_id, protocol)
         
+        for name, group in config.broker_groups.items():
+            registry.register_group(name, group)
+        
         return protocols 
\ No newline at end of file
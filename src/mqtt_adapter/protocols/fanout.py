@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+from ..models import ResponseRecord
+from ..serialization import JSON_CODEC, get_codec_for_content_type
+
+logger = logging.getLogger(__name__)
+
+# How the responses of a request sent to several brokers are gathered
+GATHER_FIRST = 'first'
+GATHER_ALL = 'all'
+GATHER_QUORUM = 'quorum'
+
+def quorum_size(count: int, quorum: Optional[int] = None) -> int:
+    """Successful responses needed by the quorum policy, a majority by default"""
+    return quorum if quorum is not None else count // 2 + 1
+
+def publish_to_all(
+    protocols: Mapping[str, 'BaseProtocol'],
+    topic: str,
+    payload: Any = None,
+    correlation_id: Optional[str] = None,
+    raw_payload: Optional[bytes] = None
+) -> Dict[str, str]:
+    """
+    Publish one message to several brokers, returning the errors by broker.
+
+    The payload is encoded once per codec and protocol version and the same
+    bytes are queued on every client, the publishes themselves are sent by
+    the paho network loops concurrently.
+    """
+    encoded: Dict[Tuple[str, int], Tuple[bytes, Any]] = {}
+    errors: Dict[str, str] = {}
+    for broker_id, protocol in protocols.items():
+        try:
+            if raw_payload is not None:
+                data, properties = raw_payload, None
+            else:
+                key = (protocol.config.codec, protocol.config.protocol_version)
+                if key not in encoded:
+                    encoded[key] = protocol._encode_payload(payload, None)
+                data, properties = encoded[key]
+            protocol.publish_nowait(topic, data, None, correlation_id, properties, True)
+        except Exception as e:
+            errors[broker_id] = str(e)
+    return errors
+
+def _response_payload(response: ResponseRecord) -> Any:
+    """Payload of a response, decoding the body of passthrough responses"""
+    if response.raw_payload is None:
+        return response.payload
+    try:
+        return get_codec_for_content_type(response.content_type, JSON_CODEC).decode(response.raw_payload)
+    except Exception:
+        return response.raw_payload.decode('utf-8', errors='replace')
+
+def _combined_response(
+    correlation_id: str,
+    responses: Dict[str, ResponseRecord],
+    status_code: int
+) -> ResponseRecord:
+    return ResponseRecord(
+        status_code=status_code,
+        payload={
+            "responses": {
+                broker_id: {"status_code": response.status_code, "payload": _response_payload(response)}
+                for broker_id, response in responses.items()
+            }
+        },
+        correlation_id=correlation_id
+    )
+
+async def gather_responses(
+    protocols: Mapping[str, 'BaseProtocol'],
+    correlation_id: str,
+    send: Callable[['BaseProtocol'], Awaitable[ResponseRecord]],
+    gather: str = GATHER_FIRST,
+    quorum: Optional[int] = None
+) -> ResponseRecord:
+    """
+    Send a request to several brokers at once and gather their responses.
+
+    ``first`` returns the first successful response as it is, ``all`` waits
+    for every broker and ``quorum`` for ``quorum`` successful responses (a
+    majority by default). ``all`` and ``quorum`` answer with the responses by
+    broker, with a 502 status when the policy was not met. Requests still
+    waiting once the result is known are cancelled.
+    """
+    tasks = {asyncio.ensure_future(send(protocol)): broker_id for broker_id, protocol in protocols.items()}
+    needed = {
+        GATHER_FIRST: 1,
+        GATHER_ALL: len(tasks),
+        GATHER_QUORUM: quorum_size(len(tasks), quorum),
+    }[gather]
+    responses: Dict[str, ResponseRecord] = {}
+    succeeded = failed = 0
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                broker_id = tasks[task]
+                try:
+                    response = task.result()
+                except Exception as e:
+                    logger.error("Request to broker %s failed: %s", broker_id, e, extra={"correlation_id": correlation_id})
+                    response = ResponseRecord(status_code=500, payload={"error": str(e)}, correlation_id=correlation_id)
+                responses[broker_id] = response
+                if response.status_code < 400:
+                    succeeded += 1
+                    if gather == GATHER_FIRST:
+                        return response
+                else:
+                    failed += 1
+            if succeeded >= needed:
+                return _combined_response(correlation_id, responses, 200)
+            if gather != GATHER_ALL and failed > len(tasks) - needed:
+                # Too many failures for the policy to be met
+                return _combined_response(correlation_id, responses, 502)
+        return _combined_response(correlation_id, responses, 502)
+    finally:
+        for task, broker_id in tasks.items():
+            if not task.done():
+                task.cancel()
+                protocols[broker_id].discard_pending(correlation_id)
@@ -0,0 +1,176 @@
+import re
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+from ..models import MQTTBrokerConfig, RouteConfig
+
+# Placeholders of the target topic templates: {topic} or {<wildcard number>}
+_PLACEHOLDER = re.compile(r'\{(topic|\d+)\}')
+
+class Route(NamedTuple):
+    """Compiled route, the target topic template is split into literals and wildcard indexes"""
+    source: str
+    topic_filter: str
+    target: str
+    # Literal strings, wildcard numbers (1 based) and 0 for the whole source topic
+    template: Optional[Tuple[Union[str, int], ...]]
+    qos: Optional[int]
+
+    def target_topic(self, topic: str, captures: Sequence[str]) -> str:
+        """Build the target topic of a message matched with the wildcard captures"""
+        if self.template is None:
+            return topic
+        return ''.join(
+            part if isinstance(part, str) else (captures[part - 1] if part else topic)
+            for part in self.template
+        )
+
+class _Node:
+    """Level of the topic trie"""
+    __slots__ = ('children', 'plus', 'hash', 'routes')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        # Subtrees of the + and # wildcards at this level
+        self.plus: Optional['_Node'] = None
+        self.hash: Optional['_Node'] = None
+        # Routes whose filter ends at this level
+        self.routes: List[Route] = []
+
+def validate_topic_filter(topic_filter: str):
+    """Raise ValueError unless the topic filter is valid, wildcards must take a whole level and # must be last"""
+    if not topic_filter:
+        raise ValueError("Topic filter must not be empty")
+    if '\0' in topic_filter:
+        raise ValueError(f"Invalid topic filter {topic_filter!r}: null characters are not allowed")
+    levels = topic_filter.split('/')
+    for index, level in enumerate(levels):
+        if '#' in level and (level != '#' or index != len(levels) - 1):
+            raise ValueError(f"Invalid topic filter '{topic_filter}': # must be the whole last level")
+        if '+' in level and level != '+':
+            raise ValueError(f"Invalid topic filter '{topic_filter}': + must be a whole level")
+
+def compile_route(config: RouteConfig) -> Route:
+    """Validate a route configuration and compile its target topic template"""
+    validate_topic_filter(config.topic)
+    wildcards = sum(1 for level in config.topic.split('/') if level in ('+', '#'))
+
+    template = None
+    if config.target_topic is not None:
+        parts: List[Union[str, int]] = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(config.target_topic):
+            if match.start() > position:
+                parts.append(config.target_topic[position:match.start()])
+            name = match.group(1)
+            index = 0 if name == 'topic' else int(name)
+            if index > wildcards or (name != 'topic' and index == 0):
+                raise ValueError(
+                    f"Route target topic '{config.target_topic}' uses {{{name}}} but '{config.topic}' has {wildcards} wildcards"
+                )
+            parts.append(index)
+            position = match.end()
+        if position < len(config.target_topic):
+            parts.append(config.target_topic[position:])
+        template = tuple(parts)
+
+    return Route(config.source, config.topic, config.target, template, config.qos)
+
+class TopicTrie:
+    """
+    Routes of one source broker indexed by their topic filter levels.
+
+    Matching a topic walks the trie one level at a time, following the exact
+    level, the + and the # branches, so its cost grows with the topic depth
+    and the number of matching routes rather than with the number of routes.
+    """
+
+    def __init__(self, routes: Iterable[Route] = ()):
+        self._root = _Node()
+        self._filters: List[str] = []
+        for route in routes:
+            self.add(route)
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    @property
+    def topic_filters(self) -> List[str]:
+        """Distinct topic filters of the routes, to subscribe to"""
+        return list(dict.fromkeys(self._filters))
+
+    def add(self, route: Route):
+        node = self._root
+        for level in route.topic_filter.split('/'):
+            if level == '+':
+                if node.plus is None:
+                    node.plus = _Node()
+                node = node.plus
+            elif level == '#':
+                if node.hash is None:
+                    node.hash = _Node()
+                node = node.hash
+            else:
+                child = node.children.get(level)
+                if child is None:
+                    child = node.children[level] = _Node()
+                node = child
+        node.routes.append(route)
+        self._filters.append(route.topic_filter)
+
+    def match(self, topic: str) -> List[Tuple[Route, Tuple[str, ...]]]:
+        """Get the routes matching a topic with the levels captured by their wildcards"""
+        levels = topic.split('/')
+        count = len(levels)
+        matches: List[Tuple[Route, Tuple[str, ...]]] = []
+        # Depth-first walk of (node, level index, captures)
+        stack = [(self._root, 0, ())]
+        while stack:
+            node, index, captures = stack.pop()
+            if node.hash is not None and not (index == 0 and topic.startswith('$')):
+                # # also matches the parent level, e.g. "a/#" matches "a"
+                rest = '/'.join(levels[index:])
+                for route in node.hash.routes:
+                    matches.append((route, captures + (rest,)))
+            if index == count:
+                for route in node.routes:
+                    matches.append((route, captures))
+                continue
+            level = levels[index]
+            child = node.children.get(level)
+            if child is not None:
+                stack.append((child, index + 1, captures))
+            # Wildcards at the first level do not match topics starting with $
+            if node.plus is not None and not (index == 0 and level.startswith('$')):
+                stack.append((node.plus, index + 1, captures + (level,)))
+        return matches
+
+def _same_broker(brokers: Optional[Mapping[str, MQTTBrokerConfig]], source: str, target: str) -> bool:
+    """Check whether two broker configurations connect to the same server"""
+    if source == target:
+        return True
+    if brokers is None:
+        return False
+    return (brokers[source].host, brokers[source].port) == (brokers[target].host, brokers[target].port)
+
+class RoutingTable:
+    """Compiled routes of all brokers, one trie per source broker"""
+
+    def __init__(self, routes: Iterable[RouteConfig] = (), brokers: Optional[Mapping[str, MQTTBrokerConfig]] = None):
+        self._tries: Dict[str, TopicTrie] = {}
+        for config in routes:
+            if brokers is not None:
+                for broker_id in (config.source, config.target):
+                    if broker_id not in brokers:
+                        raise ValueError(f"Route {config.source} '{config.topic}' -> {config.target} uses unknown broker: {broker_id}")
+            route = compile_route(config)
+            if route.template in (None, (0,)) and _same_broker(brokers, route.source, route.target):
+                # The forwarded message would match the route again and loop forever
+                raise ValueError(f"Route {config.source} '{config.topic}' -> {config.target} publishes back to the topics it routes")
+            self._tries.setdefault(route.source, TopicTrie()).add(route)
+
+    def __len__(self) -> int:
+        return sum(len(trie) for trie in self._tries.values())
+
+    def for_broker(self, broker_id: str) -> Optional[TopicTrie]:
+        """Get the routes of a source broker, None if it has none"""
+        return self._tries.get(broker_id)
@@ -0,0 +1,359 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Record framing: body length and CRC32 of the body
+_FRAME = struct.Struct('>II')
+# Record body header: timestamp, QoS, topic length and packed properties length
+_HEADER = struct.Struct('>dBHI')
+_SEGMENT_SUFFIX = '.seg'
+_CURSOR_FILE = 'cursor'
+
+class SpooledMessage(NamedTuple):
+    """Message kept in the spool until the broker can take it"""
+    topic: str
+    data: bytes
+    qos: int
+    # MQTT 5 properties as packed by paho, None before MQTT 5
+    properties: Optional[bytes]
+    timestamp: float
+
+class SpoolBatch(NamedTuple):
+    """Messages read from the spool, to commit once they are published"""
+    messages: List[SpooledMessage]
+    # Position following the last record read
+    position: Tuple[int, int]
+    # Records read, including the expired ones left out of messages
+    records: int
+
+class _Segment:
+    """Book-keeping of one segment file"""
+    __slots__ = ('size', 'pending', 'last_timestamp')
+
+    def __init__(self, size: int = 0, pending: int = 0, last_timestamp: float = 0.0):
+        self.size = size
+        # Records of the segment not replayed yet
+        self.pending = pending
+        self.last_timestamp = last_timestamp
+
+def _encode_record(message: SpooledMessage) -> bytes:
+    topic = message.topic.encode('utf-8')
+    properties = message.properties or b''
+    body = _HEADER.pack(message.timestamp, message.qos, len(topic), len(properties)) + topic + properties + message.data
+    return _FRAME.pack(len(body), zlib.crc32(body)) + body
+
+def _decode_records(buffer, offset: int, limit: Optional[int] = None) -> Tuple[List[Tuple[int, SpooledMessage]], int]:
+    """
+    Decode the records of a segment from offset, returning them with the
+    offset following each one, and the offset where decoding stopped. A
+    truncated or corrupt record (a write torn by a crash) ends the segment
+    """
+    records: List[Tuple[int, SpooledMessage]] = []
+    end = len(buffer)
+    while (limit is None or len(records) < limit) and offset + _FRAME.size <= end:
+        length, crc = _FRAME.unpack_from(buffer, offset)
+        start = offset + _FRAME.size
+        if start + length > end or length < _HEADER.size:
+            break
+        body = bytes(buffer[start:start + length])
+        if zlib.crc32(body) != crc:
+            break
+        timestamp, qos, topic_length, properties_length = _HEADER.unpack_from(body)
+        position = _HEADER.size
+        topic = body[position:position + topic_length].decode('utf-8')
+        position += topic_length
+        properties = body[position:position + properties_length] or None
+        position += properties_length
+        offset = start + length
+        records.append((offset, SpooledMessage(topic, body[position:], qos, properties, timestamp)))
+    return records, offset
+
+class Spool:
+    """
+    On-disk store-and-forward queue of the messages for one broker.
+
+    Messages are appended to segment files of about ``segment_bytes`` and
+    read back in order from a cursor, which is saved next to the segments so
+    a restarted adapter resumes where it stopped. Writes go to the OS right
+    away and are fsynced in batches by ``sync()``, called periodically by the
+    owner, so a crash of the machine can lose the writes since the last sync
+    but not more. Replayed segments are deleted.
+
+    The spool holds at most ``max_bytes``: when full, the oldest segments are
+    dropped to make room. With ``max_age`` set, messages older than that are
+    dropped instead of being replayed. Replay is at least once: a crash
+    between publishing a batch and saving the cursor replays the batch again.
+
+    All methods are thread-safe, messages may be spooled from paho threads.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 16 * 1024 * 1024,
+        max_bytes: int = 1024 * 1024 * 1024,
+        max_age: Optional[float] = None,
+        use_mmap: bool = False
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.use_mmap = use_mmap
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._segments: Dict[int, _Segment] = {}
+        self._cursor: Tuple[int, int] = (0, 0)
+        self._writer = None
+        self._write_segment = 0
+        self._dirty = False
+        self._cursor_dirty = False
+        self._rolled = False
+        # Descriptors of the segments closed since the last sync, still to fsync
+        self._unsynced: List[int] = []
+
+    @property
+    def pending(self) -> int:
+        """Messages waiting to be replayed"""
+        with self._lock:
+            return self._pending_locked()
+
+    def _segment_path(self, sequence: int) -> str:
+        return os.path.join(self.directory, f"{sequence:020d}{_SEGMENT_SUFFIX}")
+
+    def open(self):
+        """Load the segments and the cursor left by a previous run"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            sequences = sorted(
+                int(name[:-len(_SEGMENT_SUFFIX)])
+                for name in os.listdir(self.directory) if name.endswith(_SEGMENT_SUFFIX)
+            )
+            try:
+                with open(os.path.join(self.directory, _CURSOR_FILE)) as f:
+                    sequence, offset = f.read().split()
+                    self._cursor = (int(sequence), int(offset))
+            except (OSError, ValueError):
+                self._cursor = (sequences[0], 0) if sequences else (0, 0)
+
+            for sequence in sequences:
+                path = self._segment_path(sequence)
+                if sequence < self._cursor[0]:
+                    # Replayed before the cursor was saved
+                    os.remove(path)
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                records, end = _decode_records(data, 0)
+                if end < len(data):
+                    logger.warning("Truncating spool segment %s at %d of %d bytes", path, end, len(data))
+                    with open(path, 'r+b') as f:
+                        f.truncate(end)
+                start = self._cursor[1] if sequence == self._cursor[0] else 0
+                self._segments[sequence] = _Segment(
+                    end,
+                    sum(1 for offset, _ in records if offset > start),
+                    records[-1][1].timestamp if records else 0.0
+                )
+
+            if not self._segments:
+                self._segments[self._cursor[0]] = _Segment()
+            self._cursor = max(self._cursor, (min(self._segments), 0))
+            self._open_writer(max(self._segments))
+        if self.pending:
+            logger.info("Spool %s holds %d messages to replay", self.directory, self.pending)
+
+    def _open_writer(self, sequence: int):
+        if self._writer is not None:
+            self._writer.flush()
+            self._unsynced.append(os.dup(self._writer.fileno()))
+            self._writer.close()
+        self._segments.setdefault(sequence, _Segment())
+        self._writer = open(self._segment_path(sequence), 'ab')
+        self._write_segment = sequence
+        self._rolled = True
+
+    def close(self):
+        """Sync and close the segment being written"""
+        self.sync()
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def offer(self, topic: str, data: bytes, qos: int, properties: Optional[bytes], connected: bool) -> bool:
+        """
+        Spool a message unless the broker is connected and nothing is waiting
+        to be replayed, in which case it can be published right away. Returns
+        whether the message was spooled
+        """
+        with self._lock:
+            if connected and self._pending_locked() == 0:
+                return False
+            self._append_locked(SpooledMessage(topic, data, qos, properties, time.time()))
+            return True
+
+    def append(self, topic: str, data: bytes, qos: int, properties: Optional[bytes] = None):
+        """Spool a message"""
+        with self._lock:
+            self._append_locked(SpooledMessage(topic, data, qos, properties, time.time()))
+
+    def _pending_locked(self) -> int:
+        return sum(segment.pending for segment in self._segments.values())
+
+    def _append_locked(self, message: SpooledMessage):
+        record = _encode_record(message)
+        segment = self._segments[self._write_segment]
+        if segment.size and segment.size + len(record) > self.segment_bytes:
+            self._open_writer(self._write_segment + 1)
+            segment = self._segments[self._write_segment]
+        self._writer.write(record)
+        segment.size += len(record)
+        segment.pending += 1
+        segment.last_timestamp = message.timestamp
+        self._dirty = True
+        self._enforce_size_locked()
+
+    def _enforce_size_locked(self):
+        """Drop the oldest segments while the spool is over max_bytes"""
+        while len(self._segments) > 1 and sum(segment.size for segment in self._segments.values()) > self.max_bytes:
+            self._drop_oldest_locked("size")
+
+    def _drop_oldest_locked(self, reason: str):
+        sequence = min(self._segments)
+        segment = self._segments.pop(sequence)
+        self.dropped += segment.pending
+        if segment.pending:
+            logger.warning("Dropped %d spooled messages of %s, spool over its %s limit", segment.pending, self.directory, reason)
+        os.remove(self._segment_path(sequence))
+        if self._cursor[0] <= sequence:
+            self._cursor = (min(self._segments), 0)
+            self._cursor_dirty = True
+
+    def read(self, max_messages: int) -> Optional[SpoolBatch]:
+        """Read the next messages from the cursor without moving it, None when all were replayed"""
+        with self._lock:
+            sequence, offset = self._cursor
+            while True:
+                segment = self._segments.get(sequence)
+                if segment is None:
+                    return None
+                if offset < segment.size:
+                    break
+                if sequence == self._write_segment:
+                    return None
+                # Fully replayed segment, continue with the next one
+                sequence, offset = sequence + 1, 0
+            if sequence == self._write_segment:
+                self._writer.flush()
+
+            records = self._read_segment(sequence, offset, max_messages)
+            if not records:
+                return None
+            expired_before = time.time() - self.max_age if self.max_age is not None else None
+            messages = [
+                message for _, message in records
+                if expired_before is None or message.timestamp >= expired_before
+            ]
+            return SpoolBatch(messages, (sequence, records[-1][0]), len(records))
+
+    def _read_segment(self, sequence: int, offset: int, max_messages: int) -> List[Tuple[int, SpooledMessage]]:
+        with open(self._segment_path(sequence), 'rb') as f:
+            if self.use_mmap:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    return _decode_records(buffer, offset, max_messages)[0]
+            f.seek(offset)
+            # Read about enough for the batch, records are decoded from the start of the buffer
+            data = f.read(max(64 * 1024, min(self.segment_bytes, 4096 * max_messages)))
+        records, _ = _decode_records(data, 0, max_messages)
+        if not records and data:
+            # A record larger than the read buffer
+            with open(self._segment_path(sequence), 'rb') as f:
+                f.seek(offset)
+                records, _ = _decode_records(f.read(), 0, max_messages)
+        return [(offset + end, message) for end, message in records]
+
+    def commit(self, batch: SpoolBatch):
+        """Move the cursor after a batch returned by read(), deleting the replayed segments"""
+        with self._lock:
+            sequence = batch.position[0]
+            if sequence not in self._segments:
+                # Dropped by the caps while the batch was published
+                return
+            for older in [s for s in self._segments if s < sequence]:
+                del self._segments[older]
+                os.remove(self._segment_path(older))
+            segment = self._segments[sequence]
+            segment.pending = max(0, segment.pending - batch.records)
+            self.dropped += batch.records - len(batch.messages)
+            self._cursor = batch.position
+            self._cursor_dirty = True
+
+    def expire(self):
+        """Drop the segments whose messages are all older than max_age"""
+        if self.max_age is None:
+            return
+        with self._lock:
+            expired_before = time.time() - self.max_age
+            while len(self._segments) > 1 and self._segments[min(self._segments)].last_timestamp < expired_before:
+                self._drop_oldest_locked("age")
+
+    def flush(self) -> Optional[Tuple[List[int], bool]]:
+        """
+        Hand the buffered writes to the OS and save the cursor, returning the
+        file descriptors to fsync and whether the directory changed, or None
+        when nothing did. Split from sync() so the fsync itself can run
+        outside the event loop
+        """
+        with self._lock:
+            if self._writer is None or not (self._dirty or self._cursor_dirty):
+                return None
+            self._writer.flush()
+            fds, self._unsynced = self._unsynced + [os.dup(self._writer.fileno())], []
+            if self._cursor_dirty:
+                # A stale cursor only replays some messages twice, it is not fsynced on its own
+                path = os.path.join(self.directory, _CURSOR_FILE)
+                with open(path + '.tmp', 'w') as f:
+                    f.write(f"{self._cursor[0]} {self._cursor[1]}\n")
+                os.replace(path + '.tmp', path)
+            directory_changed = self._rolled or self._cursor_dirty
+            self._dirty = self._cursor_dirty = self._rolled = False
+            return fds, directory_changed
+
+    def fsync(self, fds: List[int], directory: bool):
+        """Make the writes handed over by flush() durable"""
+        try:
+            for fd in fds:
+                os.fsync(fd)
+            if directory:
+                dir_fd = os.open(self.directory, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def sync(self):
+        """Flush and fsync the pending writes"""
+        flushed = self.flush()
+        if flushed is not None:
+            self.fsync(*flushed)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get the spool depth, size and the messages dropped by the caps"""
+        with self._lock:
+            return {
+                "messages": self._pending_locked(),
+                "bytes": sum(segment.size for segment in self._segments.values()),
+                "segments": len(self._segments),
+                "dropped": self.dropped,
+            }
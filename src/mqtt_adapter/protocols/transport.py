@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import socket
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from paho.mqtt import client as mqtt
+
+from .connection import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+def set_tcp_nodelay(sock):
+    """
+    Disable Nagle's algorithm on a broker socket. paho leaves it enabled, so
+    a small publish written while an earlier one is unacknowledged waits for
+    the peer's delayed ACK, adding tens of milliseconds per hop
+    """
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (AttributeError, OSError):
+        # Not a TCP socket, e.g. a Unix socket or a websocket wrapper
+        pass
+
+@contextmanager
+def tcp_corked(sock):
+    """
+    Hold back partial TCP segments while several packets are written, so
+    small packets written together leave in full segments (Linux TCP_CORK,
+    a no-op elsewhere). Uncorking sends what is left right away
+    """
+    cork = getattr(socket, 'TCP_CORK', None)
+    try:
+        if cork is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, cork, 1)
+    except (AttributeError, OSError):
+        cork = None
+    try:
+        yield
+    finally:
+        if cork is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, cork, 0)
+            except OSError:
+                # Closed while writing
+                pass
+
+class AsyncioTransport:
+    """
+    Drives the socket I/O of a paho client from an asyncio event loop.
+
+    Instead of running ``loop_start()`` in a dedicated network thread, the
+    client socket is registered with ``add_reader``/``add_writer`` and paho's
+    ``loop_read``/``loop_write``/``loop_misc`` are called directly on the loop,
+    so all paho callbacks run on the event loop thread.
+    """
+
+    def __init__(
+        self,
+        client: mqtt.Client,
+        loop: asyncio.AbstractEventLoop,
+        misc_interval: float = 1.0,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 30.0,
+        on_connect_fail: Optional[Callable[[str], None]] = None
+    ):
+        self.client = client
+        self.loop = loop
+        self.misc_interval = misc_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        # Called with the error of every failed connection attempt
+        self.on_connect_fail = on_connect_fail
+        self._sock: Optional[socket.socket] = None
+        self._misc_task: Optional[asyncio.Task] = None
+        self._running = False
+
+        # Register the socket callbacks
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def is_connected(self) -> bool:
+        """Check whether the transport currently owns an open socket"""
+        return self._sock is not None
+
+    def write_now(self):
+        """
+        Write the packets queued on the client right away instead of on the
+        next writer callback, corked so that they leave in full TCP segments
+        """
+        if self._sock is not None:
+            with tcp_corked(self._sock):
+                self.client.loop_write()
+    
+    def _call_in_loop(self, callback, *args):
+        """Run a callback on the event loop, whichever thread paho calls us from"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        """Callback for when paho opens the broker socket"""
+        self._call_in_loop(self._add_socket, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        """Callback for when paho closes the broker socket"""
+        self._call_in_loop(self._remove_socket, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        """Callback for when paho has outgoing data to write"""
+        self._call_in_loop(self._add_writer, sock)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """Callback for when paho has flushed all outgoing data"""
+        self._call_in_loop(self._remove_writer, sock)
+
+    def _add_socket(self, sock):
+        set_tcp_nodelay(sock)
+        self._sock = sock
+        self.loop.add_reader(sock, self.client.loop_read)
+
+    def _remove_socket(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self._sock is sock:
+            self._sock = None
+
+    def _add_writer(self, sock):
+        # The socket may already be closed by the time a cross-thread call lands
+        if sock is self._sock:
+            self.loop.add_writer(sock, self.client.loop_write)
+
+    def _remove_writer(self, sock):
+        self.loop.remove_writer(sock)
+
+    async def _connect(self) -> bool:
+        """Open the connection without blocking the event loop on the TCP handshake"""
+        try:
+            await self.loop.run_in_executor(None, self.client.reconnect)
+            return True
+        except (OSError, mqtt.WebsocketConnectionError) as e:
+            logger.warning(f"Connection attempt failed: {str(e)}")
+            if self.on_connect_fail is not None:
+                self.on_connect_fail(str(e))
+            return False
+
+    async def _misc_loop(self):
+        """Run paho's periodic housekeeping and reconnect when the socket drops"""
+        # The first connection is attempted right away, reconnects wait a jittered exponential delay
+        attempt = 0
+        while self._running:
+            if self._sock is None:
+                if attempt:
+                    await asyncio.sleep(backoff_delay(attempt, self.reconnect_delay, self.max_reconnect_delay))
+                attempt += 1
+                if not await self._connect():
+                    continue
+                attempt = 1
+
+            self.client.loop_misc()
+            await asyncio.sleep(self.misc_interval)
+
+    async def start(self, host: str, port: int, keepalive: int, **connect_kwargs):
+        """Start the transport and connect to the broker"""
+        if self._running:
+            return
+
+        # Store the connection parameters, the misc loop performs the actual connect
+        self.client.connect_async(host=host, port=port, keepalive=keepalive, **connect_kwargs)
+        self._running = True
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+    async def stop(self):
+        """Stop the transport, flushing the DISCONNECT packet first"""
+        if not self._running:
+            return
+
+        self._running = False
+        if self._misc_task:
+            self._misc_task.cancel()
+            try:
+                await self._misc_task
+            except asyncio.CancelledError:
+                pass
+            self._misc_task = None
+
+        # Give paho a chance to write out anything still queued, paho closes
+        # the socket itself once the DISCONNECT packet has been written
+        if self._sock is not None:
+            self.client.loop_write()
+        if self._sock is not None:
+            self._remove_socket(self._sock)
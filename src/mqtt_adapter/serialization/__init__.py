@@ -0,0 +1,32 @@
+from .base import (
+    Codec,
+    register_codec,
+    get_codec,
+    get_codec_for_content_type,
+    list_codecs,
+    negotiate_codec,
+    frame_payload,
+    unframe_payload,
+)
+from .codecs import JSONCodec, MessagePackCodec, CBORCodec
+
+JSON_CODEC = JSONCodec()
+
+register_codec(JSON_CODEC)
+register_codec(MessagePackCodec())
+register_codec(CBORCodec())
+
+__all__ = [
+    'Codec',
+    'JSONCodec',
+    'MessagePackCodec',
+    'CBORCodec',
+    'JSON_CODEC',
+    'register_codec',
+    'get_codec',
+    'get_codec_for_content_type',
+    'list_codecs',
+    'negotiate_codec',
+    'frame_payload',
+    'unframe_payload',
+]
@@ -0,0 +1,113 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# Binary envelopes sent without MQTT 5 content types are prefixed with this byte
+# followed by the codec marker, JSON is sent unmarked so existing clients keep working
+MARKER_PREFIX = 0x00
+
+class Codec(ABC):
+    """Interface for wire codecs used for MQTT envelopes and HTTP bodies"""
+    
+    # Short name used in the configuration
+    name: str = ''
+    # MIME type used for HTTP and MQTT 5 content types
+    content_type: str = ''
+    # Other MIME types accepted for this codec
+    aliases: Tuple[str, ...] = ()
+    # Marker byte identifying the codec in MQTT 3.1.1 payloads, None when sent unmarked
+    marker: Optional[int] = None
+    
+    def is_available(self) -> bool:
+        """Check whether the libraries needed by the codec are installed"""
+        return True
+    
+    @abstractmethod
+    def encode(self, obj: Any) -> bytes:
+        """Encode an object to bytes"""
+        pass
+    
+    @abstractmethod
+    def decode(self, data: BytesLike) -> Any:
+        """Decode bytes to an object"""
+        pass
+
+_codecs_by_name: Dict[str, Codec] = {}
+_codecs_by_content_type: Dict[str, Codec] = {}
+_codecs_by_marker: Dict[int, Codec] = {}
+
+def register_codec(codec: Codec):
+    """Register a codec by name, content types and marker"""
+    _codecs_by_name[codec.name] = codec
+    for content_type in (codec.content_type,) + codec.aliases:
+        _codecs_by_content_type[content_type] = codec
+    if codec.marker is not None:
+        _codecs_by_marker[codec.marker] = codec
+
+def _check_available(codec: Codec) -> Codec:
+    if not codec.is_available():
+        raise RuntimeError(f"Codec '{codec.name}' is not available, install its package to use it")
+    return codec
+
+def get_codec(name: str) -> Codec:
+    """Get a codec by name"""
+    if name not in _codecs_by_name:
+        raise KeyError(f"Codec not found: {name}")
+    return _check_available(_codecs_by_name[name])
+
+def get_codec_for_content_type(content_type: Optional[str], default: Optional[Codec] = None) -> Optional[Codec]:
+    """Get the codec for a MIME type, ignoring its parameters"""
+    if not content_type:
+        return default
+    codec = _codecs_by_content_type.get(content_type.split(';', 1)[0].strip().lower())
+    if codec is None or not codec.is_available():
+        return default
+    return codec
+
+def list_codecs() -> List[str]:
+    """List the names of the available codecs"""
+    return [name for name, codec in _codecs_by_name.items() if codec.is_available()]
+
+def negotiate_codec(accept: Optional[str], default: Codec) -> Codec:
+    """Pick the codec for a response from an HTTP Accept header"""
+    if not accept:
+        return default
+    
+    # Order the media ranges by their quality value, keeping the header order for ties
+    ranges = []
+    for index, media_range in enumerate(accept.split(',')):
+        media_type, _, params = media_range.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, index, media_type.strip().lower()))
+    
+    for _, _, media_type in sorted(ranges):
+        if media_type in ('*/*', 'application/*'):
+            return default
+        codec = get_codec_for_content_type(media_type)
+        if codec is not None:
+            return codec
+    return default
+
+def frame_payload(codec: Codec, data: bytes) -> bytes:
+    """Prefix an encoded payload with the codec marker for MQTT 3.1.1"""
+    if codec.marker is None:
+        return data
+    return bytes((MARKER_PREFIX, codec.marker)) + data
+
+def unframe_payload(data: BytesLike, default: Codec) -> Tuple[Codec, BytesLike]:
+    """Get the codec of a payload from its marker and the payload without it"""
+    if len(data) >= 2 and data[0] == MARKER_PREFIX:
+        codec = _codecs_by_marker.get(data[1])
+        if codec is None:
+            raise ValueError(f"Unknown codec marker: {data[1]}")
+        return _check_available(codec), memoryview(data)[2:]
+    return default, data
@@ -0,0 +1,60 @@
+from typing import Any
+
+from ..utils import json_dumps, json_loads
+from .base import BytesLike, Codec
+
+# MessagePack and CBOR are optional, their codecs are only available when installed
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover - depends on the environment
+    cbor2 = None
+
+class JSONCodec(Codec):
+    """JSON codec, uses orjson when installed"""
+    
+    name = 'json'
+    content_type = 'application/json'
+    
+    def encode(self, obj: Any) -> bytes:
+        return json_dumps(obj)
+    
+    def decode(self, data: BytesLike) -> Any:
+        return json_loads(data)
+
+class MessagePackCodec(Codec):
+    """MessagePack codec, requires the msgpack package"""
+    
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+    aliases = ('application/x-msgpack', 'application/vnd.msgpack')
+    marker = 0x01
+    
+    def is_available(self) -> bool:
+        return msgpack is not None
+    
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+    
+    def decode(self, data: BytesLike) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+class CBORCodec(Codec):
+    """CBOR codec, requires the cbor2 package"""
+    
+    name = 'cbor'
+    content_type = 'application/cbor'
+    marker = 0x02
+    
+    def is_available(self) -> bool:
+        return cbor2 is not None
+    
+    def encode(self, obj: Any) -> bytes:
+        return cbor2.dumps(obj)
+    
+    def decode(self, data: BytesLike) -> Any:
+        return cbor2.loads(data)
@@ -1,5 +1,8 @@
 from .mqtt_service_manager import MQTTServiceManager
+from .admission import AdmissionController, AdmissionRejected
 
 __all__ = [
     'MQTTServiceManager',
+    'AdmissionController',
+    'AdmissionRejected',
 ] 
\ No newline at end of file
@@ -0,0 +1,83 @@
+import logging
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from ..protocols import BaseProtocol
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """Raised when a request is refused to protect an overloaded or unavailable broker"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Admission control for the requests routed to one broker.
+
+    A request is refused with 429 when the broker already has
+    ``max_concurrent_requests`` requests in progress, and with 503 when the
+    broker is disconnected or its outbound MQTT queue (in-flight plus queued
+    messages, as reported by paho) is deeper than ``max_queued_messages``.
+    Durable messages are still accepted while the broker is disconnected if
+    it has a spool to keep them. Requests waiting for a response are also
+    refused with 503 while the circuit of the broker is open.
+    """
+
+    def __init__(
+        self,
+        protocol: BaseProtocol,
+        max_concurrent_requests: Optional[int] = None,
+        max_queued_messages: Optional[int] = None,
+        retry_after: float = 1.0
+    ):
+        self.protocol = protocol
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_queued_messages = max_queued_messages
+        self.retry_after = retry_after
+        self.in_progress = 0
+        self._counters = {
+            "admitted": 0,
+            "rejected_concurrency": 0,
+            "rejected_queue_depth": 0,
+            "rejected_disconnected": 0,
+            "rejected_circuit_open": 0,
+        }
+
+    def _reject(self, counter: str, status_code: int, reason: str):
+        self._counters[counter] += 1
+        logger.warning("Rejected request for broker **%s**: %s", self.protocol.get_identifier(), reason)
+        raise AdmissionRejected(status_code, reason, self.retry_after)
+
+    def check(self, durable: bool = False):
+        """Raise AdmissionRejected if a new request can not be accepted now"""
+        if self.max_concurrent_requests is not None and self.in_progress >= self.max_concurrent_requests:
+            self._reject("rejected_concurrency", 429, f"Too many concurrent requests ({self.max_concurrent_requests})")
+
+        backpressure = self.protocol.get_backpressure()
+        if not backpressure["connected"] and not (durable and self.protocol.spool is not None):
+            self._reject("rejected_disconnected", 503, "Broker is not connected")
+        if not durable and not self.protocol.connection.available:
+            self._reject("rejected_circuit_open", 503, "Broker circuit is open")
+        if self.max_queued_messages is not None:
+            depth = backpressure["inflight"] + backpressure["queued"]
+            if depth >= self.max_queued_messages:
+                self._reject("rejected_queue_depth", 503, f"Broker outbound queue is full ({depth} messages)")
+
+    @contextmanager
+    def admit(self, durable: bool = False):
+        """Hold a request slot for the duration of the block, raising AdmissionRejected if refused"""
+        self.check(durable)
+        self.in_progress += 1
+        self._counters["admitted"] += 1
+        try:
+            yield
+        finally:
+            self.in_progress -= 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get the current load, the broker backpressure signals and the admission counters"""
+        return {"in_progress": self.in_progress, **self.protocol.get_backpressure(), **self._counters}
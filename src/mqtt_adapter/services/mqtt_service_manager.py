@@ -1,10 +1,17 @@
 import asyncio
 import uuid
 import logging
-from typing import Callable, Dict, Optional
+from contextlib import ExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
 
-from ..models import MQTTAppConfig, MQTTRequest, MQTTResponse
-from ..protocols import BaseProtocol, MQTTBrokerRegistry, MQTTProtocolFactory
+from ..models import BrokerGroupConfig, MQTTAppConfig, MQTTRequest, RequestRecord, ResponseRecord
+from ..protocols import BaseProtocol, MQTTBrokerRegistry, MQTTProtocolFactory, ReplyStream, gather_responses, publish_to_all
+from ..protocols.connection import CIRCUIT_OPEN, CONNECTED
+from ..protocols.fanout import GATHER_ALL
+from ..utils.metrics import ERRORS, METRICS
+from ..utils.tracing import TRACER
+from .admission import AdmissionController, AdmissionRejected
+from .response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +29,8 @@ class MQTTServiceManager:
         self.loop = loop or asyncio.get_event_loop()
         self.registry = MQTTBrokerRegistry()
         self.protocols: Dict[str, BaseProtocol] = {}
+        self.admission: Dict[str, AdmissionController] = {}
+        self.response_caches: Dict[str, ResponseCache] = {}
     
     async def initialize(self):
         """Initialize all protocols"""
@@ -34,6 +43,22 @@ class MQTTServiceManager:
             loop=self.loop
         )
         
+        # Limit the requests routed to each broker
+        for broker_id, protocol in self.protocols.items():
+            broker_config = self.config.get_broker_config(broker_id)
+            self.admission[broker_id] = AdmissionController(
+                protocol,
+                max_concurrent_requests=broker_config.max_concurrent_requests,
+                max_queued_messages=broker_config.max_queued_messages,
+                retry_after=broker_config.retry_after
+            )
+            if broker_config.response_cache:
+                self.response_caches[broker_id] = ResponseCache(
+                    broker_id, broker_config.response_cache, broker_config.response_cache_size
+                )
+        
+        self._register_gauges()
+        
         # Start all protocols
         for broker_id, protocol in self.protocols.items():
             await protocol.start()
@@ -51,51 +76,366 @@ class MQTTServiceManager:
         
         logger.info("MQTT Service Manager shutdown completed")
     
-    async def route_request(self, request: MQTTRequest) -> MQTTResponse:
-        """Route a request to the appropriate broker"""
+    async def route_request(
+        self,
+        request: Union[RequestRecord, MQTTRequest],
+        timeout: float = 30.0
+    ) -> Optional[ResponseRecord]:
+        """Route a request to the appropriate broker, waiting at most timeout seconds for its response"""
         try:
             # Determine the target broker
             target_broker_id = request.target_broker_id
             
             if not target_broker_id:
-                return MQTTResponse(
+                return ResponseRecord(
                     status_code=400,
                     payload={"error": "No target broker specified"},
                     correlation_id=request.correlation_id
                 )
             
-            # Get the protocol for the target broker
-            if target_broker_id not in self.protocols:
-                return MQTTResponse(
+            # Get the protocols for the target broker, broker group or list of brokers
+            targets, group = self.registry.resolve_targets(target_broker_id)
+            unknown = [broker_id for broker_id in targets if broker_id not in self.protocols]
+            if unknown:
+                return ResponseRecord(
                     status_code=404,
-                    payload={"error": f"Broker not found: {target_broker_id}"},
+                    payload={"error": f"Broker not found: {', '.join(unknown)}"},
                     correlation_id=request.correlation_id
                 )
-            
-            protocol = self.protocols[target_broker_id]
+            if group is not None or len(targets) > 1:
+                return await self._route_to_brokers(request, targets, group, timeout)
+            # A list of one broker is routed like its broker ID
+            target_broker_id = targets[0]
             
             # Generate a correlation ID if not provided
             correlation_id = request.correlation_id or str(uuid.uuid4())
-            is_response = request.is_response
-            if is_response:
-                # Send the request and wait for the response
-                response = await protocol.request(
+            
+            # Reads of cached topics are answered from the cache, concurrent ones share one request
+            cache = self.response_caches.get(target_broker_id)
+            if cache is not None and request.is_response:
+                rule = cache.rule_for(request.topic)
+                if rule is not None:
+                    return await cache.get(
+                        request.topic,
+                        request.payload,
+                        correlation_id,
+                        rule,
+                        lambda fetch_id: self._route_once(request, target_broker_id, fetch_id, timeout)
+                    )
+            return await self._route_once(request, target_broker_id, correlation_id, timeout)
+            
+        except AdmissionRejected as e:
+            return self._rejected_response(e, request.correlation_id)
+        except Exception as e:
+            if isinstance(request.target_broker_id, str) and request.target_broker_id in self.protocols:
+                ERRORS.labels(request.target_broker_id, 'route').inc()
+            logger.error("Error routing request: %s", e, extra={"correlation_id": request.correlation_id})
+            return ResponseRecord(
+                status_code=500,
+                payload={"error": str(e)},
+                correlation_id=request.correlation_id or str(uuid.uuid4())
+            )
+    
+    async def _route_once(
+        self,
+        request: Union[RequestRecord, MQTTRequest],
+        target_broker_id: str,
+        correlation_id: str,
+        timeout: float
+    ) -> Optional[ResponseRecord]:
+        """Route a request to one broker, unless it is a retry of a request already routed"""
+        return await self._send_once(
+            self.protocols[target_broker_id],
+            request,
+            correlation_id,
+            lambda: self._route_to_broker(request, target_broker_id, correlation_id, timeout)
+        )
+    
+    async def _send_once(
+        self,
+        protocol: BaseProtocol,
+        request: Union[RequestRecord, MQTTRequest],
+        correlation_id: str,
+        send: Callable[[], Awaitable[Optional[ResponseRecord]]]
+    ) -> Optional[ResponseRecord]:
+        """Send a request to a broker with send(), unless the dedup cache of the broker already saw it"""
+        dedup = protocol.dedup
+        if dedup is None:
+            return await send()
+        seen, response = protocol.check_duplicate(correlation_id)
+        if seen:
+            return self._duplicate_response(request, response, correlation_id)
+        try:
+            response = await send()
+        except BaseException:
+            dedup.discard(correlation_id)
+            raise
+        dedup.complete(correlation_id, response)
+        return response
+    
+    async def _route_to_broker(
+        self,
+        request: Union[RequestRecord, MQTTRequest],
+        target_broker_id: str,
+        correlation_id: str,
+        timeout: float
+    ) -> Optional[ResponseRecord]:
+        """Send a request to one broker, or publish it when no response is expected"""
+        # Requests go to the failover broker while the circuit of the target is open
+        protocol = self.registry.select_protocol(target_broker_id)
+        target_broker_id = protocol.get_identifier()
+        is_response = request.is_response
+        
+        # Refuse the request right away when the broker can not keep up
+        try:
+            with self.admission[target_broker_id].admit(durable=not is_response), TRACER.start_span('route_request') as span:
+                span.set_attribute('mqtt.broker', target_broker_id)
+                span.set_attribute('mqtt.topic', request.topic)
+                if is_response:
+                    # Send the request and wait for the response
+                    response = await protocol.request(
+                        topic=request.topic,
+                        payload=request.payload,
+                        correlation_id=correlation_id,
+                        timeout=timeout
+                    )
+                    
+                    return response
+                
+                # Fire and forget, publish the payload without waiting for a response
+                await protocol.publish(
                     topic=request.topic,
                     payload=request.payload,
                     correlation_id=correlation_id,
-                    timeout=30.0
+                    durable=True
                 )
+                return None
+        except AdmissionRejected as e:
+            return self._rejected_response(e, correlation_id)
+    
+    def _rejected_response(self, error: AdmissionRejected, correlation_id: str) -> ResponseRecord:
+        """Get the response for a request refused by admission control"""
+        return ResponseRecord(
+            status_code=error.status_code,
+            payload={"error": str(error), "retry_after": error.retry_after},
+            correlation_id=correlation_id
+        )
+    
+    def _duplicate_response(
+        self,
+        request: Union[RequestRecord, MQTTRequest],
+        response: Optional[ResponseRecord],
+        correlation_id: str
+    ) -> Optional[ResponseRecord]:
+        """Answer a request received again: with the cached response, or 409 while the first one is in progress"""
+        logger.info("Duplicate request for broker %s", request.target_broker_id, extra={"correlation_id": correlation_id})
+        if response is not None or not request.is_response:
+            # Fire-and-forget messages were already published
+            return response
+        return ResponseRecord(
+            status_code=409,
+            payload={"error": "Duplicate request, the first one is still in progress"},
+            correlation_id=correlation_id
+        )
+    
+    async def _route_to_brokers(
+        self,
+        request: Union[RequestRecord, MQTTRequest],
+        targets: List[str],
+        group: Optional[BrokerGroupConfig],
+        timeout: float
+    ) -> Optional[ResponseRecord]:
+        """Send a request to several brokers at once, holding an admission slot on each of them"""
+        correlation_id = request.correlation_id or str(uuid.uuid4())
+        protocols = {broker_id: self.protocols[broker_id] for broker_id in targets}
+        
+        with ExitStack() as admitted, TRACER.start_span('route_request') as span:
+            for broker_id in targets:
+                admitted.enter_context(self.admission[broker_id].admit(durable=not request.is_response))
+            span.set_attribute('mqtt.broker', ','.join(targets))
+            span.set_attribute('mqtt.topic', request.topic)
+            if request.is_response:
+                # Retries only go again to the brokers that did not answer the first time
+                async def send(protocol: BaseProtocol) -> ResponseRecord:
+                    return await self._send_once(
+                        protocol,
+                        request,
+                        correlation_id,
+                        lambda: protocol.request(request.topic, request.payload, correlation_id, timeout)
+                    )
                 
-                return response
-            return None
+                return await gather_responses(
+                    protocols,
+                    correlation_id,
+                    send,
+                    group.gather if group is not None else GATHER_ALL,
+                    group.quorum if group is not None else None
+                )
             
-        except Exception as e:
-            logger.error(f"Error routing request: {str(e)}")
-            return MQTTResponse(
-                status_code=500,
-                payload={"error": str(e)},
-                correlation_id=request.correlation_id or str(uuid.uuid4())
+            # Retries are only published again to the brokers that failed the first time
+            fresh = {}
+            for broker_id, protocol in protocols.items():
+                if protocol.dedup is not None and protocol.check_duplicate(correlation_id)[0]:
+                    logger.info("Duplicate request for broker %s", broker_id, extra={"correlation_id": correlation_id})
+                    continue
+                fresh[broker_id] = protocol
+            
+            # Fire and forget, the payload is encoded once for all the brokers
+            failed = publish_to_all(fresh, request.topic, request.payload, correlation_id)
+            for broker_id, error in failed.items():
+                if fresh[broker_id].dedup is not None:
+                    fresh[broker_id].dedup.discard(correlation_id)
+                ERRORS.labels(broker_id, 'route').inc()
+                logger.error("Error publishing to broker %s: %s", broker_id, error, extra={"correlation_id": correlation_id})
+            if failed:
+                return ResponseRecord(
+                    status_code=502,
+                    payload={"error": "Failed to publish to some brokers", "failed": failed},
+                    correlation_id=correlation_id
+                )
+            return None
+    
+    @asynccontextmanager
+    async def open_stream(
+        self,
+        request: Union[RequestRecord, MQTTRequest],
+        timeout: float = 30.0,
+        max_replies: Optional[int] = None,
+        buffer_size: int = 100
+    ) -> AsyncIterator[Union[ReplyStream, ResponseRecord]]:
+        """
+        Send a request whose responses are streamed, yielding the ReplyStream
+        or the error response when the request could not be sent. The request
+        holds its admission slot until the block exits
+        """
+        correlation_id = request.correlation_id or str(uuid.uuid4())
+        targets, group = self.registry.resolve_targets(request.target_broker_id)
+        if group is not None or len(targets) != 1:
+            yield ResponseRecord(
+                status_code=400,
+                payload={"error": "Streaming responses from several brokers is not supported"},
+                correlation_id=correlation_id
+            )
+            return
+        if targets[0] not in self.protocols:
+            yield ResponseRecord(
+                status_code=404,
+                payload={"error": f"Broker not found: {targets[0]}"},
+                correlation_id=correlation_id
             )
+            return
+        protocol = self.registry.select_protocol(targets[0])
+        
+        stream = None
+        try:
+            with self.admission[protocol.get_identifier()].admit():
+                stream = await protocol.request_stream(
+                    topic=request.topic,
+                    payload=request.payload,
+                    correlation_id=correlation_id,
+                    timeout=timeout,
+                    max_replies=max_replies,
+                    buffer_size=buffer_size
+                )
+                if stream is None:
+                    yield protocol._overloaded_response(correlation_id)
+                    return
+                yield stream
+        except AdmissionRejected as e:
+            yield self._rejected_response(e, correlation_id)
+        finally:
+            # Stop collecting replies when the reader goes away early
+            if stream is not None and not stream.closed:
+                protocol.discard_pending(correlation_id)
+    
+    def add_listener(self, broker_id: str, topic_filter: str, callback: Callable[[str, Any], None]):
+        """Call callback(topic, payload) for the messages of a broker matching the topic filter"""
+        if broker_id not in self.protocols:
+            raise KeyError(f"Broker not found: {broker_id}")
+        self.protocols[broker_id].add_listener(topic_filter, callback)
+    
+    def remove_listener(self, broker_id: str, topic_filter: str, callback: Callable[[str, Any], None]):
+        """Stop calling a listener added with add_listener"""
+        if broker_id in self.protocols:
+            self.protocols[broker_id].remove_listener(topic_filter, callback)
+    
+    def _register_gauges(self):
+        """Expose the pending table sizes and paho queue depths as gauges, read at scrape time"""
+        METRICS.gauge_callback(
+            'mqtt_adapter_pending_requests', 'Requests waiting for a response from the broker', ['broker'],
+            lambda: [((broker_id,), len(protocol._pending_requests)) for broker_id, protocol in self.protocols.items()]
+        )
+        METRICS.gauge_callback(
+            'mqtt_adapter_requests_in_progress', 'HTTP requests in progress for the broker', ['broker'],
+            lambda: [((broker_id,), admission.in_progress) for broker_id, admission in self.admission.items()]
+        )
+        METRICS.gauge_callback(
+            'mqtt_adapter_spool_messages', 'Messages spooled on disk for the broker, waiting to be replayed', ['broker'],
+            lambda: [((broker_id,), stats["messages"]) for broker_id, stats in self.get_spool_stats().items()]
+        )
+        METRICS.gauge_callback(
+            'mqtt_adapter_spool_bytes', 'Size of the on-disk spool of the broker', ['broker'],
+            lambda: [((broker_id,), stats["bytes"]) for broker_id, stats in self.get_spool_stats().items()]
+        )
+        METRICS.gauge_callback(
+            'mqtt_adapter_response_cache_entries', 'Responses cached for the requests to the broker', ['broker'],
+            lambda: [((broker_id,), len(cache)) for broker_id, cache in self.response_caches.items()]
+        )
+        METRICS.gauge_callback(
+            'mqtt_adapter_dedup_keys', 'Request keys remembered by the dedup cache of the broker', ['broker'],
+            lambda: [((broker_id,), stats["keys"]) for broker_id, stats in self.get_dedup_stats().items()]
+        )
+        METRICS.gauge_callback(
+            'mqtt_adapter_broker_connected', 'Whether the adapter is connected to the broker', ['broker'],
+            lambda: [((broker_id,), int(protocol.connection.state == CONNECTED)) for broker_id, protocol in self.protocols.items()]
+        )
+        METRICS.gauge_callback(
+            'mqtt_adapter_circuit_open', 'Whether requests to the broker fail fast, its circuit being open', ['broker'],
+            lambda: [((broker_id,), int(protocol.connection.circuit == CIRCUIT_OPEN)) for broker_id, protocol in self.protocols.items()]
+        )
+        METRICS.gauge_callback(
+            'mqtt_adapter_mqtt_queue_depth', 'Outbound MQTT messages in flight or queued in paho', ['broker', 'state'],
+            self._queue_depth_samples
+        )
+    
+    def _queue_depth_samples(self):
+        for broker_id, protocol in self.protocols.items():
+            backpressure = protocol.get_backpressure()
+            yield (broker_id, 'inflight'), backpressure["inflight"]
+            yield (broker_id, 'queued'), backpressure["queued"]
+    
+    def get_pending_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the pending request table counters of every broker"""
+        return {broker_id: protocol.get_pending_stats() for broker_id, protocol in self.protocols.items()}
+    
+    def get_spool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the spool depth and counters of the brokers with a spool"""
+        return {
+            broker_id: protocol.spool.get_stats()
+            for broker_id, protocol in self.protocols.items() if protocol.spool is not None
+        }
+    
+    def get_connection_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get the connection state, circuit state and last seen latency of every broker"""
+        return {
+            broker_id: {**protocol.connection.get_status(), "failover": protocol.config.failover}
+            for broker_id, protocol in self.protocols.items()
+        }
+    
+    def get_dedup_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the size and counters of the dedup caches of the brokers with one"""
+        return {
+            broker_id: protocol.dedup.get_stats()
+            for broker_id, protocol in self.protocols.items() if protocol.dedup is not None
+        }
+    
+    def get_response_cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the size and lookup counters of the response caches of the brokers with one"""
+        return {broker_id: cache.get_stats() for broker_id, cache in self.response_caches.items()}
+    
+    def get_admission_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the admission counters and backpressure signals of every broker"""
+        return {broker_id: admission.get_stats() for broker_id, admission in self.admission.items()}
     
     def get_protocol(self, broker_id: str) -> BaseProtocol:
         """Get a protocol by broker ID"""
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+from paho.mqtt.client import topic_matches_sub
+
+from ..models import ResponseCacheRule, ResponseRecord
+from ..protocols.routing import validate_topic_filter
+from ..utils.metrics import RESPONSE_CACHE
+
+logger = logging.getLogger(__name__)
+
+class _Entry:
+    """Cached response with the times it is fresh and stale until"""
+    __slots__ = ('response', 'fresh_until', 'stale_until')
+
+    def __init__(self, response: ResponseRecord, fresh_until: float, stale_until: float):
+        self.response = response
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+class ResponseCache:
+    """
+    Cache of the responses to the requests sent to one broker.
+
+    Only requests whose topic matches one of the rules are cached, keyed by
+    topic and payload. A response is served for ``ttl`` seconds, then for
+    ``stale_ttl`` more seconds while a single background request refreshes
+    it. Requests missing the cache while the same request is in flight wait
+    for its response instead of sending their own. Only successful (2xx)
+    responses are cached, at most ``max_entries`` of them, the least
+    recently used going first.
+    """
+
+    def __init__(self, broker_id: str, rules: Iterable[ResponseCacheRule], max_entries: int = 10000):
+        self.rules = list(rules)
+        for rule in self.rules:
+            validate_topic_filter(rule.topic)
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._counters = {"hit": 0, "stale": 0, "miss": 0, "coalesced": 0, "evicted": 0}
+        self._lookups = {result: RESPONSE_CACHE.labels(broker_id, result) for result in ("hit", "stale", "miss", "coalesced")}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def rule_for(self, topic: str) -> Optional[ResponseCacheRule]:
+        """Get the first rule matching a request topic, None if its responses are not cached"""
+        for rule in self.rules:
+            if topic_matches_sub(rule.topic, topic):
+                return rule
+        return None
+
+    def _count(self, result: str):
+        self._counters[result] += 1
+        self._lookups[result].inc()
+
+    async def get(
+        self,
+        topic: str,
+        payload: Any,
+        correlation_id: str,
+        rule: ResponseCacheRule,
+        fetch: Callable[[str], Awaitable[ResponseRecord]]
+    ) -> ResponseRecord:
+        """
+        Get the response to a request, from the cache or from the request
+        in flight if possible, fetch(correlation_id) sending the request
+        otherwise. The response carries the correlation ID of the caller
+        """
+        key = (topic, json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str))
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now < entry.fresh_until:
+                self._entries.move_to_end(key)
+                self._count("hit")
+                return entry.response._replace(correlation_id=correlation_id)
+            if now < entry.stale_until:
+                self._entries.move_to_end(key)
+                self._count("stale")
+                if key not in self._inflight:
+                    self._start_fetch(key, rule, fetch, str(uuid.uuid4()))
+                return entry.response._replace(correlation_id=correlation_id)
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self._count("miss")
+            task = self._start_fetch(key, rule, fetch, correlation_id)
+        else:
+            self._count("coalesced")
+        # A caller going away must not cancel the request the others wait for
+        response = await asyncio.shield(task)
+        return response._replace(correlation_id=correlation_id)
+
+    def _start_fetch(
+        self,
+        key: Hashable,
+        rule: ResponseCacheRule,
+        fetch: Callable[[str], Awaitable[ResponseRecord]],
+        correlation_id: str
+    ) -> asyncio.Task:
+        task = asyncio.ensure_future(self._fetch(key, rule, fetch, correlation_id))
+        self._inflight[key] = task
+        return task
+
+    async def _fetch(
+        self,
+        key: Hashable,
+        rule: ResponseCacheRule,
+        fetch: Callable[[str], Awaitable[ResponseRecord]],
+        correlation_id: str
+    ) -> ResponseRecord:
+        """Send the request and cache its response if successful"""
+        try:
+            response = await fetch(correlation_id)
+        except Exception as e:
+            logger.error("Error fetching response to cache: %s", e, extra={"correlation_id": correlation_id})
+            response = ResponseRecord(status_code=500, payload={"error": str(e)}, correlation_id=correlation_id)
+        finally:
+            self._inflight.pop(key, None)
+
+        if 200 <= response.status_code < 300:
+            now = time.monotonic()
+            self._entries[key] = _Entry(response, now + rule.ttl, now + rule.ttl + rule.stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evicted"] += 1
+        return response
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get the number of cached responses, the requests in flight and the lookup counters"""
+        return {"entries": len(self._entries), "inflight": len(self._inflight), **self._counters}
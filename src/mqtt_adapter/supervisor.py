@@ -0,0 +1,154 @@
+import logging
+import multiprocessing
+import signal
+import time
+import uuid
+from multiprocessing.connection import wait
+from typing import Any, Dict, Optional
+
+from .app import run_app
+from .utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+def _run_worker(
+    index: int,
+    config_path: Optional[str],
+    instance_id: str,
+    log_level: Optional[str],
+    log_file: Optional[str],
+    log_options: Dict[str, Any]
+):
+    """Entry point of a worker process"""
+    setup_logging(log_level, log_file, **log_options)
+    logger.info(f"Worker {index} started with instance ID **{instance_id}**")
+    run_app(config_path, instance_id, worker=True)
+
+class WorkerSupervisor:
+    """
+    Runs the adapter in several worker processes sharing the HTTP port through
+    SO_REUSEPORT, and restarts workers that exit unexpectedly (with a non-zero
+    exit code). Restarts are scheduled rather than slept on, so other workers
+    stay supervised and a stop signal is handled at once while one backs off
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        config_path: Optional[str] = None,
+        instance_id: Optional[str] = None,
+        log_level: Optional[str] = None,
+        log_file: Optional[str] = None,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 30.0,
+        log_options: Optional[Dict[str, Any]] = None
+    ):
+        self.workers = workers
+        self.config_path = config_path
+        self.instance_id = instance_id or uuid.uuid4().hex[:8]
+        self.log_level = log_level
+        self.log_file = log_file
+        self.log_options = log_options or {}
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._restart_delays: Dict[int, float] = {}
+        self._started_at: Dict[int, float] = {}
+        # Time each exited worker is due to be restarted at
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def get_worker_instance_id(self, index: int) -> str:
+        """Get the instance ID of a worker, stable across restarts of the same worker"""
+        return f"{self.instance_id}-w{index}"
+
+    def _start_worker(self, index: int):
+        """Start the worker process with the given index"""
+        process = self._context.Process(
+            target=_run_worker,
+            args=(index, self.config_path, self.get_worker_instance_id(index), self.log_level, self.log_file,
+                  self.log_options),
+            name=f"mqtt-adapter-worker-{index}",
+            daemon=False
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def _handle_exit(self, index: int):
+        """Schedule the restart of a worker that crashed, backing off when it keeps crashing"""
+        process = self._processes.pop(index)
+        process.join()
+        if self._stopping:
+            return
+        if process.exitcode == 0:
+            logger.info(f"Worker {index} (pid {process.pid}) shut down cleanly")
+            return
+
+        # Reset the backoff if the worker ran for a while before exiting
+        delay = self._restart_delays.get(index, self.restart_delay)
+        if time.monotonic() - self._started_at[index] > self.max_restart_delay:
+            delay = self.restart_delay
+        self._restart_delays[index] = min(delay * 2, self.max_restart_delay)
+        self._restart_at[index] = time.monotonic() + delay
+        logger.warning(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, restarting in {delay:.1f}s")
+
+    def _restart_due(self):
+        """Restart the workers whose backoff is over"""
+        now = time.monotonic()
+        for index, restart_at in list(self._restart_at.items()):
+            if restart_at <= now and not self._stopping:
+                del self._restart_at[index]
+                self._start_worker(index)
+
+    def _request_stop(self, signum, frame):
+        """Signal handler asking the supervisor to stop all workers"""
+        logger.info(f"Received signal {signum}, stopping workers")
+        self._stopping = True
+
+    def stop(self, timeout: float = 10.0):
+        """Stop all workers, killing those that do not exit in time"""
+        self._stopping = True
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + timeout
+        for index, process in list(self._processes.items()):
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not stop in time, killing it")
+                process.kill()
+                process.join()
+        self._processes.clear()
+
+    def run(self):
+        """Start the workers and supervise them until a stop signal is received"""
+        logger.info(f"Starting {self.workers} workers with instance ID **{self.instance_id}**")
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self._request_stop)
+
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        try:
+            while not self._stopping and (self._processes or self._restart_at):
+                sentinels = {process.sentinel: index for index, process in self._processes.items()}
+                # Wake up for the next restart due, and at least every second to notice stop signals
+                timeout = 1.0
+                if self._restart_at:
+                    timeout = max(0.0, min(timeout, min(self._restart_at.values()) - time.monotonic()))
+                if sentinels:
+                    ready = wait(list(sentinels), timeout=timeout)
+                else:
+                    time.sleep(timeout)
+                    ready = []
+                for sentinel in ready:
+                    self._handle_exit(sentinels[sentinel])
+                self._restart_due()
+        finally:
+            self.stop()
+            logger.info("All workers stopped")
@@ -1,5 +1,9 @@
 from .logging import setup_logging
+from .json_codec import JSON_BACKEND, json_dumps, json_loads
 
 __all__ = [
     'setup_logging',
-] 
\ No newline at end of file
+    'JSON_BACKEND',
+    'json_dumps',
+    'json_loads',
+]
@@ -0,0 +1,36 @@
+import json
+from typing import Any, Union
+
+# orjson is optional, it serializes straight to bytes and is several times faster
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+def json_dumps(obj: Any) -> bytes:
+    """
+    Serialize an object to compact JSON bytes using the fastest available
+    backend. What orjson refuses but json accepts (integers above 64 bits,
+    non-str dict keys) goes through json, so the output does not depend on
+    whether orjson is installed
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def json_loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Deserialize JSON from bytes or text using the fastest available backend"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            # NaN and Infinity are only accepted by json, which also reports the other errors
+            pass
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
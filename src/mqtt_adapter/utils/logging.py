@@ -1,34 +1,148 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
 import sys
 import os
+import time
+import zlib
 from typing import Optional
 
-def setup_logging(log_level: str = None, log_file: str = None):
+# Logger of the per-message step logs, sampled by message_sample_rate
+MESSAGE_LOGGER = 'mqtt_adapter.messages'
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes of every LogRecord, anything else was passed through extra=
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that hands the record over as is. The standard handler
+    formats the message in the calling thread, here formatting is left to the
+    listener thread so the network thread and event loop never pay for it
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Drop the record rather than block the caller
+            pass
+
+class MessageSamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the per-message logs. The decision is taken per
+    correlation ID (passed with extra=), so all the step logs of a sampled
+    message are kept together
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.threshold = int(max(0.0, min(1.0, rate)) * 0xFFFFFFFF)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        correlation_id = getattr(record, 'correlation_id', None)
+        key = correlation_id.encode('utf-8') if correlation_id else str(record.relativeCreated).encode('utf-8')
+        return zlib.crc32(key) <= self.threshold
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including the fields passed with extra="""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def _stop_listener():
+    """Flush the queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(_stop_listener)
+
+def setup_logging(
+    log_level: str = None,
+    log_file: str = None,
+    log_format: str = None,
+    use_queue: bool = None,
+    message_sample_rate: float = None
+):
     """
     Set up logging for the application
-    
+
     Args:
         log_level: The log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
         log_file: Optional path to a log file
+        log_format: text (default) or json, one JSON object per line
+        use_queue: Write the logs from a background thread (default), so slow
+            disks or terminals never block the network thread or event loop
+        message_sample_rate: Fraction of the messages whose per-message step
+            logs are kept (default 1)
     """
-    # Get log level from environment or parameter
+    global _listener
+    
+    # Get the settings from environment or parameters
     level_name = log_level or os.environ.get('LOG_LEVEL', 'INFO')
     level = getattr(logging, level_name.upper(), logging.INFO)
-    
+    log_format = log_format or os.environ.get('LOG_FORMAT', 'text')
+    if use_queue is None:
+        use_queue = os.environ.get('LOG_QUEUE', 'true').lower() in ('true', '1', 'yes')
+    if message_sample_rate is None:
+        message_sample_rate = float(os.environ.get('LOG_MESSAGE_SAMPLE_RATE', '1'))
+
     # Configure logging
     handlers = [logging.StreamHandler(sys.stdout)]
-    
+
     if log_file:
         handlers.append(logging.FileHandler(log_file))
-    
+
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _stop_listener()
+    if use_queue:
+        # Only the queue handler runs in the calling threads, the listener
+        # thread formats the records and writes them out
+        log_queue = queue.Queue(maxsize=100000)
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        handlers = [_NonBlockingQueueHandler(log_queue)]
+
     logging.basicConfig(
         level=level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=handlers
+        handlers=handlers,
+        force=True
     )
-    
+
+    # Keep only a sample of the per-message logs
+    message_logger = logging.getLogger(MESSAGE_LOGGER)
+    message_logger.filters.clear()
+    if message_sample_rate < 1:
+        message_logger.addFilter(MessageSamplingFilter(message_sample_rate))
+
     # Reduce verbosity of third-party libraries
     logging.getLogger('aiohttp').setLevel(logging.WARNING)
     logging.getLogger('paho').setLevel(logging.WARNING)
-    
-    logging.info(f"Logging initialized at level {level_name}") 
\ No newline at end of file
+
+    logging.info("Logging initialized at level %s", level_name)
@@ -0,0 +1,221 @@
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Minimal Prometheus instrumentation, cheap enough for the message hot path.
+#
+# Updates take no locks. A counter series keeps one cell per updating thread
+# and sums them at render time, since a series can be bumped from the event
+# loop and from paho network threads (e.g. a route publishing to its target
+# broker from the source broker's thread). Histograms are only observed on the
+# event loop and are bumped in place. Series are created once per label set
+# and should be cached by the caller with ``labels()``.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from sub-millisecond local hops to the request timeout
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+class _CounterSeries:
+    __slots__ = ('_local', '_cells')
+
+    def __init__(self):
+        self._local = threading.local()
+        # Cell of every thread that updated the series, kept after the thread exits
+        self._cells: List[List[float]] = []
+
+    def inc(self, amount: int = 1):
+        try:
+            self._local.cell[0] += amount
+        except AttributeError:
+            cell = self._local.cell = [0]
+            self._cells.append(cell)
+            cell[0] += amount
+
+    @property
+    def value(self) -> float:
+        return sum(cell[0] for cell in list(self._cells))
+
+class _HistogramSeries:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus the +Inf bucket, cumulated at render time
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class _Metric:
+    """Metric family with its series keyed by label values"""
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], object] = {}
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Get the series for the given label values, creating it on first use"""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"Metric {self.name} expects labels {self.labelnames}")
+            series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    type_name = 'counter'
+
+    def _new_series(self) -> _CounterSeries:
+        return _CounterSeries()
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for values, series in list(self._series.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(series.value)}')
+        return lines
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+    type_name = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self) -> _HistogramSeries:
+        return _HistogramSeries(self.buckets)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        bucket_labels = self.labelnames + ('le',)
+        for values, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), list(series.counts)):
+                cumulative += count
+                labels = _format_labels(bucket_labels, values + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series.sum)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class CallbackGauge(_Metric):
+    """Gauge read at scrape time, costing nothing on the hot path"""
+    type_name = 'gauge'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for values, value in self.callback():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}')
+        return lines
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Register a metric, replacing any previous metric with the same name"""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]
+    ) -> CallbackGauge:
+        return self.register(CallbackGauge(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+
+MESSAGES_IN = METRICS.counter(
+    'mqtt_adapter_messages_in_total', 'MQTT messages received from the broker', ['broker'])
+MESSAGES_OUT = METRICS.counter(
+    'mqtt_adapter_messages_out_total', 'MQTT messages published to the broker', ['broker'])
+MESSAGES_FORWARDED = METRICS.counter(
+    'mqtt_adapter_messages_forwarded_total', 'Messages forwarded from the broker to another broker', ['broker', 'target'])
+REQUESTS_TIMED_OUT = METRICS.counter(
+    'mqtt_adapter_requests_timed_out_total', 'Requests to the broker that got no response in time', ['broker'])
+ERRORS = METRICS.counter(
+    'mqtt_adapter_errors_total', 'Errors while handling messages of the broker', ['broker', 'stage'])
+RESPONSE_CACHE = METRICS.counter(
+    'mqtt_adapter_response_cache_total', 'Response cache lookups of the requests to the broker, by result', ['broker', 'result'])
+DEDUP_LOOKUPS = METRICS.counter(
+    'mqtt_adapter_dedup_lookups_total', 'Duplicate checks of the requests and messages of the broker, by result', ['broker', 'result'])
+
+HTTP_ROUND_TRIP = METRICS.histogram(
+    'mqtt_adapter_http_round_trip_seconds', 'HTTP to MQTT request handling time, by target broker', ['broker'])
+FORWARD_HOP = METRICS.histogram(
+    'mqtt_adapter_forward_hop_seconds', 'MQTT to MQTT forwarding time, by target broker', ['broker'])
+REQUEST_WAIT = METRICS.histogram(
+    'mqtt_adapter_request_wait_seconds', 'Time spent waiting for the response to a request', ['broker'])
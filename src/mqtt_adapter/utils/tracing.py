@@ -0,0 +1,285 @@
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Spans follow the OpenTelemetry data model and the trace context travels as a
+# W3C traceparent ("00-<trace id>-<span id>-<flags>"), in the HTTP header, the
+# JSON envelope field or the MQTT 5 user property of that name. When tracing is
+# disabled, start_span() returns a shared no-op span, so instrumented code does
+# not allocate or format anything. Traces a remote parent did not sample get a
+# non-recording span carrying the parent context, so the trace ID (with the
+# sampled flag cleared) is still passed on downstream.
+
+TRACEPARENT = 'traceparent'
+
+class SpanContext(NamedTuple):
+    """Identifies a span within a trace"""
+    trace_id: str
+    span_id: str
+    sampled: bool = True
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """Parse a W3C traceparent, None if it is missing or malformed"""
+    if not value or len(value) < 55:
+        return None
+    parts = value.strip().split('-')
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return SpanContext(parts[1], parts[2], bool(flags & 0x01))
+
+# Span of the code currently running, inherited by the tasks it creates
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """Timed operation within a trace, ended and exported when its block exits"""
+    __slots__ = ('tracer', 'name', 'context', 'parent_span_id', 'start_ns', 'end_ns', 'attributes', 'status', '_token')
+
+    def __init__(self, tracer: 'Tracer', name: str, context: SpanContext, parent_span_id: Optional[str], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_span_id = parent_span_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.status = 'OK'
+        self._token = None
+
+    @property
+    def traceparent(self) -> Optional[str]:
+        return self.context.traceparent
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = 'ERROR'
+        self.attributes['error'] = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        if not self.end_ns:
+            self.end_ns = time.time_ns()
+            self.tracer.exporter.export(self)
+
+    def __enter__(self) -> 'Span':
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.record_error(exc)
+        self.end()
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the span to a dictionary using the OpenTelemetry field names"""
+        return {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "parentSpanId": self.parent_span_id or '',
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+class _NoopSpan:
+    """Span returned when a trace is not recorded"""
+    __slots__ = ()
+    context = None
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+class _NonRecordingSpan(_NoopSpan):
+    """Span of a trace that is not sampled, propagating its context without exporting anything"""
+    __slots__ = ('context', '_token')
+
+    def __init__(self, context: SpanContext):
+        self.context = context
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return self.context.traceparent
+
+    def __enter__(self) -> '_NonRecordingSpan':
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        return False
+
+class SpanExporter:
+    """Destination of finished spans"""
+
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+class InMemorySpanExporter(SpanExporter):
+    """Keeps the latest finished spans in memory"""
+
+    def __init__(self, max_spans: int = 10000):
+        self._spans = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self._spans.append(span)
+
+    def get_spans(self, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get the finished spans, optionally only those of one trace"""
+        return [span.to_dict() for span in list(self._spans) if trace_id is None or span.context.trace_id == trace_id]
+
+    def clear(self):
+        self._spans.clear()
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends finished spans to a file, one JSON object per line. Spans are
+    queued and serialized and written by a background thread, so the event
+    loop never waits on the disk; they are dropped when the queue is full
+    """
+
+    def __init__(self, file_path: str, max_queued: int = 100000):
+        self.file_path = file_path
+        self.dropped = 0
+        self._file = open(file_path, 'a')
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._thread = threading.Thread(target=self._write_spans, name='span-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_spans(self):
+        while True:
+            span = self._queue.get()
+            # Write every span waiting at once, flushing once per batch
+            while span is not None:
+                self._file.write(json.dumps(span.to_dict(), default=str) + '\n')
+                try:
+                    span = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._file.flush()
+            if span is None:
+                return
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+class Tracer:
+    """Creates spans, sampling new traces at sample_rate and following the decision of remote parents"""
+
+    def __init__(self, sample_rate: float = 0.0, exporter: Optional[SpanExporter] = None):
+        self.configure(sample_rate, exporter)
+
+    def configure(self, sample_rate: float, exporter: Optional[SpanExporter]):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.enabled = sample_rate > 0 and exporter is not None
+
+    def start_span(
+        self,
+        name: str,
+        traceparent: Optional[str] = None,
+        root: bool = False,
+        attributes: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Start a span, a child of the remote traceparent if given, else of the
+        current span unless root is set. Use it as a context manager to make it
+        the current span and end it on exit
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+
+        if traceparent:
+            parent = parse_traceparent(traceparent)
+        elif root:
+            parent = None
+        else:
+            current = _current_span.get()
+            parent = current.context if current is not None else None
+        if parent is not None:
+            if not parent.sampled:
+                return _NonRecordingSpan(parent)
+            trace_id = parent.trace_id
+        elif random.random() < self.sample_rate:
+            trace_id = f"{random.getrandbits(128):032x}"
+        else:
+            return NOOP_SPAN
+
+        context = SpanContext(trace_id, f"{random.getrandbits(64):016x}")
+        return Span(self, name, context, parent.span_id if parent is not None else None, attributes or {})
+
+    def shutdown(self):
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+TRACER = Tracer()
+
+def configure_tracing(
+    sample_rate: float,
+    exporter: str = 'memory',
+    file_path: Optional[str] = None,
+    max_spans: int = 10000
+) -> Tracer:
+    """Configure the global tracer, a sample rate of 0 disables tracing"""
+    if sample_rate <= 0:
+        TRACER.configure(0.0, None)
+    elif exporter == 'file':
+        if not file_path:
+            raise ValueError("A file path is required for the file span exporter")
+        TRACER.configure(sample_rate, FileSpanExporter(file_path))
+    else:
+        TRACER.configure(sample_rate, InMemorySpanExporter(max_spans))
+    if TRACER.enabled:
+        logger.info(f"Tracing enabled, sampling {sample_rate:.0%} of new traces to the {exporter} exporter")
+    return TRACER
@@ -1,15 +1,33 @@
 import asyncio
-import json
 import logging
+import math
+import time
 import uuid
-from typing import Optional, Dict, Any
-from aiohttp import web
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from aiohttp import WSCloseCode, web
 
-from ..models import HTTPRequest, HTTPResponse, MQTTRequest, MQTTResponse
+from ..models import RequestRecord, ResponseRecord
 from ..services import MQTTServiceManager
+from ..utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_ROUND_TRIP, METRICS
+from ..utils.tracing import TRACEPARENT, TRACER, InMemorySpanExporter
+from ..serialization import Codec, JSON_CODEC, get_codec_for_content_type, negotiate_codec
+from .websocket import WebSocketSession
 
 logger = logging.getLogger(__name__)
 
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+SSE_CONTENT_TYPE = 'text/event-stream'
+
+# Defaults of the batch endpoint, in seconds
+BATCH_ITEM_TIMEOUT = 30.0
+BATCH_DEADLINE = 60.0
+
+# Default time a streamed request stays open, in seconds
+STREAM_TIMEOUT = 30.0
+
+# Interval of the WebSocket pings detecting dead connections, in seconds
+WS_HEARTBEAT = 30.0
+
 class WebServer:
     """
     HTTP Web server that adapts HTTP requests to MQTT requests
@@ -20,12 +38,25 @@ class WebServer:
         mqtt_manager: MQTTServiceManager, 
         loop: Optional[asyncio.AbstractEventLoop] = None,
         host: str = '0.0.0.0',
-        port: int = 8080
+        port: int = 8080,
+        reuse_port: bool = False,
+        max_batch_items: int = 1000,
+        batch_concurrency: int = 100,
+        stream_buffer_size: int = 100,
+        ws_max_inflight: int = 100,
+        ws_send_queue_size: int = 256
     ):
         self.mqtt_manager = mqtt_manager
         self.loop = loop or asyncio.get_event_loop()
         self.host = host
         self.port = port
+        self.reuse_port = reuse_port
+        self.max_batch_items = max_batch_items
+        self.batch_concurrency = batch_concurrency
+        self.stream_buffer_size = stream_buffer_size
+        self.ws_max_inflight = ws_max_inflight
+        self.ws_send_queue_size = ws_send_queue_size
+        self._websockets = set()
         self.app = web.Application()
         self.runner = None
         self.site = None
@@ -33,8 +64,12 @@ class WebServer:
     
     def _setup_routes(self):
         """Setup the routes for the web server"""
+        self.app.router.add_post('/api/batch', self.handle_batch_request)
         self.app.router.add_post('/api/{identifier}/{request_topic:.*}', self.handle_api_request)
+        self.app.router.add_get('/ws', self.handle_websocket)
         self.app.router.add_get('/health', self.handle_health_check)
+        self.app.router.add_get('/metrics', self.handle_metrics)
+        self.app.router.add_get('/traces', self.handle_traces)
     
     async def start(self):
         """Start the web server"""
@@ -43,7 +78,8 @@ class WebServer:
         self.runner = web.AppRunner(self.app)
         await self.runner.setup()
         
-        self.site = web.TCPSite(self.runner, self.host, self.port)
+        # With reuse_port several worker processes can bind the same port
+        self.site = web.TCPSite(self.runner, self.host, self.port, reuse_port=self.reuse_port or None)
         await self.site.start()
         
         logger.info(f"Web server started on http://{self.host}:{self.port}")
@@ -52,6 +88,10 @@ class WebServer:
         """Stop the web server"""
         logger.info("Shutting down web server")
         
+        # Tell WebSocket clients to reconnect elsewhere
+        for session in list(self._websockets):
+            await session.ws.close(code=WSCloseCode.GOING_AWAY, message=b'Server shutdown')
+        
         if self.site:
             await self.site.stop()
         
@@ -65,110 +105,406 @@ class WebServer:
         return web.json_response({
             "status": "ok",
             "service": "mqtt-adapter",
-            "brokers": self.mqtt_manager.registry.list_protocols()
+            "brokers": self.mqtt_manager.registry.list_protocols(),
+            "connections": self.mqtt_manager.get_connection_stats(),
+            "pending_requests": self.mqtt_manager.get_pending_stats(),
+            "admission": self.mqtt_manager.get_admission_stats(),
+            "spool": self.mqtt_manager.get_spool_stats(),
+            "dedup": self.mqtt_manager.get_dedup_stats(),
+            "response_cache": self.mqtt_manager.get_response_cache_stats(),
+            "websockets": len(self._websockets)
         })
     
+    async def handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        """Serve a WebSocket client multiplexing requests and topic subscriptions"""
+        ws = web.WebSocketResponse(heartbeat=WS_HEARTBEAT)
+        await ws.prepare(request)
+        
+        session = WebSocketSession(self, ws, self.ws_max_inflight, self.ws_send_queue_size)
+        self._websockets.add(session)
+        try:
+            await session.run()
+        finally:
+            self._websockets.discard(session)
+        return ws
+    
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Expose the metrics in the Prometheus text format"""
+        return web.Response(body=METRICS.render().encode('utf-8'), headers={"Content-Type": METRICS_CONTENT_TYPE})
+    
+    async def handle_traces(self, request: web.Request) -> web.Response:
+        """Get the spans kept by the in-memory exporter, optionally only those of ?trace_id="""
+        if not isinstance(TRACER.exporter, InMemorySpanExporter):
+            raise web.HTTPNotFound(text="In-memory tracing is not enabled")
+        return web.json_response({"spans": TRACER.exporter.get_spans(request.query.get('trace_id'))})
+    
     async def handle_api_request(self, request: web.Request) -> web.Response:
         """Handle API requests by converting them to MQTT requests"""
+        started = time.perf_counter()
+        identifier = request.match_info['identifier']
         try:
-            # Extract broker ID and topic from URL
-            identifier = request.match_info['identifier']
+            with TRACER.start_span('http.request', traceparent=request.headers.get(TRACEPARENT), root=True) as span:
+                span.set_attribute('http.target', request.path)
+                response = await self._handle_api_request(request, identifier)
+                span.set_attribute('http.status_code', response.status)
+                if span.traceparent and not response.prepared:
+                    # Let the client look up the trace
+                    response.headers[TRACEPARENT] = span.traceparent
+                return response
+        finally:
+            # Only known brokers get a series, so clients can not create arbitrary labels
+            if identifier in self.mqtt_manager.protocols:
+                HTTP_ROUND_TRIP.labels(identifier).observe(time.perf_counter() - started)
+    
+    async def _handle_api_request(self, request: web.Request, identifier: str) -> web.StreamResponse:
+        """Convert the HTTP request to an MQTT request, route it and convert the response back"""
+        try:
+            # Extract the topic from URL
             request_topic = request.match_info['request_topic']
             
-            # Read request body
-            body = await request.json() if request.has_body else {}
-            
-            # Extract headers
-            headers = dict(request.headers)
+            # Read request body with the codec of its Content-Type, JSON by default
+            request_codec = get_codec_for_content_type(request.headers.get('Content-Type'), JSON_CODEC)
+            body = request_codec.decode(await request.read()) if request.has_body else {}
             
-            # Create HTTP request model
-            http_request = HTTPRequest(
-                method=request.method,
-                path=request.path,
-                headers=headers,
-                body=body,
-                identifier=identifier,
-                request_topic=request_topic
-            )
+            # Encode the response in the format asked for by Accept
+            response_codec = negotiate_codec(request.headers.get('Accept'), JSON_CODEC)
             
             # Convert to MQTT request
-            mqtt_request = await self._convert_to_mqtt_request(http_request)
+            mqtt_request = self._convert_to_mqtt_request(request, identifier, request_topic, body)
+            
+            # Requests accepting NDJSON or Server-Sent Events get every response
+            stream_type = self._negotiate_stream(request.headers.get('Accept')) if mqtt_request.is_response else None
+            if stream_type is not None:
+                return await self._stream_responses(request, mqtt_request, stream_type)
             
             # Route the request to the MQTT manager
             mqtt_response = await self.mqtt_manager.route_request(mqtt_request)
             
             if mqtt_response is not None:
                 # Convert back to HTTP response
-                http_response = await self._convert_to_http_response(mqtt_response)
-            
-                # Remove Content-Type from headers since json_response will set it automatically
-                headers = dict(http_response.headers)
-                headers.pop('Content-Type', None)
-                
-                # Convert body to JSON string if it's a dict
-                body = json.dumps(http_response.body) if isinstance(http_response.body, (dict, list)) else http_response.body
-                
-                return web.json_response(
-                    body,
-                    status=http_response.status_code,
-                    headers=headers
-                )
+                return self._convert_to_http_response(mqtt_response, response_codec)
             else:
-                return web.json_response(
-                    {"success": True},
-                    status=200
+                return web.Response(
+                    body=response_codec.encode({"success": True}),
+                    status=200,
+                    content_type=response_codec.content_type
                 )
             
         except web.HTTPError as e:
             # Handle HTTP errors
             return web.json_response(
-                {"error": str(e)},
+                {"error": e.text},
                 status=e.status
             )
         except Exception as e:
             # Handle other errors
-            logger.error(f"Error handling request: {str(e)}", exc_info=True)
+            logger.error("Error handling request: %s", e, exc_info=True)
             return web.json_response(
                 {"error": str(e)},
                 status=500
             )
     
-    async def _convert_to_mqtt_request(self, http_request: HTTPRequest) -> MQTTRequest:
-        """Convert an HTTP request to an MQTT request"""
+    def _negotiate_stream(self, accept: Optional[str]) -> Optional[str]:
+        """Get the streaming content type asked for by Accept, None for a single response"""
+        if not accept:
+            return None
+        for content_type in (NDJSON_CONTENT_TYPE, SSE_CONTENT_TYPE):
+            if content_type in accept:
+                return content_type
+        return None
+    
+    async def _stream_responses(
+        self,
+        request: web.Request,
+        mqtt_request: RequestRecord,
+        stream_type: str
+    ) -> web.StreamResponse:
+        """
+        Stream every response to the request, as NDJSON lines or Server-Sent
+        Events, until ?max_replies= responses, a response marked final or the
+        ?timeout= (seconds) is reached. The last line or ``end`` event tells
+        why the stream ended and how many responses were dropped because the
+        client read too slowly
+        """
+        try:
+            timeout = float(request.query.get('timeout', STREAM_TIMEOUT))
+            max_replies = int(request.query['max_replies']) if 'max_replies' in request.query else None
+        except ValueError:
+            raise web.HTTPBadRequest(text="timeout and max_replies must be numbers")
+        if timeout <= 0 or (max_replies is not None and max_replies <= 0):
+            raise web.HTTPBadRequest(text="timeout and max_replies must be positive")
+        
+        async with self.mqtt_manager.open_stream(mqtt_request, timeout, max_replies, self.stream_buffer_size) as stream:
+            if isinstance(stream, ResponseRecord):
+                return self._convert_to_http_response(stream)
+            
+            response = web.StreamResponse(headers={
+                "Content-Type": stream_type,
+                "Cache-Control": "no-cache",
+                "X-Correlation-ID": stream.correlation_id
+            })
+            await response.prepare(request)
+            index = 0
+            try:
+                async for reply in stream:
+                    entry = {"index": index, **self._response_entry(reply, stream.correlation_id)}
+                    await response.write(self._stream_event(stream_type, 'reply', entry, index))
+                    index += 1
+                summary = {"done": True, "reason": stream.reason, "replies": stream.received, "dropped": stream.dropped}
+                await response.write(self._stream_event(stream_type, 'end', summary))
+                await response.write_eof()
+            except ConnectionResetError:
+                logger.debug("Client went away while streaming responses for correlation ID: %s", stream.correlation_id)
+            return response
+    
+    def _stream_event(self, stream_type: str, event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> bytes:
+        """Encode one streamed entry as an NDJSON line or a Server-Sent Event"""
+        encoded = JSON_CODEC.encode(data)
+        if stream_type == NDJSON_CONTENT_TYPE:
+            return encoded + b'\n'
+        prefix = f"id: {event_id}\n" if event_id is not None else ""
+        return f"{prefix}event: {event}\ndata: ".encode('utf-8') + encoded + b'\n\n'
+    
+    async def handle_batch_request(self, request: web.Request) -> web.StreamResponse:
+        """
+        Route many requests given in one body, possibly to different brokers.
+
+        The body is a list of items, or an object with ``items`` and the
+        optional ``timeout`` (default for the items), ``deadline`` (for the
+        whole batch) and ``stream`` settings. Each item has ``identifier``,
+        ``topic``, ``payload``, ``is_request`` and optionally
+        ``correlation_id`` and ``timeout``.
+
+        The results are returned together in submission order, or streamed
+        as NDJSON lines in completion order when ``stream`` is set or
+        ``Accept`` asks for NDJSON. Items not finished at the deadline get 504.
+        """
+        with TRACER.start_span('http.batch', traceparent=request.headers.get(TRACEPARENT), root=True) as span:
+            try:
+                codec = get_codec_for_content_type(request.headers.get('Content-Type'), JSON_CODEC)
+                body = codec.decode(await request.read()) if request.has_body else None
+            except Exception as e:
+                return web.json_response({"error": f"Invalid request body: {e}"}, status=400)
+            try:
+                items, timeout, deadline, stream = self._parse_batch(body)
+            except web.HTTPError as e:
+                return web.json_response({"error": e.text}, status=e.status)
+            stream = stream or NDJSON_CONTENT_TYPE in request.headers.get('Accept', '')
+            span.set_attribute('batch.items', len(items))
+
+            results = self._run_batch(items, timeout, deadline)
+            # Close the generator right away if the client goes away, cancelling the requests in flight
+            try:
+                if stream:
+                    response = web.StreamResponse(headers={"Content-Type": NDJSON_CONTENT_TYPE})
+                    await response.prepare(request)
+                    async for index, result in results:
+                        await response.write(JSON_CODEC.encode({"index": index, **result}) + b'\n')
+                    await response.write_eof()
+                    return response
+
+                ordered: List[Optional[Dict[str, Any]]] = [None] * len(items)
+                async for index, result in results:
+                    ordered[index] = result
+            finally:
+                await results.aclose()
+            response_codec = negotiate_codec(request.headers.get('Accept'), JSON_CODEC)
+            return web.Response(
+                body=response_codec.encode({"results": ordered}),
+                content_type=response_codec.content_type
+            )
+    
+    def _parse_batch(self, body: Any) -> Tuple[List[Any], float, float, bool]:
+        """
+        Validate a batch body. Returns one RequestRecord and timeout pair per
+        valid item, or the 400 result of an invalid item, with the default item
+        timeout, the deadline and the stream flag
+        """
+        options: Dict[str, Any] = {}
+        if isinstance(body, dict):
+            options, body = body, body.get('items')
+        if not isinstance(body, list):
+            raise web.HTTPBadRequest(text="Batch body must be a list of items or an object with items")
+        if len(body) > self.max_batch_items:
+            raise web.HTTPRequestEntityTooLarge(
+                max_size=self.max_batch_items, actual_size=len(body),
+                text=f"Too many items in batch ({len(body)} > {self.max_batch_items})"
+            )
+        try:
+            timeout = float(options.get('timeout', BATCH_ITEM_TIMEOUT))
+            deadline = float(options.get('deadline', BATCH_DEADLINE))
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text="Batch timeout and deadline must be numbers")
+        if timeout <= 0 or deadline <= 0:
+            raise web.HTTPBadRequest(text="Batch timeout and deadline must be positive")
+        
+        items: List[Any] = []
+        correlation_ids = set()
+        for item in body:
+            correlation_id = (item.get('correlation_id') if isinstance(item, dict) else None) or str(uuid.uuid4())
+            error = self._validate_item(item, timeout)
+            if error is None and correlation_id in correlation_ids:
+                # Responses are matched by correlation ID, a duplicate would replace the first request
+                error = f"Duplicate correlation ID: {correlation_id}"
+            correlation_ids.add(correlation_id)
+            
+            if error is not None:
+                items.append(ResponseRecord(status_code=400, payload={"error": error}, correlation_id=correlation_id))
+                continue
+            items.append((self._item_to_record(item, correlation_id), float(item.get('timeout', timeout))))
+        return items, timeout, deadline, bool(options.get('stream', False))
+    
+    def _validate_item(self, item: Any, timeout: float) -> Optional[str]:
+        """Check a request item of the batch or WebSocket API, returning the error if it is invalid"""
+        if not isinstance(item, dict):
+            return "Item must be an object"
+        identifier = item.get('identifier')
+        if isinstance(identifier, list):
+            # Fan out to a list of brokers
+            if not identifier or not all(isinstance(broker_id, str) for broker_id in identifier):
+                return "Item identifier must be a string or a list of strings"
+        elif not isinstance(identifier, str):
+            return "Item identifier and topic must be strings"
+        if not isinstance(item.get('topic'), str):
+            return "Item identifier and topic must be strings"
+        if not isinstance(item.get('payload', {}), dict):
+            return "Item payload must be an object"
+        if not isinstance(item.get('timeout', timeout), (int, float)) or item.get('timeout', timeout) <= 0:
+            return "Item timeout must be a positive number"
+        return None
+    
+    def _item_to_record(self, item: Dict[str, Any], correlation_id: str) -> RequestRecord:
+        """Convert a validated request item to the record routed to the broker"""
+        return RequestRecord(
+            topic=item['topic'],
+            payload=item.get('payload', {}),
+            correlation_id=correlation_id,
+            target_broker_id=item['identifier'],
+            is_response=bool(item.get('is_request', False))
+        )
+    
+    async def _run_batch(
+        self,
+        items: List[Any],
+        timeout: float,
+        deadline: float
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Route the batch items concurrently and yield (index, result) as they complete"""
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + deadline
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        
+        async def route(record: RequestRecord, item_timeout: float) -> Dict[str, Any]:
+            async with semaphore:
+                # Never wait for a response past the batch deadline
+                remaining = deadline_at - loop.time()
+                response = await self.mqtt_manager.route_request(record, timeout=min(item_timeout, remaining))
+            return self._response_entry(response, record.correlation_id)
+        
+        tasks: Dict[asyncio.Future, int] = {}
+        for index, item in enumerate(items):
+            if isinstance(item, ResponseRecord):
+                yield index, self._response_entry(item, item.correlation_id)
+            else:
+                tasks[asyncio.ensure_future(route(*item))] = index
+        
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline_at - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    yield tasks[task], task.result()
+            for task in pending:
+                task.cancel()
+                correlation_id = items[tasks[task]][0].correlation_id
+                yield tasks[task], self._response_entry(
+                    ResponseRecord(status_code=504, payload={"error": "Batch deadline exceeded"}, correlation_id=correlation_id),
+                    correlation_id
+                )
+        finally:
+            # The client went away or the deadline passed, stop the remaining requests
+            for task in pending:
+                task.cancel()
+    
+    def _response_entry(self, response: Optional[ResponseRecord], correlation_id: str) -> Dict[str, Any]:
+        """Convert the response to a batch item or a streamed request to its entry in the results"""
+        if response is None:
+            return {"status_code": 200, "correlation_id": correlation_id, "payload": {"success": True}}
+        payload = response.payload
+        if response.raw_payload is not None:
+            codec = get_codec_for_content_type(response.content_type, JSON_CODEC)
+            try:
+                payload = codec.decode(response.raw_payload)
+            except Exception:
+                payload = bytes(response.raw_payload).decode('utf-8', errors='replace')
+        return {"status_code": response.status_code, "correlation_id": response.correlation_id, "payload": payload}
+    
+    def _convert_to_mqtt_request(
+        self, 
+        request: web.Request, 
+        identifier: str, 
+        request_topic: str, 
+        body: Any
+    ) -> RequestRecord:
+        """Convert an HTTP request to an MQTT request, validating the body"""
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="Request body must be an object")
+        
         # Generate a correlation ID if not provided
-        correlation_id = http_request.headers.get('X-Correlation-ID', str(uuid.uuid4()))
+        correlation_id = request.headers.get('X-Correlation-ID') or str(uuid.uuid4())
         
         # Extract any additional MQTT-specific parameters from the body or headers
-        payload: Dict[str, Any] = http_request.body.get('payload', {})
-        is_response: bool = http_request.body.get('is_request', False)
-        if 'headers' in http_request.body:
+        payload: Dict[str, Any] = body.get('payload', {})
+        if not isinstance(payload, dict):
+            raise web.HTTPBadRequest(text="Request payload must be an object")
+        is_response: bool = bool(body.get('is_request', False))
+        if 'headers' in body:
             # Remove any headers that were moved to the body to avoid duplication
-            for header in http_request.body['headers']:
+            for header in body['headers']:
                 if header in payload:
-                    logger.warning(f"Header '{header}' appears both in headers and payload, using payload value")
+                    logger.warning("Header '%s' appears both in headers and payload, using payload value", header)
         
-        return MQTTRequest(
-            topic=http_request.request_topic,
+        return RequestRecord(
+            topic=request_topic,
+            payload=payload,
             correlation_id=correlation_id,
-            target_broker_id=http_request.identifier,
-            is_response=is_response,
-            payload=payload
+            target_broker_id=identifier,
+            is_response=is_response
         )
     
-    async def _convert_to_http_response(self, mqtt_response: MQTTResponse) -> HTTPResponse:
-        """Convert an MQTT response to an HTTP response"""
+    def _convert_to_http_response(self, mqtt_response: ResponseRecord, codec: Codec = JSON_CODEC) -> web.Response:
+        """Convert an MQTT response to an HTTP response, serializing the payload exactly once"""
         # Set appropriate HTTP status code based on MQTT response code
         # Map MQTT status codes to HTTP status codes if needed
         status_code = mqtt_response.status_code
         
-        # Set up response headers
+        # Set up response headers, Content-Type is set from content_type
         headers = {
-            "X-Correlation-ID": mqtt_response.correlation_id,
-            "Content-Type": "application/json"
+            "X-Correlation-ID": mqtt_response.correlation_id
         }
         
-        return HTTPResponse(
-            status_code=status_code,
+        # Tell clients refused by admission control when to come back
+        if status_code in (429, 503) and isinstance(mqtt_response.payload, dict) and 'retry_after' in mqtt_response.payload:
+            headers["Retry-After"] = str(max(1, math.ceil(mqtt_response.payload['retry_after'])))
+        
+        # Pass the broker payload through unchanged when it is already in the
+        # requested format, otherwise encode it exactly once
+        if mqtt_response.raw_payload is not None:
+            raw_codec = get_codec_for_content_type(mqtt_response.content_type, JSON_CODEC)
+            if raw_codec is codec:
+                body = mqtt_response.raw_payload
+            else:
+                body = codec.encode(raw_codec.decode(mqtt_response.raw_payload))
+        else:
+            body = codec.encode(mqtt_response.payload)
+        
+        return web.Response(
+            body=body,
+            status=status_code,
             headers=headers,
-            body=mqtt_response.payload
-        ) 
\ No newline at end of file
+            content_type=codec.content_type
+        )
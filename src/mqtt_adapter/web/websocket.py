@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from aiohttp import WSMsgType, web
+
+from ..protocols.routing import validate_topic_filter
+from ..serialization import JSON_CODEC
+
+logger = logging.getLogger(__name__)
+
+# Response timeout of WebSocket requests that do not set one, in seconds
+WS_REQUEST_TIMEOUT = 30.0
+
+class WebSocketSession:
+    """
+    One client connection of the WebSocket gateway.
+
+    Frames are JSON objects with a ``type`` and an ``id`` chosen by the client,
+    echoed in the answer:
+
+    * ``request`` with ``identifier``, ``topic``, ``payload``, ``is_request``
+      and optionally ``correlation_id`` and ``timeout``, answered by a
+      ``response`` frame once the broker replied (or right after publishing
+      when ``is_request`` is false). Many requests can be in flight at once.
+    * ``subscribe`` with ``identifier`` and a ``topic`` filter (``+`` and ``#``
+      wildcards allowed), answered by ``subscribed`` with a ``subscription``
+      ID, after which every matching message is pushed as a ``message`` frame.
+    * ``unsubscribe`` with the ``subscription`` ID, answered by ``unsubscribed``.
+
+    Backpressure is applied per connection: with ``max_inflight`` requests in
+    flight the session stops reading frames until one completes, and frames
+    are sent through a queue of ``send_queue_size``. Responses wait for room
+    in the queue, pushed messages that do not fit are dropped and counted in
+    a ``dropped`` frame.
+    """
+
+    def __init__(self, server: 'WebServer', ws: web.WebSocketResponse, max_inflight: int = 100, send_queue_size: int = 256):
+        self.server = server
+        self.mqtt_manager = server.mqtt_manager
+        self.ws = ws
+        self.dropped = 0
+        self._dropped_unreported = 0
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._tasks: Set[asyncio.Task] = set()
+        self._correlation_ids: Set[str] = set()
+        self._outbox: asyncio.Queue = asyncio.Queue(send_queue_size)
+        self._subscriptions: Dict[str, Tuple[str, str, Callable[[str, Any], None]]] = {}
+        self._next_subscription = 0
+
+    async def run(self):
+        """Serve the connection until the client closes it"""
+        writer = asyncio.ensure_future(self._write_loop())
+        try:
+            async for message in self.ws:
+                if message.type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    await self._handle_frame(message.data)
+                elif message.type == WSMsgType.ERROR:
+                    logger.warning("WebSocket connection closed with error: %s", self.ws.exception())
+        finally:
+            for subscription_id in list(self._subscriptions):
+                self._unsubscribe(subscription_id)
+            for task in list(self._tasks):
+                task.cancel()
+            writer.cancel()
+            await asyncio.gather(writer, *self._tasks, return_exceptions=True)
+
+    async def _handle_frame(self, data: Any):
+        try:
+            frame = JSON_CODEC.decode(data)
+        except Exception as e:
+            await self._send({"type": "error", "status_code": 400, "error": f"Invalid frame: {e}"})
+            return
+        if not isinstance(frame, dict):
+            await self._send({"type": "error", "status_code": 400, "error": "Frame must be an object"})
+            return
+
+        frame_type = frame.get('type')
+        if frame_type == 'request':
+            await self._start_request(frame)
+        elif frame_type == 'subscribe':
+            await self._subscribe(frame)
+        elif frame_type == 'unsubscribe':
+            subscription_id = str(frame.get('subscription'))
+            if self._unsubscribe(subscription_id):
+                await self._send({"type": "unsubscribed", "id": frame.get('id'), "subscription": subscription_id})
+            else:
+                await self._send_error(frame, 404, f"Subscription not found: {subscription_id}")
+        else:
+            await self._send_error(frame, 400, f"Unknown frame type: {frame_type}")
+
+    async def _start_request(self, frame: Dict[str, Any]):
+        correlation_id = frame.get('correlation_id') or str(uuid.uuid4())
+        error = self.server._validate_item(frame, WS_REQUEST_TIMEOUT)
+        if error is None and correlation_id in self._correlation_ids:
+            # Responses are matched by correlation ID, a duplicate would replace the first request
+            error = f"Duplicate correlation ID: {correlation_id}"
+        if error is not None:
+            await self._send({
+                "type": "response", "id": frame.get('id'), "status_code": 400,
+                "correlation_id": correlation_id, "payload": {"error": error}
+            })
+            return
+
+        # Stop reading frames while the connection has too many requests in flight
+        await self._inflight.acquire()
+        self._correlation_ids.add(correlation_id)
+        record = self.server._item_to_record(frame, correlation_id)
+        task = asyncio.ensure_future(self._request(frame.get('id'), record, float(frame.get('timeout', WS_REQUEST_TIMEOUT))))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _request(self, frame_id: Any, record, timeout: float):
+        try:
+            response = await self.mqtt_manager.route_request(record, timeout=timeout)
+            await self._send({"type": "response", "id": frame_id, **self.server._response_entry(response, record.correlation_id)})
+        finally:
+            self._correlation_ids.discard(record.correlation_id)
+            self._inflight.release()
+
+    async def _subscribe(self, frame: Dict[str, Any]):
+        identifier, topic_filter = frame.get('identifier'), frame.get('topic')
+        try:
+            if not isinstance(identifier, str) or not isinstance(topic_filter, str):
+                raise ValueError("Subscription needs a broker identifier and a topic filter")
+            if topic_filter.startswith('$share/'):
+                # Listeners get every matching message, shared subscriptions would split them
+                raise ValueError("Shared subscriptions are not supported")
+            validate_topic_filter(topic_filter)
+        except ValueError as e:
+            await self._send_error(frame, 400, str(e))
+            return
+
+        self._next_subscription += 1
+        subscription_id = str(self._next_subscription)
+
+        def callback(topic: str, payload: Any):
+            self._push({"type": "message", "subscription": subscription_id, "identifier": identifier, "topic": topic, "payload": payload})
+
+        try:
+            self.mqtt_manager.add_listener(identifier, topic_filter, callback)
+        except KeyError as e:
+            await self._send_error(frame, 404, e.args[0])
+            return
+        self._subscriptions[subscription_id] = (identifier, topic_filter, callback)
+        await self._send({"type": "subscribed", "id": frame.get('id'), "subscription": subscription_id})
+
+    def _unsubscribe(self, subscription_id: Optional[str]) -> bool:
+        subscription = self._subscriptions.pop(subscription_id, None)
+        if subscription is None:
+            return False
+        self.mqtt_manager.remove_listener(*subscription)
+        return True
+
+    async def _send_error(self, frame: Dict[str, Any], status_code: int, error: str):
+        await self._send({"type": "error", "id": frame.get('id'), "status_code": status_code, "error": error})
+
+    async def _send(self, frame: Dict[str, Any]):
+        """Queue a frame, waiting for room in the send queue"""
+        await self._outbox.put(frame)
+
+    def _push(self, frame: Dict[str, Any]):
+        """Queue a pushed message, dropping it if the client is not keeping up"""
+        try:
+            self._outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self._dropped_unreported += 1
+
+    async def _write_loop(self):
+        while True:
+            frame = await self._outbox.get()
+            try:
+                data = JSON_CODEC.encode(frame)
+            except (TypeError, ValueError):
+                # Payloads decoded by a binary codec may hold values JSON can not represent
+                data = JSON_CODEC.encode({**frame, "payload": repr(frame.get('payload'))})
+            await self.ws.send_str(data.decode('utf-8'))
+            if self._dropped_unreported:
+                count, self._dropped_unreported = self._dropped_unreported, 0
+                await self.ws.send_str(JSON_CODEC.encode({"type": "dropped", "count": count}).decode('utf-8'))
@@ -0,0 +1,72 @@
+"""
+Shared driver of the HTTP to MQTT tools (http_to_mqtt_rrp.py and http_to_mqtt_ffg.py), sending messages
+through the adapter HTTP API with the adapter client SDK (mqtt_adapter.client).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqtt_adapter.client import AdapterCall, AdapterClient
+
+logger = logging.getLogger(__name__)
+
+def parse_args(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--url", default="http://localhost:8080", help="Adapter base URL")
+    parser.add_argument("--broker", default="internet 2", help="Identifier of the target broker")
+    parser.add_argument("--topic", help="MQTT topic, requests/<broker> by default")
+    parser.add_argument("--count", type=int, default=1, help="Number of messages to send")
+    parser.add_argument("--concurrency", type=int, default=100, help="Maximum HTTP requests in flight")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="Messages per /api/batch request, 0 sends one HTTP request per message")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout of each message in seconds")
+    parser.add_argument("--retries", type=int, default=2, help="Retries of each message")
+    return parser.parse_args()
+
+async def send_messages(args, is_request):
+    topic = args.topic or f"requests/{args.broker}"
+
+    async with AdapterClient(args.url, max_concurrency=args.concurrency, timeout=args.timeout, retries=args.retries) as client:
+        health = await client.health()
+        if health.get("status") != "ok":
+            logger.error(f"Adapter is not healthy: {health}")
+            return
+        logger.info(f"Adapter is running with brokers: {health.get('brokers', [])}")
+
+        calls = (
+            AdapterCall(
+                args.broker,
+                topic,
+                {"message": "Hello from HTTP to MQTT bridge!", "sequence": sequence, "timestamp": time.time()},
+                is_request=is_request
+            )
+            for sequence in range(args.count)
+        )
+
+        started = time.perf_counter()
+        results = await client.batch(calls, batch_size=args.batch_size or None)
+        elapsed = time.perf_counter() - started
+
+    failed = [r for r in results if isinstance(r, Exception) or not r.ok]
+    if args.count == 1:
+        result = results[0]
+        if isinstance(result, Exception):
+            logger.error(f"Request failed: {result}")
+        else:
+            logger.info(f"Status {result.status_code} after {result.elapsed:.3f}s")
+            logger.info(f"Response: {json.dumps(result.payload, indent=2)}")
+    logger.info(f"Sent {args.count} messages in {elapsed:.2f}s ({args.count / elapsed:.0f}/s), {len(failed)} failed")
+
+def run(description, is_request):
+    """Parse the command line and send the messages"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(send_messages(parse_args(description), is_request))
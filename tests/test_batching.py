@@ -0,0 +1,42 @@
+import pytest
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from mqtt_adapter.protocols.batching import BATCH_PREFIX, BatchedMessage, pack_batch, unpack_batch
+
+def message(topic, data, properties=None):
+    return BatchedMessage(topic, data, 1, properties, topic)
+
+def test_batch_envelope_round_trip():
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.ResponseTopic = "replies/1"
+    properties.CorrelationData = b"id-1"
+    messages = [
+        message("a/1", b"one"),
+        message("a/é", b"", properties),
+        message("a/3", bytes(range(256)) * 300),
+    ]
+
+    envelope = pack_batch(messages)
+    assert envelope.startswith(BATCH_PREFIX)
+    unpacked = unpack_batch(envelope)
+
+    assert [(topic, data) for topic, data, _ in unpacked] == [(m.topic, m.data) for m in messages]
+    assert unpacked[0][2] == b"" and unpacked[2][2] == b""
+    decoded = Properties(PacketTypes.PUBLISH)
+    decoded.unpack(unpacked[1][2])
+    assert decoded.ResponseTopic == "replies/1"
+    assert decoded.CorrelationData == b"id-1"
+
+def test_empty_batch_round_trip():
+    assert unpack_batch(pack_batch([])) == []
+
+def test_payload_without_the_prefix_is_rejected():
+    with pytest.raises(ValueError):
+        unpack_batch(b'{"message": "not a batch"}')
+
+@pytest.mark.parametrize("cut", [1, 5, 9])
+def test_truncated_envelope_is_rejected(cut):
+    envelope = pack_batch([message("a/1", b"one"), message("a/2", b"two")])
+    with pytest.raises(ValueError):
+        unpack_batch(envelope[:-cut])
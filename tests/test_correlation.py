@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from mqtt_adapter.protocols.correlation import (
+    OVERFLOW_EVICT_OLDEST,
+    STREAM_DEADLINE,
+    STREAM_EVICTED,
+    CorrelationTable,
+    PendingRequestEvicted,
+    PendingRequestsFull,
+)
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_request_expires_after_its_timeout():
+    async def scenario():
+        table = CorrelationTable(asyncio.get_running_loop(), tick=0.01)
+        future = table.add("a", 0.05)
+        await asyncio.sleep(0.03)
+        assert not future.done()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(future, 1)
+        assert len(table) == 0
+        assert table.get_stats()["expired"] == 1
+    run(scenario())
+
+def test_timeout_longer_than_the_wheel_waits_for_its_rounds():
+    async def scenario():
+        table = CorrelationTable(asyncio.get_running_loop(), tick=0.01, wheel_size=4)
+        future = table.add("a", 0.1)
+        await asyncio.sleep(0.07)
+        assert not future.done()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(future, 1)
+    run(scenario())
+
+def test_resolve_completes_the_request_before_expiry():
+    async def scenario():
+        table = CorrelationTable(asyncio.get_running_loop(), tick=0.01)
+        future = table.add("a", 0.05)
+        assert table.resolve("a", "response")
+        assert await future == "response"
+        assert not table.resolve("a", "late response")
+        await asyncio.sleep(0.1)
+        assert table.get_stats()["expired"] == 0
+    run(scenario())
+
+def test_cancelled_waiter_leaves_the_table():
+    async def scenario():
+        table = CorrelationTable(asyncio.get_running_loop())
+        future = table.add("a", 10)
+        future.cancel()
+        await asyncio.sleep(0)
+        assert "a" not in table
+        assert table.get_stats()["cancelled"] == 1
+    run(scenario())
+
+def test_full_table_rejects_new_requests():
+    async def scenario():
+        table = CorrelationTable(asyncio.get_running_loop(), capacity=1)
+        table.add("a", 10)
+        with pytest.raises(PendingRequestsFull):
+            table.add("b", 10)
+        assert "a" in table
+        assert table.get_stats()["rejected"] == 1
+        table.cancel_all()
+    run(scenario())
+
+def test_full_table_evicts_the_oldest_request():
+    async def scenario():
+        table = CorrelationTable(asyncio.get_running_loop(), capacity=2, overflow_policy=OVERFLOW_EVICT_OLDEST)
+        oldest = table.add("a", 10)
+        stream = table.add_stream("b", 10)
+        table.add("c", 10)
+        with pytest.raises(PendingRequestEvicted):
+            await oldest
+        table.add("d", 10)
+        assert stream.reason == STREAM_EVICTED
+        assert "a" not in table and "b" not in table
+        assert "c" in table and "d" in table
+        assert table.get_stats()["evicted"] == 2
+        table.cancel_all()
+    run(scenario())
+
+def test_reused_correlation_id_replaces_the_request():
+    async def scenario():
+        table = CorrelationTable(asyncio.get_running_loop(), capacity=1)
+        first = table.add("a", 10)
+        second = table.add("a", 10)
+        await asyncio.sleep(0)
+        assert first.cancelled()
+        assert table.resolve("a", "response")
+        assert await second == "response"
+    run(scenario())
+
+def test_stream_ends_at_its_deadline_with_the_replies_received():
+    async def scenario():
+        table = CorrelationTable(asyncio.get_running_loop(), tick=0.01)
+        stream = table.add_stream("a", 0.05)
+        table.resolve("a", 1)
+        table.resolve("a", 2)
+        replies = [reply async for reply in stream]
+        assert replies == [1, 2]
+        assert stream.reason == STREAM_DEADLINE
+        assert len(table) == 0
+    run(scenario())
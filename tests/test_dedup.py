@@ -0,0 +1,63 @@
+import pytest
+
+from mqtt_adapter.models import ResponseRecord
+from mqtt_adapter.protocols.dedup import DedupCache
+
+def test_seen_key_is_a_duplicate():
+    cache = DedupCache(capacity=10)
+    assert cache.add("a") == (False, None)
+    assert cache.add("a") == (True, None)
+    assert cache.get_stats()["hits"] == 1
+
+def test_complete_keeps_the_response_for_duplicates():
+    cache = DedupCache(capacity=10)
+    cache.add("a")
+    response = ResponseRecord(200, {"ok": True}, "a")
+    cache.complete("a", response)
+    assert cache.add("a") == (True, response)
+
+def test_complete_without_response_keeps_the_key_only():
+    cache = DedupCache(capacity=10)
+    cache.add("a")
+    cache.complete("a", None)
+    assert cache.add("a") == (True, None)
+
+@pytest.mark.parametrize("status_code", [408, 429, 500, 503, 504])
+def test_complete_with_a_transient_failure_forgets_the_key(status_code):
+    cache = DedupCache(capacity=10)
+    cache.add("a")
+    cache.complete("a", ResponseRecord(status_code, None, "a"))
+    assert len(cache) == 0
+    assert cache.add("a") == (False, None)
+
+def test_complete_with_a_client_error_keeps_it():
+    cache = DedupCache(capacity=10)
+    cache.add("a")
+    response = ResponseRecord(404, None, "a")
+    cache.complete("a", response)
+    assert cache.add("a") == (True, response)
+
+def test_complete_of_an_unknown_key_is_ignored():
+    cache = DedupCache(capacity=10)
+    cache.complete("a", ResponseRecord(200, None, "a"))
+    assert cache.add("a") == (False, None)
+
+def test_new_key_reusing_a_slot_does_not_get_the_old_response():
+    cache = DedupCache(capacity=1)
+    cache.add("a")
+    cache.complete("a", ResponseRecord(200, None, "a"))
+    assert cache.add("b") == (False, None)
+    assert cache.add("b") == (True, None)
+    assert cache.add("a") == (False, None)
+    assert cache.get_stats()["evicted"] == 2
+
+def test_keys_expire_after_the_ttl():
+    cache = DedupCache(capacity=10, ttl=0)
+    cache.add("a")
+    assert cache.add("a") == (False, None)
+
+def test_discard_forgets_the_key():
+    cache = DedupCache(capacity=10)
+    cache.add("a")
+    cache.discard("a")
+    assert cache.add("a") == (False, None)
@@ -0,0 +1,58 @@
+import pytest
+
+from mqtt_adapter.models import RouteConfig
+from mqtt_adapter.protocols.routing import TopicTrie, compile_route, validate_topic_filter
+
+def route(topic_filter, target_topic=None):
+    return compile_route(RouteConfig(source="edge", topic=topic_filter, target="core", target_topic=target_topic))
+
+def matched(trie, topic):
+    return sorted((route.topic_filter, captures) for route, captures in trie.match(topic))
+
+def test_exact_and_wildcard_filters_match():
+    trie = TopicTrie(route(f) for f in ("a/b/c", "a/+/c", "a/#", "+/b/#", "x/y"))
+    assert matched(trie, "a/b/c") == [
+        ("+/b/#", ("a", "c")),
+        ("a/#", ("b/c",)),
+        ("a/+/c", ("b",)),
+        ("a/b/c", ()),
+    ]
+    assert matched(trie, "x/y") == [("x/y", ())]
+    assert matched(trie, "x/y/z") == []
+    assert matched(trie, "a/b") == [("+/b/#", ("a", "")), ("a/#", ("b",))]
+
+def test_hash_matches_the_parent_level():
+    trie = TopicTrie([route("a/#")])
+    assert matched(trie, "a") == [("a/#", ("",))]
+    assert matched(trie, "ab") == []
+
+def test_plus_matches_exactly_one_level():
+    trie = TopicTrie([route("a/+")])
+    assert matched(trie, "a/b") == [("a/+", ("b",))]
+    assert matched(trie, "a/") == [("a/+", ("",))]
+    assert matched(trie, "a") == []
+    assert matched(trie, "a/b/c") == []
+
+def test_first_level_wildcards_skip_dollar_topics():
+    trie = TopicTrie(route(f) for f in ("#", "+/info", "$SYS/#"))
+    assert matched(trie, "$SYS/info") == [("$SYS/#", ("info",))]
+    assert matched(trie, "broker/info") == [("#", ("broker/info",)), ("+/info", ("broker",))]
+
+def test_routes_sharing_a_filter_all_match():
+    trie = TopicTrie([route("a/+"), route("a/+", "copy/{1}")])
+    assert len(trie.match("a/b")) == 2
+    assert trie.topic_filters == ["a/+"]
+
+def test_target_topic_uses_the_captures():
+    trie = TopicTrie([route("site/+/sensor/#", "core/{1}/{2}/{topic}")])
+    ((matched_route, captures),) = trie.match("site/7/sensor/temp/raw")
+    assert matched_route.target_topic("site/7/sensor/temp/raw", captures) == "core/7/temp/raw/site/7/sensor/temp/raw"
+
+@pytest.mark.parametrize("topic_filter", ["", "a/#/b", "a/b#", "a/+b", "a\0b"])
+def test_invalid_filters_are_rejected(topic_filter):
+    with pytest.raises(ValueError):
+        validate_topic_filter(topic_filter)
+
+def test_template_placeholders_must_exist():
+    with pytest.raises(ValueError):
+        route("a/+", "b/{2}")
@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+from mqtt_adapter.protocols.spool import Spool
+
+def open_spool(directory, **kwargs):
+    spool = Spool(str(directory), **kwargs)
+    spool.open()
+    return spool
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.seg'))
+
+def replay(spool, batch_size=100):
+    """Read and commit everything left in the spool"""
+    messages = []
+    while True:
+        batch = spool.read(batch_size)
+        if batch is None:
+            return messages
+        messages.extend(batch.messages)
+        spool.commit(batch)
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_messages_are_replayed_in_order(tmp_path, use_mmap):
+    spool = open_spool(tmp_path, use_mmap=use_mmap)
+    spool.append("a/1", b"one", 1, b"\x01\x02")
+    spool.append("a/2", b"two", 0)
+    assert spool.pending == 2
+
+    first, second = replay(spool)
+    assert (first.topic, first.data, first.qos, first.properties) == ("a/1", b"one", 1, b"\x01\x02")
+    assert (second.topic, second.data, second.qos, second.properties) == ("a/2", b"two", 0, None)
+    assert spool.pending == 0
+    assert spool.read(10) is None
+    spool.close()
+
+def test_offer_spools_only_while_disconnected_or_behind(tmp_path):
+    spool = open_spool(tmp_path)
+    assert not spool.offer("a", b"0", 0, None, connected=True)
+    assert spool.offer("a", b"1", 0, None, connected=False)
+    # Messages keep their order behind the ones waiting for replay
+    assert spool.offer("a", b"2", 0, None, connected=True)
+    assert [m.data for m in replay(spool)] == [b"1", b"2"]
+    spool.close()
+
+def test_reopened_spool_resumes_from_the_cursor(tmp_path):
+    spool = open_spool(tmp_path)
+    for n in range(5):
+        spool.append("a", str(n).encode(), 0)
+    batch = spool.read(2)
+    spool.commit(batch)
+    # Read but not committed, so replayed again after the restart
+    spool.read(2)
+    spool.close()
+
+    spool = open_spool(tmp_path)
+    assert spool.pending == 3
+    assert [m.data for m in replay(spool)] == [b"2", b"3", b"4"]
+    spool.close()
+
+def test_corrupt_record_ends_the_segment_on_recovery(tmp_path):
+    spool = open_spool(tmp_path)
+    for n in range(3):
+        spool.append("a", b"payload %d" % n, 0)
+    spool.close()
+
+    (name,) = segments(tmp_path)
+    path = tmp_path / name
+    data = bytearray(path.read_bytes())
+    # Flip the last payload byte, the CRC of the last record no longer matches
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    size = len(data)
+
+    spool = open_spool(tmp_path)
+    assert [m.data for m in replay(spool)] == [b"payload 0", b"payload 1"]
+    assert path.stat().st_size < size
+    spool.close()
+
+def test_torn_write_is_truncated_and_appends_continue(tmp_path):
+    spool = open_spool(tmp_path)
+    spool.append("a", b"kept", 0)
+    spool.append("a", b"torn", 0)
+    spool.close()
+
+    (name,) = segments(tmp_path)
+    path = tmp_path / name
+    path.write_bytes(path.read_bytes()[:-3])
+
+    spool = open_spool(tmp_path)
+    spool.append("a", b"after", 0)
+    assert [m.data for m in replay(spool)] == [b"kept", b"after"]
+    spool.close()
+
+def test_replayed_segments_are_deleted(tmp_path):
+    spool = open_spool(tmp_path, segment_bytes=100)
+    for n in range(10):
+        spool.append("a", b"x" * 40, 0)
+    assert len(segments(tmp_path)) > 1
+    assert len(replay(spool, batch_size=3)) == 10
+    spool.sync()
+    assert len(segments(tmp_path)) == 1
+    spool.close()
+
+def test_oldest_segments_are_dropped_over_max_bytes(tmp_path):
+    spool = open_spool(tmp_path, segment_bytes=100, max_bytes=300)
+    for n in range(20):
+        spool.append("a", b"%02d" % n + b"x" * 38, 0)
+    stats = spool.get_stats()
+    assert stats["bytes"] <= 300
+    assert stats["dropped"] == 20 - stats["messages"]
+    replayed = replay(spool)
+    assert len(replayed) == stats["messages"]
+    assert replayed[-1].data.startswith(b"19")
+    spool.close()
+
+def test_expired_messages_are_skipped(tmp_path):
+    spool = open_spool(tmp_path, max_age=0)
+    spool.append("a", b"old", 0)
+    batch = spool.read(10)
+    assert batch.messages == [] and batch.records == 1
+    spool.commit(batch)
+    assert spool.pending == 0
+    assert spool.dropped == 1
+    spool.close()